@@ -0,0 +1,96 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+Coalescing of alarm state changes from MaaS.
+"""
+from otter.log import log
+from twisted.internet import defer, reactor
+
+
+class AlarmQueue(object):
+    """
+    Collects alarm state changes and processes them in the background.
+
+    A change is held for ``window`` seconds, and any further changes to the
+    same alarm in that time replace it, so a burst of changes to one alarm is
+    processed once with the latest state.  An alarm is never processed twice
+    at once; a change that arrives while its alarm is being processed waits
+    for that to finish.
+
+    :param process: A callable taking an alarm id and state, returning a
+        Deferred that fires once the change has been processed.
+    :param window: How long, in seconds, to wait for further changes.
+    :param clock: An IReactorTime provider.
+    """
+
+    def __init__(self, process, window=5, clock=reactor):
+        self._process = process
+        self._window = window
+        self._clock = clock
+
+        self._pending = {}
+        self._delayed = {}
+        self._processing = {}
+
+        self.received = 0
+        self.coalesced = 0
+        self.processed = 0
+        self.failed = 0
+
+    def add(self, alarm_id, state):
+        """Queue a change of an alarm's state."""
+        self.received += 1
+        if alarm_id in self._pending:
+            self.coalesced += 1
+        self._pending[alarm_id] = state
+        if alarm_id not in self._delayed and alarm_id not in self._processing:
+            self._delayed[alarm_id] = self._clock.callLater(
+                self._window, self._flush, alarm_id)
+
+    def _flush(self, alarm_id):
+        self._delayed.pop(alarm_id, None)
+        state = self._pending.pop(alarm_id)
+        d = defer.maybeDeferred(self._process, alarm_id, state)
+        self._processing[alarm_id] = d
+
+        def processed(result):
+            self.processed += 1
+            return result
+
+        def failed(failure):
+            self.failed += 1
+            log.err(failure, 'Failed to process alarm', alarm_id=alarm_id, state=state)
+
+        def finished(_):
+            del self._processing[alarm_id]
+            if alarm_id in self._pending:
+                self._delayed[alarm_id] = self._clock.callLater(
+                    self._window, self._flush, alarm_id)
+        d.addCallbacks(processed, failed)
+        d.addCallback(finished)
+        return d
+
+    def flush(self):
+        """
+        Process every queued change now, without waiting for its window.
+
+        Changes that arrive while their alarm is being processed are flushed
+        as soon as it is done.
+
+        :return: A Deferred that fires once nothing is queued or being processed.
+        """
+        for alarm_id in self._delayed.keys():
+            self._delayed[alarm_id].cancel()
+            self._flush(alarm_id)
+        if not self._processing:
+            return defer.succeed(None)
+        d = defer.gatherResults(self._processing.values())
+        return d.addCallback(lambda _: self.flush())
+
+    def metrics(self):
+        """Get the number of queued and processing alarms, and counts of changes."""
+        return {'pending': len(self._pending),
+                'processing': len(self._processing),
+                'received': self.received,
+                'coalesced': self.coalesced,
+                'processed': self.processed,
+                'failed': self.failed}
@@ -0,0 +1,127 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+In-process read-through caching of rarely changing Cassandra rows.
+"""
+from collections import OrderedDict
+
+from twisted.internet import defer, reactor
+
+from bobby import cass
+
+
+class TTLCache(object):
+    """
+    A size-capped LRU cache whose entries expire after ``ttl`` seconds.
+
+    Concurrent misses for the same key share a single fetch.
+
+    :param max_size: The most entries to keep; the least recently used are
+        dropped first.
+    :param ttl: How long, in seconds, an entry may be used for.
+    :param clock: An IReactorTime provider.
+    """
+
+    def __init__(self, max_size=1000, ttl=60, clock=reactor):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._fetching = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, fetch):
+        """
+        Get the value for a key, calling ``fetch`` to get it if it isn't cached.
+
+        :param fetch: A callable returning a Deferred that fires with the value.
+        :return: A Deferred that fires with the value.
+        """
+        now = self._clock.seconds()
+        if key in self._entries:
+            value, expires = self._entries.pop(key)
+            if expires > now:
+                self._entries[key] = (value, expires)
+                self.hits += 1
+                return defer.succeed(value)
+
+        if key in self._fetching:
+            self.hits += 1
+            waiter = defer.Deferred()
+            self._fetching[key].append(waiter)
+            return waiter
+
+        self.misses += 1
+        waiters = self._fetching[key] = []
+        d = fetch()
+
+        def store(value):
+            if self._fetching.get(key) is waiters:
+                del self._fetching[key]
+                self._entries[key] = (value, now + self._ttl)
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
+            for waiter in waiters:
+                waiter.callback(value)
+            return value
+
+        def fail(failure):
+            if self._fetching.get(key) is waiters:
+                del self._fetching[key]
+            for waiter in waiters:
+                waiter.errback(failure)
+            return failure
+        return d.addCallbacks(store, fail)
+
+    def invalidate(self, key):
+        """Forget a key, including any fetch of it in progress."""
+        self._entries.pop(key, None)
+        self._fetching.pop(key, None)
+
+    def metrics(self):
+        """Get the cache's size, hits, misses and hit rate."""
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0}
+
+
+class ReadCache(object):
+    """
+    Read-through cache in front of :func:`bobby.cass.get_group_by_id` and
+    :func:`bobby.cass.get_policies_by_group_id`.
+
+    Whatever changes a group or its policies must invalidate them here.
+    """
+
+    def __init__(self, db, max_size=1000, ttl=60, clock=reactor):
+        self._db = db
+        self._groups = TTLCache(max_size, ttl, clock)
+        self._policies = TTLCache(max_size, ttl, clock)
+
+    def get_group_by_id(self, tenant_id, group_id):
+        """Get a group, see :func:`bobby.cass.get_group_by_id`."""
+        return self._groups.get(
+            (tenant_id, group_id),
+            lambda: cass.get_group_by_id(self._db, tenant_id, group_id))
+
+    def get_policies_by_group_id(self, group_id):
+        """Get a group's policies, see :func:`bobby.cass.get_policies_by_group_id`."""
+        return self._policies.get(
+            group_id,
+            lambda: cass.get_policies_by_group_id(self._db, group_id))
+
+    def invalidate_group(self, tenant_id, group_id):
+        """Forget a group and its policies."""
+        self._groups.invalidate((tenant_id, group_id))
+        self._policies.invalidate(group_id)
+
+    def invalidate_policies(self, group_id):
+        """Forget a group's policies."""
+        self._policies.invalidate(group_id)
+
+    def metrics(self):
+        """Get the metrics of the group and policy caches."""
+        return {'groups': self._groups.metrics(),
+                'policies': self._policies.metrics()}
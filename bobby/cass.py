@@ -2,9 +2,18 @@
 """
 Functions for getting data out of Cassandra.
 """
+from functools import partial
+
 from silverberg.client import ConsistencyLevel
 from twisted.internet import defer
 
+from bobby import metrics
+from bobby.metrics import timed
+
+
+MAX_BATCH_SIZE = 50
+PAGE_SIZE = 1000
+
 
 class ExcessiveResultsError(Exception):
     """Exception raised when too many results are found."""
@@ -21,12 +30,87 @@ class ResultNotFoundError(Exception):
             'Result of type "{0}" and id "{1}" not found.'.format(type_string, type_id))
 
 
+class Pages(object):
+    """
+    The rows of one partition, read a page at a time.
+
+    Rows are paged through in clustering-key order: each page after the first
+    asks for the rows whose clustering key is greater than the last one seen,
+    so only one page is ever held in memory.
+
+    :param table: The table to read.
+    :param partition_key: The name of the table's partition key column.
+    :param partition_value: The partition to read.
+    :param clustering_key: The name of the table's clustering key column.
+    :param page_size: The number of rows to read at a time.
+    """
+
+    def __init__(self, db, table, partition_key, partition_value, clustering_key,
+                 page_size=PAGE_SIZE):
+        self._db = db
+        self._table = table
+        self._partition_key = partition_key
+        self._partition_value = partition_value
+        self._clustering_key = clustering_key
+        self._page_size = page_size
+        self._last = None
+        self._done = False
+
+    def next(self):
+        """
+        Read the next page.
+
+        :return: A Deferred that fires with a list of rows, or None once every
+            row has been read.
+        """
+        if self._done:
+            return defer.succeed(None)
+
+        data = {'partition': self._partition_value}
+        query = 'SELECT * FROM {0} WHERE "{1}"=:partition'.format(
+            self._table, self._partition_key)
+        if self._last is not None:
+            query += ' AND "{0}">:after'.format(self._clustering_key)
+            data['after'] = self._last
+        query += ' LIMIT {0};'.format(self._page_size)
+        d = metrics.registry.time('cass', 'page_{0}'.format(self._table),
+                                  self._db.execute, query, data, ConsistencyLevel.ONE)
+
+        def got_page(rows):
+            if len(rows) < self._page_size:
+                self._done = True
+            if not rows:
+                return None
+            self._last = rows[-1][self._clustering_key]
+            return rows
+        return d.addCallback(got_page)
+
+    @defer.inlineCallbacks
+    def each(self, f):
+        """
+        Call ``f`` with each page in turn.
+
+        The next page isn't read until any Deferred returned by ``f`` for the
+        last one has fired.  Pages are handled in a loop rather than by
+        chaining callbacks, so pages read synchronously don't grow the stack.
+
+        :return: A Deferred that fires with None once every page is done.
+        """
+        while True:
+            page = yield self.next()
+            if page is None:
+                break
+            yield f(page)
+
+
+@timed('cass')
 def get_groups_by_tenant_id(db, tenant_id):
     """Get all groups owned by a provided tenant."""
     query = 'SELECT * FROM groups WHERE "tenantId"=:tenantId;'
     return db.execute(query, {'tenantId': tenant_id}, ConsistencyLevel.ONE)
 
 
+@timed('cass')
 def get_group_by_id(db, tenant_id, group_id):
     """Get a group db, by its id."""
     query = 'SELECT * FROM groups WHERE "tenantId"=:tenantId AND "groupId"=:groupId;'
@@ -43,13 +127,19 @@ def get_group_by_id(db, tenant_id, group_id):
     return d.addCallback(return_group)
 
 
-def create_group(db, tenant_id, group_id, notification, notification_plan):
-    """Create a new group and return that new group."""
+@timed('cass')
+def create_group(db, tenant_id, group_id, notification, notification_plan, verify=False):
+    """Create a new group and return that new group.
+
+    The group is built from the inserted values, unless ``verify`` is set, in
+    which case it is read back from Cassandra.
+    """
 
-    query = ' '.join([
-            'INSERT INTO groups',
-            '("tenantId", "groupId", "notification", "notificationPlan")',
-            'VALUES (:tenantId, :groupId, :notification, :notificationPlan);'])
+    query = (
+        'INSERT INTO groups '
+        '("tenantId", "groupId", "notification", "notificationPlan") '
+        'VALUES (:tenantId, :groupId, :notification, :notificationPlan);'
+    )
 
     data = {'groupId': group_id,
             'tenantId': tenant_id,
@@ -59,10 +149,13 @@ def create_group(db, tenant_id, group_id, notification, notification_plan):
     d = db.execute(query, data, ConsistencyLevel.ONE)
 
     def retrieve_new_group(_):
+        if not verify:
+            return data
         return get_group_by_id(db, tenant_id, group_id)
     return d.addCallback(retrieve_new_group)
 
 
+@timed('cass')
 def delete_group(db, tenant_id, group_id):
     """Delete a group."""
     query = 'DELETE FROM groups WHERE "groupId"=:groupId AND "tenantId"=:tenantId;'
@@ -72,6 +165,7 @@ def delete_group(db, tenant_id, group_id):
                       ConsistencyLevel.ONE)
 
 
+@timed('cass')
 def get_servers_by_group_id(db, tenant_id, group_id):
     """Get all servers with a specified groupId."""
     query = 'SELECT * FROM servers WHERE "groupId"=:groupId;'
@@ -80,6 +174,12 @@ def get_servers_by_group_id(db, tenant_id, group_id):
                       ConsistencyLevel.ONE)
 
 
+def page_servers_by_group_id(db, tenant_id, group_id, page_size=PAGE_SIZE):
+    """Get the servers with a specified groupId as :class:`Pages`."""
+    return Pages(db, 'servers', 'groupId', group_id, 'serverId', page_size)
+
+
+@timed('cass')
 def get_server_by_server_id(db, tenant_id, group_id, server_id):
     """Get a server by its serverId."""
 
@@ -97,33 +197,137 @@ def get_server_by_server_id(db, tenant_id, group_id, server_id):
     return d.addCallback(return_server)
 
 
+@timed('cass')
+def get_servers_by_server_ids(db, group_id, server_ids, max_batch_size=MAX_BATCH_SIZE):
+    """Get the servers in a group with any of the given serverIds.
+
+    The servers are read with IN queries of at most ``max_batch_size`` serverIds.
+    """
+    def get_batch(batch):
+        data = {'groupId': group_id}
+        for i, server_id in enumerate(batch):
+            data['serverId{0}'.format(i)] = server_id
+        query = 'SELECT * FROM servers WHERE "groupId"=:groupId AND "serverId" IN ({0});'.format(
+            ', '.join(':serverId{0}'.format(i) for i in range(len(batch))))
+        return db.execute(query, data, ConsistencyLevel.ONE)
+
+    d = _in_batches(get_batch, server_ids, max_batch_size)
+    return d.addCallback(lambda results: [server for result in results for server in result])
+
+
 # TODO: the order of these arguments makes almost no sense. Fix it plz.
-def create_server(db, tenant_id, server_id, entity_id, group_id):
-    """Create and return a new server dict."""
-    query = ' '.join([
-        'INSERT INTO servers ("serverId", "entityId", "groupId")',
-        'VALUES (:serverId, :entityId, :groupId);'])
+@timed('cass')
+def create_server(db, tenant_id, server_id, entity_id, group_id, verify=False):
+    """Create and return a new server dict.
 
-    d = db.execute(query,
-                   {'serverId': server_id, 'entityId': entity_id, 'groupId': group_id},
-                   ConsistencyLevel.ONE)
+    The server is built from the inserted values, unless ``verify`` is set, in
+    which case it is read back from Cassandra.
+    """
+    query = (
+        'INSERT INTO servers ("serverId", "entityId", "groupId") '
+        'VALUES (:serverId, :entityId, :groupId);'
+    )
+    data = {'serverId': server_id, 'entityId': entity_id, 'groupId': group_id}
+
+    d = db.execute(query, data, ConsistencyLevel.ONE)
 
     def retrieve_server(_):
+        if not verify:
+            return data
         return get_server_by_server_id(db, tenant_id, group_id, server_id)
     return d.addCallback(retrieve_server)
 
 
-def delete_server(db, tenant_id, group_id, server_id):
-    """Delete a server and cascade to deleting related serverpolicies."""
-    # TODO: also delete the entity is MaaS
-    query = 'DELETE FROM servers WHERE "groupId"=:groupId AND "serverId"=:serverId;'
-    d = db.execute(query,
-                   {'serverId': server_id, 'groupId': group_id},
-                   ConsistencyLevel.ONE)
-
-    return d
+@timed('cass')
+def create_servers(db, tenant_id, group_id, servers, max_batch_size=MAX_BATCH_SIZE):
+    """Create many servers in a group, and return their server dicts.
 
+    The inserts all go to the group's servers partition, so they are sent in
+    unlogged batches of at most ``max_batch_size`` servers.
 
+    :param servers: A list of (server_id, entity_id) tuples.
+    """
+    def create_batch(batch):
+        statements = []
+        data = {'groupId': group_id}
+        for i, (server_id, entity_id) in enumerate(batch):
+            statements.append(
+                'INSERT INTO servers ("serverId", "entityId", "groupId") '
+                'VALUES (:serverId{0}, :entityId{0}, :groupId)'.format(i))
+            data['serverId{0}'.format(i)] = server_id
+            data['entityId{0}'.format(i)] = entity_id
+        query = 'BEGIN UNLOGGED BATCH {0} APPLY BATCH;'.format(' '.join(statements))
+        return db.execute(query, data, ConsistencyLevel.ONE)
+
+    d = _in_batches(create_batch, servers, max_batch_size)
+    return d.addCallback(lambda _: [
+        {'serverId': server_id, 'entityId': entity_id, 'groupId': group_id}
+        for server_id, entity_id in servers])
+
+
+@timed('cass')
+def delete_server(db, tenant_id, group_id, server_id, quorum=None):
+    """Delete a server and cascade to deleting related serverpolicies.
+
+    The serverpolicies are found with one read of the server's
+    serverpolicies_by_server partition, and are deleted along with their
+    alarms_by_id records and the server itself in a single batch.  The
+    serverpolicies with and without alarms are each padded to a power-of-two
+    count, which only repeats deletes, to bound the number of distinct
+    batches.  The quorum counters of each policy are then updated.
+
+    Deleting a server that has already been deleted does nothing, so a
+    failed delete can be retried.
+    """
+    d = get_serverpolicies_by_server_id(db, group_id, server_id)
+
+    def delete_all(serverpolicies):
+        statements = [
+            'DELETE FROM servers WHERE "groupId"=:groupId AND "serverId"=:serverId',
+            'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId'
+        ]
+        data = {'groupId': group_id, 'serverId': server_id}
+        with_alarms = _padded([sp for sp in serverpolicies if sp.get('alarmId') is not None])
+        without_alarms = _padded([sp for sp in serverpolicies if sp.get('alarmId') is None])
+        for i, serverpolicy in enumerate(with_alarms + without_alarms):
+            statements.append(
+                'DELETE FROM serverpolicies WHERE "policyId"=:policyId{0} '
+                'AND "serverId"=:serverId'.format(i))
+            data['policyId{0}'.format(i)] = serverpolicy['policyId']
+            if i < len(with_alarms):
+                statements.append('DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId{0}'.format(i))
+                data['alarmId{0}'.format(i)] = serverpolicy['alarmId']
+        query = 'BEGIN BATCH {0} APPLY BATCH;'.format(' '.join(statements))
+        d = db.execute(query, data, ConsistencyLevel.ONE)
+
+        def update_quorums(_):
+            return defer.gatherResults([
+                _record_quorum_delta(db, quorum, serverpolicy['policyId'], -1,
+                                     -1 if is_critical(serverpolicy['state']) else 0)
+                for serverpolicy in serverpolicies])
+        return d.addCallback(update_quorums)
+    d.addCallback(delete_all)
+    return d.addCallback(lambda _: None)
+
+
+@timed('cass')
+def delete_servers(db, group_id, server_ids, max_batch_size=MAX_BATCH_SIZE):
+    """Delete many servers in a group, in unlogged batches."""
+    def delete_batch(batch):
+        statements = []
+        data = {'groupId': group_id}
+        for i, server_id in enumerate(batch):
+            statements.append(
+                'DELETE FROM servers WHERE "groupId"=:groupId AND "serverId"=:serverId{0}'.format(i))
+            data['serverId{0}'.format(i)] = server_id
+        query = 'BEGIN UNLOGGED BATCH {0} APPLY BATCH;'.format(' '.join(statements))
+        return db.execute(query, data, ConsistencyLevel.ONE)
+
+    d = _in_batches(delete_batch, server_ids, max_batch_size)
+    return d.addCallback(lambda _: None)
+
+
+@timed('cass')
 def get_policies_by_group_id(db, group_id):
     """Get all policies owned by a provided groupId."""
     query = 'SELECT * FROM policies WHERE "groupId"=:groupId;'
@@ -131,6 +335,7 @@ def get_policies_by_group_id(db, group_id):
                       ConsistencyLevel.ONE)
 
 
+@timed('cass')
 def get_policy_by_policy_id(db, group_id, policy_id):
     """Get a single policy by its policyId."""
     query = 'SELECT * FROM policies WHERE "policyId"=:policyId AND "groupId"=:groupId;'
@@ -146,65 +351,261 @@ def get_policy_by_policy_id(db, group_id, policy_id):
     return d.addCallback(return_policy)
 
 
-def create_policy(db, policy_id, group_id, alarm_template, check_template):
-    """Create and return a policy."""
-    query = ' '.join((
-        'INSERT INTO policies ("policyId", "groupId", "alarmTemplate", "checkTemplate")',
+@timed('cass')
+def create_policy(db, policy_id, group_id, alarm_template, check_template, verify=False):
+    """Create and return a policy.
+
+    The policy is built from the inserted values, unless ``verify`` is set, in
+    which case it is read back from Cassandra.
+    """
+    query = (
+        'INSERT INTO policies ("policyId", "groupId", "alarmTemplate", "checkTemplate") '
         'VALUES (:policyId, :groupId, :alarmTemplate, :checkTemplate);'
-    ))
+    )
+    data = {'policyId': policy_id,
+            'groupId': group_id,
+            'alarmTemplate': alarm_template,
+            'checkTemplate': check_template}
 
-    d = db.execute(query,
-                   {'policyId': policy_id,
-                    'groupId': group_id,
-                    'alarmTemplate': alarm_template,
-                    'checkTemplate': check_template},
-                   ConsistencyLevel.ONE)
+    d = db.execute(query, data, ConsistencyLevel.ONE)
 
     def retrieve_policy(_):
+        if not verify:
+            return data
         return get_policy_by_policy_id(db, group_id, policy_id)
     return d.addCallback(retrieve_policy)
 
 
-def delete_policy(db, group_id, policy_id):
-    """Delete a policy and associated serverpolicies."""
-    query = 'DELETE FROM policies WHERE "groupId"=:groupId AND "policyId"=:policyId;'
+@timed('cass')
+def delete_policy(db, group_id, policy_id, quorum=None, page_size=PAGE_SIZE,
+                  max_batch_size=MAX_BATCH_SIZE):
+    """Delete a policy and associated serverpolicies.
 
-    d = db.execute(query,
-                   {'groupId': group_id,
-                    'policyId': policy_id},
-                   ConsistencyLevel.ONE)
+    The policy's serverpolicies are read a page at a time, and their
+    serverpolicies_by_server and alarms_by_id records deleted in unlogged
+    batches of at most ``max_batch_size``.  The policy and its whole
+    serverpolicies partition are then dropped together in one logged batch,
+    so a delete that fails part way can be retried and will find the same
+    serverpolicies.  Its quorum counters are deleted last.
+    """
+    def delete_batch(with_alarms, batch):
+        statements = []
+        data = {'policyId': policy_id}
+        for i, serverpolicy in enumerate(batch):
+            statements.append(
+                'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId{0} '
+                'AND "policyId"=:policyId'.format(i))
+            data['serverId{0}'.format(i)] = serverpolicy['serverId']
+            if with_alarms:
+                statements.append('DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId{0}'.format(i))
+                data['alarmId{0}'.format(i)] = serverpolicy['alarmId']
+        query = 'BEGIN UNLOGGED BATCH {0} APPLY BATCH;'.format(' '.join(statements))
+        return db.execute(query, data, ConsistencyLevel.ONE)
+
+    def delete_records(serverpolicies):
+        with_alarms = [sp for sp in serverpolicies if sp.get('alarmId') is not None]
+        without_alarms = [sp for sp in serverpolicies if sp.get('alarmId') is None]
+        d = _in_batches(partial(delete_batch, True), with_alarms, max_batch_size)
+        return d.addCallback(
+            lambda _: _in_batches(partial(delete_batch, False), without_alarms, max_batch_size))
+
+    d = page_policy_state(db, policy_id, page_size).each(delete_records)
+
+    def delete_partition(_):
+        query = (
+            'BEGIN BATCH '
+            'DELETE FROM policies WHERE "groupId"=:groupId AND "policyId"=:policyId '
+            'DELETE FROM serverpolicies WHERE "policyId"=:policyId '
+            'APPLY BATCH;'
+        )
+        return db.execute(query, {'groupId': group_id, 'policyId': policy_id},
+                          ConsistencyLevel.ONE)
+    d.addCallback(delete_partition)
 
-    return d
+    def delete_quorum(_):
+        if quorum is not None:
+            quorum.forget(policy_id)
+        return db.execute('DELETE FROM policyquorum WHERE "policyId"=:policyId;',
+                          {'policyId': policy_id},
+                          ConsistencyLevel.ONE)
+    d.addCallback(delete_quorum)
+    return d.addCallback(lambda _: None)
 
 
-def register_policy_on_server(db, policy_id, server_id, alarm_id, check_id):
-    """Create a serverpolicy."""
-    query = ' '.join((
-        'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state)',
-        'VALUES (:serverId, :policyId, :alarmId, :checkId, false);'
-    ))
+@timed('cass')
+def register_policy_on_server(db, policy_id, server_id, alarm_id, check_id, quorum=None):
+    """Create a serverpolicy, and its alarms_by_id and serverpolicies_by_server records.
 
+    Serverpolicies are created not in the OK state.  A new one counts towards
+    both the total and the critical counters of the policy quorum; one that
+    replaces an existing serverpolicy only moves it to critical.
+    """
+    data = {'policyId': policy_id,
+            'serverId': server_id,
+            'alarmId': alarm_id,
+            'checkId': check_id}
+    d = db.execute('SELECT * FROM serverpolicies WHERE "policyId"=:policyId '
+                   'AND "serverId"=:serverId;',
+                   data, ConsistencyLevel.ONE)
+
+    def insert_serverpolicy(existing):
+        query = (
+            'BEGIN BATCH '
+            'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state) '
+            'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+            'INSERT INTO alarms_by_id ("alarmId", "policyId", "serverId", state) '
+            'VALUES (:alarmId, :policyId, :serverId, false) '
+            'INSERT INTO serverpolicies_by_server ("serverId", "policyId", "alarmId", "checkId", state) '
+            'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+            'APPLY BATCH;'
+        )
+        d = db.execute(query, data, ConsistencyLevel.ONE)
+        return d.addCallback(lambda _: _record_registration(db, quorum, policy_id, 1, existing))
+    return d.addCallback(insert_serverpolicy)
+
+
+@timed('cass')
+def register_policy_on_servers(db, policy_id, registrations, quorum=None,
+                               max_batch_size=MAX_BATCH_SIZE):
+    """Create serverpolicies for one policy on many servers.
+
+    The servers are registered ``max_batch_size`` at a time.  The
+    alarms_by_id and serverpolicies_by_server records of a batch span many
+    partitions, so they are written first in a logged batch, which Cassandra
+    applies completely or not at all.  The serverpolicies all go to the
+    policy's one partition, so they are then written in an unlogged batch.
+    A serverpolicy is therefore never written without the records the alarm
+    webhook finds it by.
+
+    Each batch's existing serverpolicies are read first, so that registering
+    a server again does not count it twice in the policy quorum.
+
+    :param registrations: A list of (server_id, alarm_id, check_id) tuples.
+    """
+    def register_batch(batch):
+        index_statements = []
+        statements = []
+        data = {'policyId': policy_id}
+        for i, (server_id, alarm_id, check_id) in enumerate(batch):
+            index_statements.append(
+                'INSERT INTO alarms_by_id ("alarmId", "policyId", "serverId", state) '
+                'VALUES (:alarmId{0}, :policyId, :serverId{0}, false)'.format(i))
+            index_statements.append(
+                'INSERT INTO serverpolicies_by_server '
+                '("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId{0}, :policyId, :alarmId{0}, :checkId{0}, false)'.format(i))
+            statements.append(
+                'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId{0}, :policyId, :alarmId{0}, :checkId{0}, false)'.format(i))
+            data['serverId{0}'.format(i)] = server_id
+            data['alarmId{0}'.format(i)] = alarm_id
+            data['checkId{0}'.format(i)] = check_id
+
+        d = db.execute(
+            'SELECT * FROM serverpolicies WHERE "policyId"=:policyId AND "serverId" IN ({0});'.format(
+                ', '.join(':serverId{0}'.format(i) for i in range(len(batch)))),
+            data, ConsistencyLevel.ONE)
+
+        def insert_serverpolicies(existing):
+            d = db.execute('BEGIN BATCH {0} APPLY BATCH;'.format(' '.join(index_statements)),
+                           data, ConsistencyLevel.ONE)
+            d.addCallback(lambda _: db.execute(
+                'BEGIN UNLOGGED BATCH {0} APPLY BATCH;'.format(' '.join(statements)),
+                data, ConsistencyLevel.ONE))
+            return d.addCallback(
+                lambda _: _record_registration(db, quorum, policy_id, len(batch), existing))
+        return d.addCallback(insert_serverpolicies)
+
+    d = _in_batches(register_batch, registrations, max_batch_size)
+    return d.addCallback(lambda _: None)
+
+
+@timed('cass')
+def deregister_policy_on_server(db, policy_id, server_id, quorum=None):
+    """Delete a serverpolicy, and its alarms_by_id and serverpolicies_by_server records."""
+    query = ('SELECT * FROM serverpolicies WHERE "policyId"=:policyId '
+             'AND "serverId"=:serverId;')
     d = db.execute(query,
                    {'policyId': policy_id,
-                    'serverId': server_id,
-                    'alarmId': alarm_id,
-                    'checkId': check_id},
+                    'serverId': server_id},
                    ConsistencyLevel.ONE)
-    return d
 
+    def delete_serverpolicy(result):
+        if len(result) < 1:
+            query = (
+                'BEGIN BATCH '
+                'DELETE FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId '
+                'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId '
+                'AND "policyId"=:policyId '
+                'APPLY BATCH;'
+            )
+            return db.execute(query,
+                              {'policyId': policy_id,
+                               'serverId': server_id},
+                              ConsistencyLevel.ONE)
+
+        query = (
+            'BEGIN BATCH '
+            'DELETE FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId '
+            'DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId '
+            'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId AND "policyId"=:policyId '
+            'APPLY BATCH;'
+        )
+        d2 = db.execute(query,
+                        {'policyId': policy_id,
+                         'serverId': server_id,
+                         'alarmId': result[0]['alarmId']},
+                        ConsistencyLevel.ONE)
 
-def deregister_policy_on_server(db, policy_id, server_id):
-    """Delete a serverpolicy record."""
-    query = 'DELETE FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId;'
+        critical_delta = -1 if is_critical(result[0]['state']) else 0
+        return d2.addCallback(
+            lambda _: _record_quorum_delta(db, quorum, policy_id, -1, critical_delta))
+    d.addCallback(delete_serverpolicy)
+    return d.addCallback(lambda _: None)
 
-    d = db.execute(query,
-                   {'policyId': policy_id,
-                    'serverId': server_id},
-                   ConsistencyLevel.ONE)
 
-    return d
+@timed('cass')
+def deregister_policy_on_servers(db, policy_id, serverpolicies, quorum=None,
+                                 max_batch_size=MAX_BATCH_SIZE):
+    """Delete many serverpolicies of one policy, and their other records.
 
+    Serverpolicies without an alarm, such as those made by
+    :func:`add_serverpolicy`, have no alarms_by_id record, so they are
+    deleted in batches of their own.
 
+    :param serverpolicies: A list of serverpolicy dicts, as returned by
+        :func:`get_policy_state`.
+    """
+    def deregister_batch(with_alarms, batch):
+        statements = []
+        data = {'policyId': policy_id}
+        for i, serverpolicy in enumerate(batch):
+            statements.append(
+                'DELETE FROM serverpolicies WHERE "policyId"=:policyId '
+                'AND "serverId"=:serverId{0}'.format(i))
+            if with_alarms:
+                statements.append('DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId{0}'.format(i))
+                data['alarmId{0}'.format(i)] = serverpolicy['alarmId']
+            statements.append(
+                'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId{0} '
+                'AND "policyId"=:policyId'.format(i))
+            data['serverId{0}'.format(i)] = serverpolicy['serverId']
+        query = 'BEGIN UNLOGGED BATCH {0} APPLY BATCH;'.format(' '.join(statements))
+
+        critical = len([sp for sp in batch if is_critical(sp['state'])])
+        d = db.execute(query, data, ConsistencyLevel.ONE)
+        return d.addCallback(
+            lambda _: _record_quorum_delta(db, quorum, policy_id, -len(batch), -critical))
+
+    with_alarms = [sp for sp in serverpolicies if sp.get('alarmId') is not None]
+    without_alarms = [sp for sp in serverpolicies if sp.get('alarmId') is None]
+    d = _in_batches(partial(deregister_batch, True), with_alarms, max_batch_size)
+    d.addCallback(lambda _: _in_batches(
+        partial(deregister_batch, False), without_alarms, max_batch_size))
+    return d.addCallback(lambda _: None)
+
+
+@timed('cass')
 def get_policy_state(db, policy_id):
     """ Get the state of the policy checks on each server. """
     query = 'SELECT * FROM serverpolicies WHERE "policyId"=:policyId;'
@@ -212,23 +613,21 @@ def get_policy_state(db, policy_id):
                       ConsistencyLevel.ONE)
 
 
-def get_serverpolicies_by_server_id(db, group_id, server_id):
-    """Get all serverpolicies for a server."""
-    query = 'SELECT * FROM policies WHERE "groupId"=:groupId'
-    d = db.execute(query,
-                   {'groupId': group_id},
-                   ConsistencyLevel.ONE)
+def page_policy_state(db, policy_id, page_size=PAGE_SIZE):
+    """Get the state of the policy checks on each server as :class:`Pages`."""
+    return Pages(db, 'serverpolicies', 'policyId', policy_id, 'serverId', page_size)
 
-    def find_server_policies(policies):
-        policy_list = [policy['policyId'] for policy in policies]
-        query = 'SELECT * FROM serverpolicies WHERE "policyId" IN (:policies) AND "serverId"=:serverId'
-        return db.execute(query,
-                          {'policies': ', '.join(policy_list),
-                           'serverId': server_id},
-                          ConsistencyLevel.ONE)
-    return d.addCallback(find_server_policies)
+
+@timed('cass')
+def get_serverpolicies_by_server_id(db, group_id, server_id):
+    """Get all serverpolicies for a server, from its serverpolicies_by_server partition."""
+    query = 'SELECT * FROM serverpolicies_by_server WHERE "serverId"=:serverId;'
+    return db.execute(query,
+                      {'serverId': server_id},
+                      ConsistencyLevel.ONE)
 
 
+@timed('cass')
 def add_serverpolicy(db, server_id, policy_id):
     """Add a serverpolicy with the given server_id and policy_id.
 
@@ -236,7 +635,12 @@ def add_serverpolicy(db, server_id, policy_id):
     :param str policy_id: A policy_id
     """
     # TODO: validate that the policy exists and belongs to the user.
-    query = 'INSERT INTO serverpolicies ("serverId", "policyId") VALUES (:serverId, :policyId);'
+    query = (
+        'BEGIN BATCH '
+        'INSERT INTO serverpolicies ("serverId", "policyId") VALUES (:serverId, :policyId) '
+        'INSERT INTO serverpolicies_by_server ("serverId", "policyId") VALUES (:serverId, :policyId) '
+        'APPLY BATCH;'
+    )
 
     d = db.execute(query,
                    {'serverId': server_id, 'policyId': policy_id},
@@ -244,13 +648,19 @@ def add_serverpolicy(db, server_id, policy_id):
     return d
 
 
+@timed('cass')
 def delete_serverpolicy(db, server_id, policy_id):
     """Delete a serverpolicy with the given server_id and policy_id.
 
     :param str server_id: A server_id
     :param str policy_id: A policy_id
     """
-    query = 'DELETE FROM serverpolicies WHERE "serverId"=:serverId AND "policyId"=:policyId;'
+    query = (
+        'BEGIN BATCH '
+        'DELETE FROM serverpolicies WHERE "serverId"=:serverId AND "policyId"=:policyId '
+        'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId AND "policyId"=:policyId '
+        'APPLY BATCH;'
+    )
 
     d = db.execute(query,
                    {'serverId': server_id, 'policyId': policy_id},
@@ -258,17 +668,20 @@ def delete_serverpolicy(db, server_id, policy_id):
     return d
 
 
-def alter_alarm_state(db, alarm_id, state):
+@timed('cass')
+def alter_alarm_state(db, alarm_id, state, quorum=None):
     """
     Get the alarm locator and alter the state for that alarm.
 
-    This is slightly more complex than it needs to be because you can't do an UPDATE
-    based on an index.... so we have to look up the serverpolicies record from
-    the alarmId and then alter it.
+    The serverpolicy is found through the alarms_by_id table, which also holds
+    the previous state, and all three records of it are then updated together.
+
+    If the alarm moved into or out of the OK state, the policy quorum counters
+    are updated with the difference.
 
     Remember: CQL looks like SQL but it isn't.  There is no query planner.
     """
-    query = 'SELECT * FROM serverpolicies WHERE "alarmId"=:alarmId;'
+    query = 'SELECT * FROM alarms_by_id WHERE "alarmId"=:alarmId;'
 
     d = db.execute(query,
                    {'alarmId': alarm_id},
@@ -279,13 +692,26 @@ def alter_alarm_state(db, alarm_id, state):
             return defer.fail(ResultNotFoundError('alarm', alarm_id))
         if len(result) > 1:
             return defer.fail(ExcessiveResultsError('alarm', alarm_id))
-        query = ('UPDATE serverpolicies SET state=:state WHERE "policyId"=:policyId '
-                 'AND "serverId"=:serverId;')
+        query = (
+            'BEGIN BATCH '
+            'UPDATE serverpolicies SET state=:state WHERE "policyId"=:policyId '
+            'AND "serverId"=:serverId '
+            'UPDATE alarms_by_id SET state=:state WHERE "alarmId"=:alarmId '
+            'UPDATE serverpolicies_by_server SET state=:state WHERE "serverId"=:serverId '
+            'AND "policyId"=:policyId '
+            'APPLY BATCH;'
+        )
         d2 = db.execute(query,
                         {'state': state,
                          'policyId': result[0]['policyId'],
-                         'serverId': result[0]['serverId']},
+                         'serverId': result[0]['serverId'],
+                         'alarmId': alarm_id},
                         ConsistencyLevel.ONE)
+
+        critical_delta = is_critical(state) - is_critical(result[0]['state'])
+        if critical_delta:
+            d2.addCallback(lambda _: _record_quorum_delta(
+                db, quorum, result[0]['policyId'], 0, critical_delta))
         d2.addCallback(lambda _: (result[0]['policyId'], result[0]['serverId']))
         return d2
 
@@ -294,25 +720,168 @@ def alter_alarm_state(db, alarm_id, state):
     return d
 
 
+def is_critical(state):
+    """Whether a serverpolicy state counts against the health of the quorum."""
+    return state != 'OK'
+
+
+def quorum_is_healthy(total, critical):
+    """Decide the health of a quorum from its total and critical counts."""
+    return critical < total / 2.0
+
+
+@timed('cass')
+def count_policy_states(db, policy_id, page_size=PAGE_SIZE):
+    """
+    Count the serverpolicies of a policy by reading the whole partition, a
+    page at a time.
+
+    :return: A tuple of (total, critical) counts.
+    """
+    counts = [0, 0]
+
+    def count(serverpolicies):
+        counts[0] += len(serverpolicies)
+        counts[1] += len([serverpolicy for serverpolicy in serverpolicies
+                          if is_critical(serverpolicy['state'])])
+    d = page_policy_state(db, policy_id, page_size).each(count)
+    return d.addCallback(lambda _: tuple(counts))
+
+
+@timed('cass')
 def check_quorum_health(db, policy_id):
     """
     Check the status of an alarm across all servers.
 
+    This does a full scan of the policy's serverpolicies; see
+    :class:`bobby.quorum.QuorumTracker` for the incremental version.
+
     :param policy_id: The id of the policy that needs a health check.
     :return: True if the quorum is healthy, False if the quorum is unhealthy.
     """
-    query = ('SELECT * FROM serverpolicies WHERE "policyId"=:policyId;')
+    d = count_policy_states(db, policy_id)
+
+    def verify_health((total, critical)):
+        return defer.succeed(quorum_is_healthy(total, critical))
+    return d.addCallback(verify_health)
+
+
+@timed('cass')
+def get_quorum_counts(db, policy_id):
+    """
+    Get the stored quorum counters for a policy.
+
+    :return: A tuple of (total, critical) counts, or None if nothing has been
+        recorded for the policy yet.
+    """
+    query = 'SELECT * FROM policyquorum WHERE "policyId"=:policyId;'
     d = db.execute(query,
                    {'policyId': policy_id},
                    ConsistencyLevel.ONE)
 
-    def verify_health(serverpolicies):
-        total = len(serverpolicies)
-        critical = len([serverpolicy for serverpolicy in serverpolicies
-                        if serverpolicy['state'] != 'OK'])
+    def return_counts(result):
+        if len(result) < 1:
+            return None
+        return (result[0]['total'] or 0, result[0]['critical'] or 0)
+    return d.addCallback(return_counts)
 
-        if critical >= total / 2.0:
-            return defer.succeed(False)
-        else:
-            return defer.succeed(True)
-    return d.addCallback(verify_health)
+
+@timed('cass')
+def update_quorum_counts(db, policy_id, total_delta, critical_delta):
+    """Add the given deltas to the stored quorum counters for a policy."""
+    query = ('UPDATE policyquorum SET total=total + :total, critical=critical + :critical '
+             'WHERE "policyId"=:policyId;')
+    return db.execute(query,
+                      {'total': total_delta,
+                       'critical': critical_delta,
+                       'policyId': policy_id},
+                      ConsistencyLevel.ONE)
+
+
+def _record_quorum_delta(db, quorum, policy_id, total_delta, critical_delta):
+    """Write a quorum delta through to Cassandra and the in-memory tracker."""
+    d = update_quorum_counts(db, policy_id, total_delta, critical_delta)
+
+    def apply_to_tracker(_):
+        if quorum is not None:
+            quorum.apply(policy_id, total_delta, critical_delta)
+    return d.addCallback(apply_to_tracker)
+
+
+def _record_registration(db, quorum, policy_id, registered, existing):
+    """Record the quorum delta of (re-)registering serverpolicies.
+
+    :param registered: How many serverpolicies were written, not in the OK state.
+    :param existing: The serverpolicy rows they replaced.
+    """
+    critical = len([sp for sp in existing if is_critical(sp['state'])])
+    return _record_quorum_delta(db, quorum, policy_id,
+                                registered - len(existing), registered - critical)
+
+
+@timed('cass')
+def get_policy_execution(db, policy_id):
+    """
+    Get when a policy was last executed, if it is still cooling down.
+
+    :return: The time of the last execution, or None if there is no
+        unexpired record of one.
+    """
+    query = 'SELECT * FROM policyexecutions WHERE "policyId"=:policyId;'
+    d = db.execute(query,
+                   {'policyId': policy_id},
+                   ConsistencyLevel.ONE)
+
+    def return_executed_at(result):
+        if len(result) < 1:
+            return None
+        return result[0]['executedAt']
+    return d.addCallback(return_executed_at)
+
+
+@timed('cass')
+def record_policy_execution(db, policy_id, executed_at, cooldown):
+    """Record that a policy was executed, expiring once its cooldown has passed."""
+    query = ('INSERT INTO policyexecutions ("policyId", "executedAt") '
+             'VALUES (:policyId, :executedAt) USING TTL {0};').format(int(cooldown))
+    return db.execute(query,
+                      {'policyId': policy_id,
+                       'executedAt': int(executed_at)},
+                      ConsistencyLevel.ONE)
+
+
+def _padded(items):
+    """
+    Pad a list to a power-of-two length by repeating its last item.
+
+    A batch of idempotent statements built from a padded list has one of only
+    a few sizes, so only a few distinct queries are ever prepared for it.
+    """
+    size = 1
+    while size < len(items):
+        size *= 2
+    return items + items[-1:] * (size - len(items))
+
+
+def _in_batches(f, items, max_batch_size):
+    """
+    Call ``f`` with the items in lists of at most ``max_batch_size``, all at once.
+
+    The items are split into lists of ``max_batch_size``, and whatever is left
+    into lists with power-of-two lengths, so a batch built from each list has
+    one of only a few sizes, and only a few distinct queries are ever prepared
+    for it.
+
+    :return: A Deferred that fires with a list of the results, or fails with
+        the first failure.
+    """
+    deferreds = []
+    start = 0
+    while start < len(items):
+        size = min(max_batch_size, len(items) - start)
+        if size < max_batch_size:
+            size = 1 << (size.bit_length() - 1)
+        deferreds.append(f(items[start:start + size]))
+        start += size
+    d = defer.gatherResults(deferreds, consumeErrors=True)
+    return d.addErrback(lambda failure: failure.trap(defer.FirstError) and failure.value.subFailure)
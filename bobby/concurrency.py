@@ -0,0 +1,48 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+Limits on how much work is done at once for a tenant.
+"""
+from twisted.internet import defer
+
+
+class TenantLimiter(object):
+    """
+    Runs at most ``limit`` operations at once for each tenant.
+
+    Operations beyond the limit wait, in order, for a running one to finish.
+    Each tenant gets its own :class:`twisted.internet.defer.DeferredSemaphore`,
+    which is thrown away once the tenant has nothing running or waiting.
+
+    :param limit: The number of operations a tenant may run at once.
+    """
+
+    def __init__(self, limit=10):
+        self._limit = limit
+        self._semaphores = {}
+
+    def run(self, tenant_id, f, *args, **kwargs):
+        """
+        Run ``f(*args, **kwargs)`` once the tenant is below its limit.
+
+        :return: A Deferred that fires with the result of ``f``.
+        """
+        semaphore = self._semaphores.get(tenant_id)
+        if semaphore is None:
+            semaphore = self._semaphores[tenant_id] = defer.DeferredSemaphore(self._limit)
+
+        def cleanup(result):
+            if semaphore.tokens == self._limit and not semaphore.waiting:
+                self._semaphores.pop(tenant_id, None)
+            return result
+        return semaphore.run(f, *args, **kwargs).addBoth(cleanup)
+
+    def queue_depth(self, tenant_id):
+        """The number of operations waiting to run for a tenant."""
+        semaphore = self._semaphores.get(tenant_id)
+        return len(semaphore.waiting) if semaphore else 0
+
+    def metrics(self):
+        """Get the number of running and waiting operations for each busy tenant."""
+        return dict((tenant_id, {'running': self._limit - semaphore.tokens,
+                                 'queued': len(semaphore.waiting)})
+                    for tenant_id, semaphore in self._semaphores.items())
@@ -20,11 +20,38 @@ So we make do with what we can.
 And thus, we reach this piece of code, which is a super-lightweight facade for
 the calls we'll make against MaaS.
 """
+import heapq
+import itertools
 import json
+import random
 
 from otter.util import http
 import treq
-from twisted.internet import defer
+from twisted.internet import defer, error, reactor, task
+from twisted.web.client import HTTPConnectionPool, ResponseFailed, ResponseNeverReceived
+
+from bobby.metrics import timed
+
+
+MAX_PERSISTENT_PER_HOST = 10
+IDLE_TIMEOUT = 240
+
+REQUESTS_PER_SECOND = 50
+BURST = 100
+MAX_THROTTLED_RETRIES = 5
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+MAX_RETRIES = 3
+BACKOFF = 1
+MAX_BACKOFF = 30
+POLICY_METADATA_KEY = 'bobby_policy_id'
+
+_connection_pools = {}
+_schedulers = {}
+_retries = {}
 
 
 def fetch_entity_by_uuid(tenant_id, policy_id, server_id):
@@ -32,19 +59,325 @@ def fetch_entity_by_uuid(tenant_id, policy_id, server_id):
     pass
 
 
+class CountingConnectionPool(HTTPConnectionPool):
+    """An HTTPConnectionPool that counts how often it reuses a connection."""
+
+    def __init__(self, *args, **kwargs):
+        HTTPConnectionPool.__init__(self, *args, **kwargs)
+        self.hits = 0
+        self.misses = 0
+
+    def getConnection(self, key, endpoint):
+        """Get a cached connection if there is one, or make a new one."""
+        if self._connections.get(key):
+            self.hits += 1
+        else:
+            self.misses += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+
+def get_connection_pool(endpoint, max_per_host=None, idle_timeout=None):
+    """
+    Get the persistent connection pool shared by every client of an endpoint.
+
+    :param endpoint: The MaaS endpoint URL.
+    :param max_per_host: The number of idle connections to keep for each host.
+        Only used when the pool is first created.
+    :param idle_timeout: How long, in seconds, an idle connection is kept open.
+        Only used when the pool is first created.
+    """
+    if endpoint not in _connection_pools:
+        pool = CountingConnectionPool(reactor, persistent=True)
+        pool.maxPersistentPerHost = max_per_host or MAX_PERSISTENT_PER_HOST
+        pool.cachedConnectionTimeout = idle_timeout or IDLE_TIMEOUT
+        _connection_pools[endpoint] = pool
+    return _connection_pools[endpoint]
+
+
+def connection_pool_stats():
+    """Get the connection reuse hits and misses for each endpoint."""
+    return dict((endpoint, {'hits': pool.hits, 'misses': pool.misses})
+                for endpoint, pool in _connection_pools.items())
+
+
+class RequestScheduler(object):
+    """
+    Sends requests to a MaaS endpoint no faster than a token bucket allows.
+
+    The bucket holds up to ``burst`` tokens and gains ``rate`` of them a
+    second; each request takes one.  When it is empty, requests wait in a
+    queue, lowest priority number first and then in the order they came.
+
+    A request answered with a 429 pauses the whole endpoint for as long as
+    its ``Retry-After`` header says, and goes back in the queue in its old
+    place.  After ``max_retries`` 429s its response is passed on as it is.
+
+    :param rate: The number of requests allowed each second.
+    :param burst: The number of requests that may be sent at once after
+        the endpoint has been idle.
+    :param max_retries: How many times a throttled request is sent again.
+    :param clock: An IReactorTime provider.
+    """
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=BURST,
+                 max_retries=MAX_THROTTLED_RETRIES, clock=reactor):
+        self._rate = rate
+        self._burst = burst
+        self._max_retries = max_retries
+        self._clock = clock
+
+        self._tokens = burst
+        self._updated = clock.seconds()
+        self._paused_until = 0
+        self._queue = []
+        self._order = itertools.count()
+        self._call = None
+
+        self.sent = 0
+        self.throttled = 0
+
+    def request(self, priority, f, *args, **kwargs):
+        """
+        Call ``f(*args, **kwargs)`` once the bucket and queue allow.
+
+        :param priority: One of the ``PRIORITY_*`` constants.
+        :param f: A callable returning a Deferred that fires with a response.
+        :return: A Deferred that fires with the response.
+        """
+        d = defer.Deferred()
+        heapq.heappush(self._queue, (priority, next(self._order), 0, d, f, args, kwargs))
+        self._send_queued()
+        return d
+
+    def queued(self):
+        """The number of requests waiting, by priority."""
+        counts = {}
+        for entry in self._queue:
+            counts[entry[0]] = counts.get(entry[0], 0) + 1
+        return counts
+
+    def _send_queued(self):
+        """Send as many queued requests as there are tokens, and wait for more."""
+        if self._call is not None:
+            if self._call.active():
+                return
+            self._call = None
+
+        now = self._clock.seconds()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        while self._queue:
+            if now < self._paused_until:
+                wait = self._paused_until - now
+                break
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / float(self._rate)
+                break
+            self._tokens -= 1
+            self._send(heapq.heappop(self._queue))
+        else:
+            return
+        self._call = self._clock.callLater(wait, self._send_queued)
+
+    def _send(self, entry):
+        priority, order, retries, d, f, args, kwargs = entry
+        self.sent += 1
+
+        def check(response):
+            if response.code != 429 or retries >= self._max_retries:
+                d.callback(response)
+                return
+            self.throttled += 1
+            self._paused_until = max(self._paused_until,
+                                     self._clock.seconds() + _retry_after(response))
+            heapq.heappush(self._queue, (priority, order, retries + 1, d, f, args, kwargs))
+            if self._call is not None and self._call.active():
+                self._call.cancel()
+            self._send_queued()
+        defer.maybeDeferred(f, *args, **kwargs).addCallbacks(check, d.errback)
+
+
+def _retry_after(response):
+    """The seconds a 429 response says to wait, or 1 if it doesn't say."""
+    try:
+        return max(0, float(response.headers.getRawHeaders('retry-after')[0]))
+    except (TypeError, ValueError):
+        return 1
+
+
+def get_scheduler(endpoint, rate=None, burst=None, clock=reactor):
+    """
+    Get the request scheduler shared by every client of an endpoint.
+
+    MaaS endpoints are per tenant, so each tenant gets its own token bucket.
+
+    :param endpoint: The MaaS endpoint URL.
+    :param rate: The number of requests allowed each second.  Only used
+        when the scheduler is first created.
+    :param burst: The number of requests that may be sent at once.  Only
+        used when the scheduler is first created.
+    :param clock: An IReactorTime provider.  Only used when the scheduler is
+        first created.
+    """
+    if endpoint not in _schedulers:
+        _schedulers[endpoint] = RequestScheduler(rate or REQUESTS_PER_SECOND, burst or BURST,
+                                                 clock=clock)
+    return _schedulers[endpoint]
+
+
+def scheduler_stats():
+    """Get the requests sent, throttled and queued for each endpoint."""
+    return dict((endpoint, {'sent': scheduler.sent, 'throttled': scheduler.throttled,
+                            'queued': sum(scheduler.queued().values())})
+                for endpoint, scheduler in _schedulers.items())
+
+
+def _tag_with_policy(obj, policy_id):
+    """Add a policy id to a MaaS object's metadata, so it can be found again."""
+    obj['metadata'] = dict(obj.get('metadata') or {}, **{POLICY_METADATA_KEY: policy_id})
+    return obj
+
+
+def _is_transient(failure):
+    """Whether a request failed for a reason that sending it again might fix."""
+    if failure.check(http.APIError):
+        return failure.value.code == 429 or failure.value.code >= 500
+    return failure.check(error.ConnectError, error.TimeoutError, ResponseFailed,
+                         ResponseNeverReceived) is not None
+
+
+def _count_retry(operation, result):
+    counts = _retries.setdefault(operation, {'retried': 0, 'found': 0, 'exhausted': 0})
+    counts[result] += 1
+
+
+def retry_stats():
+    """
+    Get how often each kind of MaaS object's creation was retried.
+
+    For each operation: ``retried`` is the number of retries, ``found`` the
+    number that found the object had been created after all, and
+    ``exhausted`` the number of creates that failed after every retry.
+    """
+    return dict((operation, dict(counts)) for operation, counts in _retries.items())
+
+
 class MaasClient(object):
-    """A web client for making requests to MaaS."""
+    """A web client for making requests to MaaS.
+
+    Every call is timed in :data:`bobby.metrics.registry`.
+
+    Requests go through the endpoint's :class:`RequestScheduler`.  Deletes
+    are sent at :data:`PRIORITY_HIGH`, since they free up MaaS resources,
+    and everything else at the client's ``priority``.
+
+    Creating entities, checks and alarms is retried after transient
+    failures, and is idempotent: entities are found again by their label and
+    agent, and checks and alarms by the policy id in their metadata.
+
+    ``max_per_host`` and ``idle_timeout`` configure the endpoint's connection
+    pool, and ``request_rate`` and ``burst`` its scheduler, if they haven't
+    been made already; see :func:`get_connection_pool` and
+    :func:`get_scheduler`.
+    """
 
     SERVICE_NAME = 'cloudMonitoring'
 
-    def __init__(self, service_catalog, auth_token):
+    def __init__(self, service_catalog, auth_token, priority=PRIORITY_NORMAL, clock=reactor,
+                 max_per_host=None, idle_timeout=None, request_rate=None, burst=None):
+        self._endpoint = None
         # MaaS doesn't have regions.
         for service in service_catalog:
             if self.SERVICE_NAME == service['name']:
                 self._endpoint = service['endpoints'][0]['publicURL']
                 break
         self._auth_token = auth_token
+        self._priority = priority
+        self._clock = clock
+        self._pool = get_connection_pool(self._endpoint, max_per_host, idle_timeout)
+        self._scheduler = get_scheduler(self._endpoint, request_rate, burst, clock)
+
+    def _request(self, method, url, **kwargs):
+        """Make a request through the scheduler, at a priority that depends on its method."""
+        priority = PRIORITY_HIGH if method == 'DELETE' else self._priority
+        f = {'GET': treq.get, 'POST': treq.post, 'DELETE': treq.delete}[method]
+        return self._scheduler.request(priority, f, url, headers=http.headers(self._auth_token),
+                                       pool=self._pool, **kwargs)
+
+    def _find(self, url, match):
+        """
+        Find an object listed at ``url``, following the list's pages.
+
+        :param match: A callable returning whether an object is the one wanted.
+        :return: A Deferred that fires with the object, or None if there isn't one.
+        """
+        d = self._request('GET', url)
+        d.addCallback(http.check_success, [200])
+        d.addCallback(treq.json_content)
+
+        def search(page):
+            for obj in page['values']:
+                if match(obj):
+                    return obj
+            next_href = (page.get('metadata') or {}).get('next_href')
+            if next_href:
+                return self._find(next_href, match)
+            return None
+        return d.addCallback(search)
+
+    def _create(self, operation, url, data, match):
+        """
+        Create an object by POSTing ``data`` to ``url``, retrying transient failures.
+
+        Each retry waits a random time of up to :data:`BACKOFF` seconds,
+        doubled for every retry before it, up to :data:`MAX_BACKOFF`.  A
+        failed POST may still have created the object, so before each retry
+        the objects at ``url`` are searched with ``match``, and the one found
+        is used instead of creating another.
 
+        :return: A Deferred that fires with the id of the object.
+        """
+        def post():
+            d = self._request('POST', url, data=data)
+            d.addCallback(http.check_success, [201])
+            return d.addCallback(lambda response: response.headers.getRawHeaders('x-object-id')[0])
+
+        def retry(failure, retries):
+            if not _is_transient(failure):
+                return failure
+            if retries >= MAX_RETRIES:
+                _count_retry(operation, 'exhausted')
+                return failure
+            _count_retry(operation, 'retried')
+            delay = random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** retries))
+            d = task.deferLater(self._clock, delay, self._find, url, match)
+
+            def create_unless_found(obj):
+                if obj is not None:
+                    _count_retry(operation, 'found')
+                    return obj['id']
+                return post().addErrback(retry, retries + 1)
+            return d.addCallbacks(create_unless_found, retry, errbackArgs=(retries + 1,))
+        return post().addErrback(retry, 0)
+
+    def _create_policy_object(self, operation, url, obj, policy_id, fetch):
+        """
+        Create a policy's check or alarm, returning it with its id, or as MaaS has it if ``fetch``.
+        """
+        def match(existing):
+            return (existing.get('metadata') or {}).get(POLICY_METADATA_KEY) == policy_id
+        d = self._create(operation, url, json.dumps(obj), match)
+
+        if not fetch:
+            return d.addCallback(lambda object_id: dict(obj, id=object_id))
+
+        def get(object_id):
+            return self._request('GET', http.append_segments(url, object_id))
+        d.addCallback(get)
+        d.addCallback(http.check_success, [200])
+        return d.addCallback(treq.json_content)
+
+    @timed('maas')
     def create_entity(self, server):
         entity_url = http.append_segments(self._endpoint, 'entities')
         data = {
@@ -54,23 +387,20 @@ class MaasClient(object):
             'metadata': server['metadata']
         }
 
-        d = treq.post(entity_url,
-                      headers=http.headers(self._auth_token),
-                      data=json.dumps(data))
-
-        def parse_response(response):
-            entity_id = response.headers.getRawHeaders('x-object-id')[0]
-            return defer.succeed(entity_id)
-        return d.addCallback(parse_response)
+        def match(entity):
+            return (entity.get('label'), entity.get('agent_id')) == (data['label'], data['agent_id'])
+        return self._create('create_entity', entity_url, json.dumps(data), match)
 
+    @timed('maas')
     def delete_entity(self, entity_id):
         entity_url = http.append_segments(self._endpoint, 'entities', entity_id)
 
-        d = treq.delete(entity_url,
-                        headers=http.headers(self._auth_token))
-        d.addCallback(http.check_success, [204])
+        d = self._request('DELETE', entity_url)
+        # An entity that is already gone has been deleted.
+        d.addCallback(http.check_success, [204, 404])
         return d
 
+    @timed('maas')
     def add_notification_and_plan(self):
         """Groups must have a Notification and Notification plan for Auto
 Scale.
@@ -90,9 +420,7 @@ Scale.
             }
         }
         notification_url = http.append_segments(self._endpoint, 'notifications')
-        d = treq.post(notification_url,
-                      headers=http.headers(self._auth_token),
-                      data=json.dumps(notification_data))
+        d = self._request('POST', notification_url, data=json.dumps(notification_data))
         d.addCallback(http.check_success, [201])
 
         # Get the newly created notification
@@ -108,9 +436,8 @@ Scale.
             }
             notification_plan_url = http.append_segments(
                 self._endpoint, 'notification_plans')
-            return treq.post(notification_plan_url,
-                             headers=http.headers(self._auth_token),
-                             data=json.dumps(notification_plan_data))
+            return self._request('POST', notification_plan_url,
+                                 data=json.dumps(notification_plan_data))
         d.addCallback(create_notification_plan)
         d.addCallback(http.check_success, [201])
 
@@ -119,63 +446,64 @@ Scale.
             return defer.succeed((notification_id[0], notification_plan_id))
         return d.addCallback(return_ids)
 
+    @timed('maas')
     def remove_notification_and_plan(self, notification_plan_id, notification_id):
         """Delete a notification plan and notification id."""
         notification_plan_url = http.append_segments(
             self._endpoint, 'notification_plans', notification_plan_id)
-        d = treq.delete(notification_plan_url,
-                        headers=http.headers(self._auth_token))
+        d = self._request('DELETE', notification_plan_url)
         d.addCallback(http.check_success, [204])
 
         def delete_notification(_):
             notification_url = http.append_segments(
                 self._endpoint, 'notifications', notification_id)
-            return treq.delete(notification_url,
-                               headers=http.headers(self._auth_token))
+            return self._request('DELETE', notification_url)
         d.addCallback(delete_notification)
         d.addCallback(http.check_success, [204])
         return d
 
-    def add_check(self, policy_id, entity_id, check_template):
-        """Add a new check to the entity."""
-        d = treq.post(
-            http.append_segments(self._endpoint, 'entities', entity_id, 'checks'),
-            headers=http.headers(self._auth_token),
-            data=check_template)
-        d.addCallback(http.check_success, [201])
+    @timed('maas')
+    def add_check(self, policy_id, entity_id, check_template, fetch=False):
+        """Add a new check to the entity.
 
-        def get_check(result):
-            location = result.headers.getRawHeaders('Location')[0]
-            return treq.get(location, headers=http.headers(self._auth_token))
-        d.addCallback(get_check)
-        d.addCallback(http.check_success, [200])
-        return d.addCallback(treq.json_content)
+        The check is built from the template and the id MaaS gives it, unless
+        ``fetch`` is set, in which case it is read back from MaaS to get the
+        fields MaaS fills in.  The policy id is kept in the check's metadata.
+        """
+        check = _tag_with_policy(json.loads(check_template), policy_id)
+        return self._create_policy_object(
+            'add_check', http.append_segments(self._endpoint, 'entities', entity_id, 'checks'),
+            check, policy_id, fetch)
 
+    @timed('maas')
     def remove_check(self, entity_id, check_id):
         """Remove a check."""
-        d = treq.delete(http.append_segments(
-            self._endpoint, 'entities', entity_id, 'checks', check_id),
-            headers=http.headers(self._auth_token))
-        return d.addCallback(http.check_success, [204])
-
-    def add_alarm(self, policy_id, entity_id, notification_plan_id, check_id, alarm_template):
-        """Add an alarm."""
-        d = treq.post(
-            http.append_segments(self._endpoint, 'entities', entity_id, 'alarms'),
-            headers=http.headers(self._auth_token),
-            data=json.dumps(alarm_template))
-        d.addCallback(http.check_success, [201])
+        d = self._request('DELETE', http.append_segments(
+            self._endpoint, 'entities', entity_id, 'checks', check_id))
+        return d.addCallback(http.check_success, [204, 404])
 
-        def get_alarm(result):
-            location = result.headers.getRawHeaders('Location')[0]
-            return treq.get(location, headers=http.headers(self._auth_token))
-        d.addCallback(get_alarm)
-        d.addCallback(http.check_success, [200])
-        return d.addCallback(treq.json_content)
+    @timed('maas')
+    def add_alarm(self, policy_id, entity_id, notification_plan_id, check_id, alarm_template,
+                  fetch=False):
+        """Add an alarm.
+
+        The alarm is built from the template and the id MaaS gives it, unless
+        ``fetch`` is set, in which case it is read back from MaaS to get the
+        fields MaaS fills in.  A template that is a string is the alarm's
+        criteria.  The policy id is kept in the alarm's metadata.
+        """
+        if isinstance(alarm_template, dict):
+            alarm = dict(alarm_template)
+        else:
+            alarm = {'criteria': alarm_template}
+        alarm.update(check_id=check_id, notification_plan_id=notification_plan_id)
+        return self._create_policy_object(
+            'add_alarm', http.append_segments(self._endpoint, 'entities', entity_id, 'alarms'),
+            _tag_with_policy(alarm, policy_id), policy_id, fetch)
 
+    @timed('maas')
     def remove_alarm(self, entity_id, alarm_id):
         """Remove an alarm."""
-        d = treq.delete(http.append_segments(
-            self._endpoint, 'entities', entity_id, 'alarms', alarm_id),
-            headers=http.headers(self._auth_token))
-        return d.addCallback(http.check_success, [204])
+        d = self._request('DELETE', http.append_segments(
+            self._endpoint, 'entities', entity_id, 'alarms', alarm_id))
+        return d.addCallback(http.check_success, [204, 404])
@@ -0,0 +1,106 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+Deduplication of policy executions.
+"""
+from otter.log import log
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+from bobby import cass
+
+
+class ExecutionTracker(object):
+    """
+    Keeps a policy from being executed more than once per cooldown.
+
+    Executions of a policy requested while one is already running share its
+    result, and those requested within ``cooldown`` seconds of a successful
+    one are dropped.  A failed execution doesn't start a cooldown.
+
+    With a ``db``, executions are also recorded in Cassandra with a TTL of
+    the cooldown, so that every node sharing the database honours them.  The
+    check and the record aren't atomic, so two nodes may still occasionally
+    execute the same policy at once.
+
+    :param db: A CQL client, or None to keep cooldowns in memory only.
+    :param cooldown: How long, in seconds, after an execution to drop others.
+    :param clock: An IReactorTime provider.
+    """
+
+    def __init__(self, db=None, cooldown=300, clock=reactor):
+        self._db = db
+        self._cooldown = cooldown
+        self._clock = clock
+        self._in_flight = {}
+        self._executed_at = {}
+        self.executed = 0
+        self.suppressed = 0
+
+    def run(self, policy_id, execute):
+        """
+        Execute a policy unless it is already running or cooling down.
+
+        :param execute: A callable taking the policy id and returning a
+            Deferred that fires once the policy has been executed.
+        :return: A Deferred that fires with the result of the execution, or
+            None if it was suppressed.
+        """
+        if policy_id in self._in_flight:
+            self.suppressed += 1
+            waiter = defer.Deferred()
+            self._in_flight[policy_id].append(waiter)
+            return waiter
+
+        if self._cooling_down(policy_id, self._executed_at.get(policy_id)):
+            self.suppressed += 1
+            return defer.succeed(None)
+
+        waiters = self._in_flight[policy_id] = []
+        if self._db is None:
+            d = defer.succeed(None)
+        else:
+            d = cass.get_policy_execution(self._db, policy_id)
+
+        def maybe_execute(executed_at):
+            if self._cooling_down(policy_id, executed_at):
+                self._executed_at[policy_id] = executed_at
+                self.suppressed += 1
+                return None
+            d = defer.maybeDeferred(execute, policy_id)
+            return d.addCallback(self._record, policy_id)
+        d.addCallback(maybe_execute)
+
+        def finished(result):
+            del self._in_flight[policy_id]
+            for waiter in waiters:
+                if isinstance(result, Failure):
+                    waiter.errback(result)
+                else:
+                    waiter.callback(result)
+            return result
+        return d.addBoth(finished)
+
+    def _cooling_down(self, policy_id, executed_at):
+        if executed_at is None:
+            return False
+        if executed_at + self._cooldown > self._clock.seconds():
+            return True
+        self._executed_at.pop(policy_id, None)
+        return False
+
+    def _record(self, result, policy_id):
+        now = self._clock.seconds()
+        self.executed += 1
+        self._executed_at[policy_id] = now
+        if self._db is None:
+            return result
+
+        d = cass.record_policy_execution(self._db, policy_id, now, self._cooldown)
+        d.addErrback(log.err, 'Failed to record policy execution', policy_id=policy_id)
+        return d.addCallback(lambda _: result)
+
+    def metrics(self):
+        """Get the number of executions run, suppressed and in flight."""
+        return {'executed': self.executed,
+                'suppressed': self.suppressed,
+                'in_flight': len(self._in_flight)}
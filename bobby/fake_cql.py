@@ -0,0 +1,403 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+An in-memory stand-in for Cassandra, for tests and benchmarks.
+
+:class:`FakeCQLClient` has the ``execute(query, params, consistency)``
+interface of a :class:`silverberg.client.CQLClient`, and understands the
+tables in ``schema/setup`` and the queries :mod:`bobby.cass` makes of them:
+``SELECT * ... WHERE ... [LIMIT n]``, ``INSERT ... [USING TTL n]``, ``UPDATE``
+(including counters), ``DELETE`` and batches of them.
+
+Like Cassandra, a query must restrict the partition key, or else an indexed
+column, with ``=`` or ``IN``; anything else is refused with an
+:class:`InvalidRequestException` rather than scanning the table.
+"""
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+import os
+import re
+
+from silverberg.cassandra.ttypes import InvalidRequestException
+from twisted.internet import defer, reactor, task
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'schema', 'setup',
+                           'control_11_create_tables.cql')
+
+_TABLE = re.compile(r'CREATE COLUMNFAMILY (\w+) \((.*?)\);', re.S)
+_INDEX = re.compile(r'CREATE INDEX (?:\w+ )?ON (\w+) ?\("?(\w+)"?\);')
+_COLUMN = re.compile(r'"?(\w+)"? (\w+)')
+_PRIMARY_KEY = re.compile(r'PRIMARY KEY\s*\((.*?)\)')
+
+_SELECT = re.compile(r'SELECT \* FROM (\w+)(?: WHERE (.*?))?(?: LIMIT (\d+))?$')
+_INSERT = re.compile(r'INSERT INTO (\w+) \((.*?)\) VALUES \((.*?)\)(?: USING TTL (\d+))?$')
+_UPDATE = re.compile(r'UPDATE (\w+) SET (.*?) WHERE (.*)$')
+_DELETE = re.compile(r'DELETE FROM (\w+) WHERE (.*)$')
+_BATCH = re.compile(r'BEGIN (?:UNLOGGED )?BATCH (.*) APPLY BATCH$')
+_STATEMENT = re.compile(r' (?=(?:INSERT|UPDATE|DELETE) )')
+_CONDITION = re.compile(r'"?(\w+)"?\s*(=|>=|<=|>|<| IN )\s*(.+)', re.I)
+_ASSIGNMENT = re.compile(r'"?(\w+)"?\s*=\s*(?:"?(\w+)"? ([+-]) )?(.+)')
+
+_RANGES = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+
+
+class Table(object):
+    """
+    The columns, primary key and indexes of a table.
+
+    :ivar partition_key: The name of the partition key column.
+    :ivar clustering_keys: The names of the clustering key columns.
+    :ivar indexes: The names of the columns with secondary indexes.
+    """
+
+    def __init__(self, name, columns, primary_key, indexes=()):
+        self.name = name
+        self.columns = columns
+        self.primary_key = primary_key
+        self.partition_key = primary_key[0]
+        self.clustering_keys = primary_key[1:]
+        self.indexes = set(indexes)
+
+
+def parse_schema(cql):
+    """
+    Get the tables created by a CQL schema.
+
+    :return: A dict of table names to :class:`Table`.
+    """
+    cql = re.sub(r'/\*.*?\*/', '', cql, flags=re.S)
+    tables = {}
+    for name, body in _TABLE.findall(cql):
+        primary_key = [column.strip().strip('"')
+                       for column in _PRIMARY_KEY.search(body).group(1).split(',')]
+        columns = dict((column, column_type) for column, column_type
+                       in _COLUMN.findall(_PRIMARY_KEY.sub('', body)))
+        tables[name] = Table(name, columns, primary_key)
+    for name, column in _INDEX.findall(cql):
+        tables[name].indexes.add(column)
+    return tables
+
+
+def _value(literal, params):
+    if literal.startswith(':'):
+        value = params[literal[1:]]
+        # Cassandra gives back bytes, whatever it was given.
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+    if literal.startswith("'"):
+        return literal[1:-1]
+    if literal in ('true', 'false'):
+        return literal == 'true'
+    return int(literal)
+
+
+def _bind(conditions, params):
+    return [(column, op, [_value(value, params) for value in values])
+            for column, op, values in conditions]
+
+
+class _Partition(object):
+    """The rows of one partition, by clustering key, and those keys in order."""
+
+    def __init__(self):
+        self.rows = {}
+        self.keys = []
+
+    def add(self, key, row):
+        if key not in self.rows:
+            insort(self.keys, key)
+        self.rows[key] = row
+
+    def remove(self, key):
+        del self.rows[key]
+        del self.keys[bisect_left(self.keys, key)]
+
+
+class FakeCQLClient(object):
+    """
+    A CQL client that keeps its tables in memory.
+
+    Each table is a dict of partitions, each of which keeps its rows in a
+    dict by clustering key along with a sorted list of those keys, so reads
+    of a row, a partition or a slice of one never scan the table.  Secondary
+    indexes are dicts of column values to primary keys.
+
+    Results are returned after ``latency`` seconds, which stands in for the
+    round trip to Cassandra.
+
+    :param tables: A dict of table names to :class:`Table`.
+    :param latency: How long, in seconds, each query takes.
+    :param clock: An IReactorTime provider.
+    """
+
+    def __init__(self, tables, latency=0, clock=reactor):
+        self._tables = tables
+        self._latency = latency
+        self._clock = clock
+        self._partitions = dict((name, {}) for name in tables)
+        self._indexes = dict((name, dict((column, {}) for column in table.indexes))
+                             for name, table in tables.items())
+        self._expiry = {}
+        self._plans = {}
+        self.queries = 0
+
+    @classmethod
+    def from_schema(cls, path=SCHEMA_PATH, **kwargs):
+        """Create a client for the tables in a CQL schema file."""
+        with open(path) as f:
+            return cls(parse_schema(f.read()), **kwargs)
+
+    def rows(self, table):
+        """Get every row of a table."""
+        return [dict(row)
+                for partition_value, partition in sorted(self._partitions[table].items())
+                for key, row in sorted(partition.rows.items())
+                if not self._expired(table, partition_value, key)]
+
+    def execute(self, query, params, consistency):
+        """Run a query, see :meth:`silverberg.client.CQLClient.execute`."""
+        self.queries += 1
+        try:
+            plan = self._plans.get(query)
+            if plan is None:
+                plan = self._plans[query] = self._prepare(query.strip().rstrip(';').strip())
+            result = plan(params)
+        except Exception:
+            return defer.fail()
+        if not self._latency:
+            return defer.succeed(result)
+        return task.deferLater(self._clock, self._latency, lambda: result)
+
+    def _prepare(self, query):
+        """
+        Parse a query into a function that runs it with a dict of params.
+
+        :mod:`bobby.cass` runs the same few query strings over and over, so
+        each is only parsed once.
+        """
+        match = _BATCH.match(query)
+        if match:
+            plans = [self._prepare(statement.strip())
+                     for statement in _STATEMENT.split(match.group(1))]
+
+            def batch(params):
+                for plan in plans:
+                    plan(params)
+            return batch
+
+        match = _SELECT.match(query)
+        if match:
+            table, where, limit = match.groups()
+            conditions = self._conditions(table, where)
+
+            def select(params):
+                rows = self._select(table, _bind(conditions, params))
+                if limit is not None:
+                    rows = islice(rows, int(limit))
+                return [dict(row) for row in rows]
+            return select
+
+        match = _INSERT.match(query)
+        if match:
+            table, columns, values, ttl = match.groups()
+            columns = [column.strip().strip('"') for column in columns.split(',')]
+            values = [value.strip() for value in values.split(',')]
+            self._check_columns(table, columns)
+
+            def insert(params):
+                self._upsert(table, dict((column, _value(value, params))
+                                         for column, value in zip(columns, values)),
+                             int(ttl) if ttl is not None else None)
+            return insert
+
+        match = _UPDATE.match(query)
+        if match:
+            table, assignments, where = match.groups()
+            conditions = self._conditions(table, where)
+            for column, op, values in conditions:
+                if op != '=' or len(values) != 1 or column not in self._tables[table].primary_key:
+                    raise InvalidRequestException(
+                        why='UPDATE must set the whole primary key of {0}'.format(table))
+            assignments = [_ASSIGNMENT.match(assignment.strip()).groups()
+                           for assignment in assignments.split(',')]
+            self._check_columns(table, [column for column, _, _, _ in assignments])
+
+            def update(params):
+                key = dict((column, values[0])
+                           for column, _, values in _bind(conditions, params))
+                row = self._get(table, key) or {}
+                updates = {}
+                for column, counter, sign, value in assignments:
+                    value = _value(value, params)
+                    if counter:
+                        value = (row.get(column) or 0) + (value if sign == '+' else -value)
+                    updates[column] = value
+                updates.update(key)
+                self._upsert(table, updates)
+            return update
+
+        match = _DELETE.match(query)
+        if match:
+            table, where = match.groups()
+            conditions = self._conditions(table, where)
+
+            def delete(params):
+                for row in list(self._select(table, _bind(conditions, params))):
+                    self._delete(table, row)
+            return delete
+
+        raise InvalidRequestException(why='Unsupported query: {0}'.format(query))
+
+    def _check_columns(self, table, columns):
+        if table not in self._tables:
+            raise InvalidRequestException(why='unconfigured columnfamily {0}'.format(table))
+        for column in columns:
+            if column not in self._tables[table].columns:
+                raise InvalidRequestException(why='Undefined name {0}'.format(column))
+
+    def _conditions(self, table, where):
+        """Parse a WHERE clause into a list of (column, op, literals) conditions."""
+        conditions = []
+        for condition in (where or '').split(' AND '):
+            if not condition.strip():
+                continue
+            column, op, value = _CONDITION.match(condition.strip()).groups()
+            op = op.strip().upper()
+            if op == 'IN':
+                values = [v.strip() for v in value.strip().strip('()').split(',')]
+                op = '='
+            else:
+                values = [value.strip()]
+            conditions.append((column, op, values))
+        self._check_columns(table, [condition[0] for condition in conditions])
+        return conditions
+
+    def _partition_key(self, table, row):
+        return row[self._tables[table].partition_key]
+
+    def _clustering_key(self, table, row):
+        return tuple([row[column] for column in self._tables[table].clustering_keys])
+
+    def _expired(self, table, partition_value, key):
+        expires = self._expiry.get((table, partition_value, key))
+        return expires is not None and expires <= self._clock.seconds()
+
+    def _get(self, table, values):
+        partition = self._partitions[table].get(self._partition_key(table, values))
+        if partition is None:
+            return None
+        key = self._clustering_key(table, values)
+        row = partition.rows.get(key)
+        if row is None or self._expired(table, self._partition_key(table, values), key):
+            return None
+        return row
+
+    def _upsert(self, table, values, ttl=None):
+        t = self._tables[table]
+        partition_value = self._partition_key(table, values)
+        key = self._clustering_key(table, values)
+        partition = self._partitions[table].get(partition_value)
+        if partition is None:
+            partition = self._partitions[table][partition_value] = _Partition()
+
+        row = self._get(table, values)
+        if row is None:
+            if key in partition.rows:
+                self._delete(table, partition.rows[key])
+                partition = self._partitions[table].setdefault(partition_value, partition)
+            row = dict.fromkeys(t.columns)
+            row.update((column, values[column]) for column in t.primary_key)
+            partition.add(key, row)
+
+        for column, value in values.items():
+            if column in t.indexes and row[column] != value:
+                self._unindex(table, column, row)
+                self._indexes[table][column].setdefault(value, set()).add(
+                    (partition_value, key))
+            row[column] = value
+
+        if ttl is not None:
+            self._expiry[(table, partition_value, key)] = self._clock.seconds() + ttl
+        return row
+
+    def _unindex(self, table, column, row):
+        keys = self._indexes[table][column].get(row[column])
+        if keys is not None:
+            keys.discard((self._partition_key(table, row), self._clustering_key(table, row)))
+            if not keys:
+                del self._indexes[table][column][row[column]]
+
+    def _delete(self, table, row):
+        partition_value = self._partition_key(table, row)
+        key = self._clustering_key(table, row)
+        partition = self._partitions[table][partition_value]
+        partition.remove(key)
+        if not partition.rows:
+            del self._partitions[table][partition_value]
+        for column in self._tables[table].indexes:
+            self._unindex(table, column, row)
+        self._expiry.pop((table, partition_value, key), None)
+
+    def _select(self, table, conditions):
+        """Yield the rows matching a query's conditions, in clustering order."""
+        t = self._tables[table]
+        equal = dict((column, values) for column, op, values in conditions if op == '=')
+
+        if t.partition_key in equal:
+            for partition_value in sorted(set(equal[t.partition_key])):
+                partition = self._partitions[table].get(partition_value)
+                if partition is not None:
+                    for row in self._select_partition(table, partition_value, partition,
+                                                      conditions):
+                        yield row
+            return
+
+        indexed = [column for column in equal if column in t.indexes]
+        if not indexed:
+            raise InvalidRequestException(
+                why='No indexed columns present in by-columns clause with Equal operator')
+        keys = set()
+        for value in equal[indexed[0]]:
+            keys.update(self._indexes[table][indexed[0]].get(value, ()))
+        for partition_value, key in sorted(keys):
+            row = self._partitions[table][partition_value].rows[key]
+            if self._matches(table, partition_value, key, row, conditions):
+                yield row
+
+    def _select_partition(self, table, partition_value, partition, conditions):
+        keys = partition.keys
+        start = 0
+        clustering_keys = self._tables[table].clustering_keys
+        if len(clustering_keys) == 1:
+            for column, op, values in conditions:
+                if column != clustering_keys[0]:
+                    continue
+                if op == '=':
+                    keys = [(value,) for value in sorted(set(values))
+                            if (value,) in partition.rows]
+                    start = 0
+                    break
+                if op in ('>', '>='):
+                    bisect = bisect_right if op == '>' else bisect_left
+                    start = bisect(keys, (values[0],))
+        for key in islice(keys, start, None):
+            row = partition.rows[key]
+            if self._matches(table, partition_value, key, row, conditions):
+                yield row
+
+    def _matches(self, table, partition_value, key, row, conditions):
+        if self._expired(table, partition_value, key):
+            return False
+        for column, op, values in conditions:
+            if op == '=':
+                if row[column] not in values:
+                    return False
+            elif not _RANGES[op](row[column], values[0]):
+                return False
+        return True
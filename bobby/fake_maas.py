@@ -0,0 +1,267 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+A local stand-in for the parts of the MaaS API that :class:`bobby.ele.MaasClient` uses.
+
+Serve :attr:`FakeMaaS.app` with a :class:`twisted.web.server.Site`, and give
+bobby a service catalog pointing at it (see :meth:`FakeMaaS.service_catalog`).
+Its latency, rate limit and error rate can be set to see how bobby copes
+with a slow, busy or failing MaaS.
+"""
+from functools import wraps
+import json
+import math
+import random
+import uuid
+
+from klein import Klein
+from twisted.internet import reactor, task
+
+
+def _endpoint(f):
+    """Run a route through :meth:`FakeMaaS._handle`, as an endpoint named after it."""
+    @wraps(f)
+    def _(self, request, *args, **kwargs):
+        return self._handle(f.__name__, request, f, self, request, *args, **kwargs)
+    return _
+
+
+class FakeMaaS(object):
+    """
+    Entities, checks, alarms, notifications and notification plans, kept in memory.
+
+    Each endpoint is named after the method that handles it, such as
+    ``create_check``.  ``latency`` and ``error_rate`` may be given as a dict
+    of endpoint names to values, with a ``'default'`` for the rest, or as a
+    single value for every endpoint.
+
+    Requests beyond ``rate_limit`` in a ``rate_period`` are refused with a
+    429 and a ``Retry-After`` header, as MaaS does, and a randomly chosen
+    ``error_rate`` of the rest fail with ``error_code`` without changing
+    anything.
+
+    :param latency: How long, in seconds, requests take.
+    :param rate_limit: The number of requests allowed in each period, or
+        None for no limit.
+    :param rate_period: The length, in seconds, of a rate limit period.
+    :param error_rate: The fraction of requests that fail.
+    :param error_code: The response code of failed requests.
+    :param seed: A seed for choosing which requests fail.
+    :param clock: An IReactorTime provider.
+    """
+
+    app = Klein()
+
+    def __init__(self, latency=0, rate_limit=None, rate_period=1, error_rate=0,
+                 error_code=500, seed=None, clock=reactor):
+        self._latency = latency
+        self._rate_limit = rate_limit
+        self._rate_period = rate_period
+        self._error_rate = error_rate
+        self._error_code = error_code
+        self._random = random.Random(seed)
+        self._clock = clock
+
+        self._period = None
+        self._period_requests = 0
+
+        self.objects = {
+            'entities': {},
+            'checks': {},
+            'alarms': {},
+            'notifications': {},
+            'notification_plans': {},
+        }
+        self.requests = {}
+        self.throttled = {}
+        self.errors = {}
+
+    @staticmethod
+    def service_catalog(url):
+        """Get a service catalog whose monitoring endpoint is ``url``."""
+        return [{'name': 'cloudMonitoring', 'endpoints': [{'publicURL': url}]}]
+
+    def metrics(self):
+        """Get the number of requests, throttled requests and errors, by endpoint."""
+        return {'requests': dict(self.requests),
+                'throttled': dict(self.throttled),
+                'errors': dict(self.errors)}
+
+    def _setting(self, setting, endpoint):
+        if isinstance(setting, dict):
+            return setting.get(endpoint, setting.get('default', 0))
+        return setting
+
+    def _throttle(self):
+        """Count a request against the rate limit, returning how long to wait if it's over."""
+        if self._rate_limit is None:
+            return None
+        now = self._clock.seconds()
+        period = int(now // self._rate_period)
+        if period != self._period:
+            self._period = period
+            self._period_requests = 0
+        self._period_requests += 1
+        if self._period_requests <= self._rate_limit:
+            return None
+        return max(1, int(math.ceil((period + 1) * self._rate_period - now)))
+
+    def _handle(self, endpoint, request, f, *args, **kwargs):
+        """
+        Throttle, fail or run a request to an endpoint, and respond once its latency has passed.
+
+        :param f: A callable returning a tuple of the response code, and
+            optionally a body and the id of a created object.
+        """
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        headers = {}
+        retry_after = self._throttle()
+        if retry_after is not None:
+            self.throttled[endpoint] = self.throttled.get(endpoint, 0) + 1
+            headers['Retry-After'] = str(retry_after)
+            response = (429, {'type': 'overLimit', 'message': 'Rate limit exceeded'})
+        elif self._random.random() < self._setting(self._error_rate, endpoint):
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            response = (self._error_code, {'type': 'internalError', 'message': 'Injected error'})
+        else:
+            response = f(*args, **kwargs)
+
+        code, body, object_id = (response + (None, None))[:3]
+        if object_id is not None:
+            headers['X-Object-Id'] = object_id
+            headers['Location'] = str(request.URLPath().child(object_id))
+
+        def respond():
+            request.setResponseCode(code)
+            for name, value in headers.items():
+                request.setHeader(name, value)
+            if body is None:
+                return ''
+            request.setHeader('Content-Type', 'application/json')
+            return json.dumps(body)
+        latency = self._setting(self._latency, endpoint)
+        if not latency:
+            return respond()
+        return task.deferLater(self._clock, latency, respond)
+
+    def _create(self, request, kind, prefix, **fields):
+        object_id = '{0}{1}'.format(prefix, uuid.uuid4().hex[:10])
+        body = request.content.read()
+        try:
+            obj = json.loads(body)
+        except ValueError:
+            obj = {'criteria': body}
+        if not isinstance(obj, dict):
+            obj = {'criteria': obj}
+        obj.update(fields, id=object_id)
+        self.objects[kind][object_id] = obj
+        return (201, None, object_id)
+
+    def _list(self, kind, **fields):
+        values = [obj for obj in self.objects[kind].values()
+                  if all(obj.get(name) == value for name, value in fields.items())]
+        return (200, {'values': values, 'metadata': {'count': len(values), 'next_href': None}})
+
+    def _get(self, kind, object_id):
+        obj = self.objects[kind].get(object_id)
+        if obj is None:
+            return (404,)
+        return (200, obj)
+
+    def _delete(self, kind, object_id):
+        if self.objects[kind].pop(object_id, None) is None:
+            return (404,)
+        return (204,)
+
+    @app.route('/entities', methods=['POST'])
+    @_endpoint
+    def create_entity(self, request):
+        """Create an entity."""
+        return self._create(request, 'entities', 'en')
+
+    @app.route('/entities', methods=['GET'])
+    @_endpoint
+    def list_entities(self, request):
+        """List the entities."""
+        return self._list('entities')
+
+    @app.route('/entities/<string:entity_id>', methods=['DELETE'])
+    @_endpoint
+    def delete_entity(self, request, entity_id):
+        """Delete an entity."""
+        return self._delete('entities', entity_id)
+
+    @app.route('/entities/<string:entity_id>/checks', methods=['POST'])
+    @_endpoint
+    def create_check(self, request, entity_id):
+        """Create a check on an entity."""
+        if entity_id not in self.objects['entities']:
+            return (404,)
+        return self._create(request, 'checks', 'ch', entity_id=entity_id)
+
+    @app.route('/entities/<string:entity_id>/checks', methods=['GET'])
+    @_endpoint
+    def list_checks(self, request, entity_id):
+        """List an entity's checks."""
+        return self._list('checks', entity_id=entity_id)
+
+    @app.route('/entities/<string:entity_id>/checks/<string:check_id>', methods=['GET'])
+    @_endpoint
+    def get_check(self, request, entity_id, check_id):
+        """Get a check."""
+        return self._get('checks', check_id)
+
+    @app.route('/entities/<string:entity_id>/checks/<string:check_id>', methods=['DELETE'])
+    @_endpoint
+    def delete_check(self, request, entity_id, check_id):
+        """Delete a check."""
+        return self._delete('checks', check_id)
+
+    @app.route('/entities/<string:entity_id>/alarms', methods=['POST'])
+    @_endpoint
+    def create_alarm(self, request, entity_id):
+        """Create an alarm on an entity."""
+        if entity_id not in self.objects['entities']:
+            return (404,)
+        return self._create(request, 'alarms', 'al', entity_id=entity_id)
+
+    @app.route('/entities/<string:entity_id>/alarms', methods=['GET'])
+    @_endpoint
+    def list_alarms(self, request, entity_id):
+        """List an entity's alarms."""
+        return self._list('alarms', entity_id=entity_id)
+
+    @app.route('/entities/<string:entity_id>/alarms/<string:alarm_id>', methods=['GET'])
+    @_endpoint
+    def get_alarm(self, request, entity_id, alarm_id):
+        """Get an alarm."""
+        return self._get('alarms', alarm_id)
+
+    @app.route('/entities/<string:entity_id>/alarms/<string:alarm_id>', methods=['DELETE'])
+    @_endpoint
+    def delete_alarm(self, request, entity_id, alarm_id):
+        """Delete an alarm."""
+        return self._delete('alarms', alarm_id)
+
+    @app.route('/notifications', methods=['POST'])
+    @_endpoint
+    def create_notification(self, request):
+        """Create a notification."""
+        return self._create(request, 'notifications', 'nt')
+
+    @app.route('/notifications/<string:notification_id>', methods=['DELETE'])
+    @_endpoint
+    def delete_notification(self, request, notification_id):
+        """Delete a notification."""
+        return self._delete('notifications', notification_id)
+
+    @app.route('/notification_plans', methods=['POST'])
+    @_endpoint
+    def create_notification_plan(self, request):
+        """Create a notification plan."""
+        return self._create(request, 'notification_plans', 'np')
+
+    @app.route('/notification_plans/<string:plan_id>', methods=['DELETE'])
+    @_endpoint
+    def delete_notification_plan(self, request, plan_id):
+        """Delete a notification plan."""
+        return self._delete('notification_plans', plan_id)
@@ -0,0 +1,112 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+Background jobs, for requests that shouldn't wait for their work to finish.
+"""
+import uuid
+
+from otter.log import log
+from twisted.internet import defer, reactor
+
+
+class Job(object):
+    """
+    A unit of work run in the background.
+
+    :ivar status: One of ``'pending'``, ``'running'``, ``'succeeded'`` or
+        ``'failed'``.
+    :ivar result: The result of a job that succeeded.
+    :ivar error: The error message of a job that failed.
+    :ivar progress: A dict of how many of its items a job has ``done`` out of
+        its ``total``, if it reports its progress, or None.
+    """
+
+    def __init__(self, job_id, tenant_id):
+        self.id = job_id
+        self.tenant_id = tenant_id
+        self.status = 'pending'
+        self.result = None
+        self.error = None
+        self.progress = None
+
+    def report_progress(self, done, total):
+        """Record that ``done`` of the job's ``total`` items are done."""
+        self.progress = {'done': done, 'total': total}
+
+
+class JobRunner(object):
+    """
+    Runs jobs in the background, at most ``limit`` at once.
+
+    Finished jobs are kept for ``retention`` seconds so that their status can
+    be looked up, and are then forgotten.
+
+    :param limit: The number of jobs that may run at once.
+    :param retention: How long, in seconds, to keep finished jobs for.
+    :param clock: An IReactorTime provider.
+    """
+
+    def __init__(self, limit=10, retention=3600, clock=reactor):
+        self._semaphore = defer.DeferredSemaphore(limit)
+        self._retention = retention
+        self._clock = clock
+        self._jobs = {}
+
+    def submit(self, tenant_id, f, *args, **kwargs):
+        """
+        Run ``f(*args, **kwargs)`` as a job.
+
+        :return: The :class:`Job`.
+        """
+        return self.run(self.create(tenant_id), f, *args, **kwargs)
+
+    def create(self, tenant_id):
+        """
+        Create a job to be run later with :meth:`run`.
+
+        This lets the job be handed to the work it runs, to report progress.
+        """
+        job = Job(uuid.uuid4().hex, tenant_id)
+        self._jobs[job.id] = job
+        return job
+
+    def run(self, job, f, *args, **kwargs):
+        """
+        Run ``f(*args, **kwargs)`` as a job that has been created.
+
+        :return: The :class:`Job`.
+        """
+        tenant_id = job.tenant_id
+
+        def start():
+            job.status = 'running'
+            return f(*args, **kwargs)
+
+        def succeeded(result):
+            job.status = 'succeeded'
+            job.result = result
+
+        def failed(failure):
+            job.status = 'failed'
+            job.error = failure.getErrorMessage()
+            log.err(failure, 'Job failed', job_id=job.id, tenant_id=tenant_id)
+
+        def finished(_):
+            self._clock.callLater(self._retention, self._jobs.pop, job.id, None)
+        d = self._semaphore.run(start)
+        d.addCallbacks(succeeded, failed)
+        d.addCallback(finished)
+        return job
+
+    def get(self, tenant_id, job_id):
+        """Get a tenant's job, or None if there is no such job."""
+        job = self._jobs.get(job_id)
+        if job is None or job.tenant_id != tenant_id:
+            return None
+        return job
+
+    def metrics(self):
+        """Get the number of jobs in each status."""
+        counts = dict.fromkeys(('pending', 'running', 'succeeded', 'failed'), 0)
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return counts
@@ -0,0 +1,181 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+Latency and error metrics for the calls bobby makes to Cassandra and MaaS,
+rendered in the Prometheus text format.
+"""
+from bisect import bisect_left
+from functools import wraps
+
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Histogram(object):
+    """
+    Counts of observed values, in buckets by upper bound.
+
+    :param buckets: The bucket upper bounds, in increasing order.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """Record a value."""
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """Get the number of values at or below each bucket's bound."""
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+def _outcome(failure):
+    """
+    Describe how a call failed: by its HTTP status code if it has one (as
+    :class:`otter.util.http.APIError` does), or else by the type of its error.
+    """
+    code = getattr(failure.value, 'code', None)
+    if code is not None:
+        return str(code)
+    return failure.type.__name__
+
+
+class Metrics(object):
+    """
+    Times calls to Cassandra and MaaS, keeping a :class:`Histogram` for each
+    component, operation and outcome.
+
+    The outcome of a call is ``'success'``, the HTTP status code of a failed
+    MaaS call, or the name of the error a call failed with.
+
+    When not ``enabled``, calls are passed straight through untimed.
+
+    :param enabled: Whether to time calls.
+    :param buckets: The histogram bucket bounds, in seconds.
+    :param clock: An IReactorTime provider.
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS, clock=reactor):
+        self.enabled = enabled
+        self._buckets = buckets
+        self._clock = clock
+        self._histograms = {}
+
+    def observe(self, component, operation, outcome, seconds):
+        """Record that a call took ``seconds``."""
+        key = (component, operation, outcome)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self._buckets)
+        histogram.observe(seconds)
+
+    def time(self, component, operation, f, *args, **kwargs):
+        """
+        Call ``f(*args, **kwargs)``, timing it until the Deferred it returns fires.
+
+        :return: The result of ``f``.
+        """
+        if not self.enabled:
+            return f(*args, **kwargs)
+
+        start = self._clock.seconds()
+        try:
+            result = f(*args, **kwargs)
+        except Exception:
+            self.observe(component, operation, _outcome(Failure()),
+                         self._clock.seconds() - start)
+            raise
+
+        if not isinstance(result, defer.Deferred):
+            self.observe(component, operation, 'success', self._clock.seconds() - start)
+            return result
+
+        def finished(result):
+            if isinstance(result, Failure):
+                outcome = _outcome(result)
+            else:
+                outcome = 'success'
+            self.observe(component, operation, outcome, self._clock.seconds() - start)
+            return result
+        return result.addBoth(finished)
+
+    def histograms(self):
+        """Get the histograms, keyed by (component, operation, outcome)."""
+        return dict(self._histograms)
+
+    def render(self, families=()):
+        """
+        Render the histograms, and any other metrics, in the Prometheus text format.
+
+        :param families: A list of ``(name, type, help, samples)`` tuples of
+            other metrics, where ``samples`` is a list of ``(labels, value)``.
+        :return: The metrics as a str.
+        """
+        components = {}
+        for (component, operation, outcome), histogram in sorted(self._histograms.items()):
+            components.setdefault(component, []).append((operation, outcome, histogram))
+
+        lines = []
+        for component, histograms in sorted(components.items()):
+            name = 'bobby_{0}_operation_seconds'.format(component)
+            lines.append('# HELP {0} Time taken by {1} operations.'.format(name, component))
+            lines.append('# TYPE {0} histogram'.format(name))
+            for operation, outcome, histogram in histograms:
+                labels = {'operation': operation, 'outcome': outcome}
+                for bound, count in zip(histogram.buckets, histogram.cumulative_counts()):
+                    lines.append(_sample(name + '_bucket', dict(labels, le=repr(float(bound))),
+                                         count))
+                lines.append(_sample(name + '_bucket', dict(labels, le='+Inf'), histogram.count))
+                lines.append(_sample(name + '_sum', labels, histogram.sum))
+                lines.append(_sample(name + '_count', labels, histogram.count))
+
+        for name, metric_type, help_text, samples in families:
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+            for labels, value in samples:
+                lines.append(_sample(name, labels, value))
+        return ''.join(line + '\n' for line in lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join('{0}="{1}"'.format(key, _escape(labels[key]))
+                               for key in sorted(labels)) + '}'
+    return '{0} {1}'.format(name, repr(float(value)))
+
+
+registry = Metrics()
+
+
+def timed(component):
+    """
+    Time every call to the decorated function in :data:`registry`, as an
+    operation named after the function.
+    """
+    def decorator(f):
+        operation = f.__name__
+
+        @wraps(f)
+        def _(*args, **kwargs):
+            return registry.time(component, operation, f, *args, **kwargs)
+        return _
+    return decorator
@@ -0,0 +1,129 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+A pool of CQL clients spread across several Cassandra hosts.
+"""
+from collections import deque
+
+from thrift.transport.TTransport import TTransportException
+from twisted.internet import defer, error, reactor
+from twisted.python.failure import Failure
+
+
+_CONNECTION_ERRORS = (error.ConnectError, error.ConnectionClosed, TTransportException)
+
+
+class _Member(object):
+    """A single client, and how many queries it is running."""
+
+    def __init__(self, host, client):
+        self.host = host
+        self.client = client
+        self.outstanding = 0
+
+
+class CQLClientPool(object):
+    """
+    Spreads queries over several CQL clients.
+
+    It has the same ``execute(query, params, consistency)`` interface as a
+    :class:`silverberg.client.CQLClient`, so it can be used anywhere one is.
+    Each query goes to the client with the fewest outstanding queries on a
+    host that isn't backing off.  When every client is busy, queries wait in
+    a queue until one frees up.
+
+    A host whose connection fails is avoided for ``backoff`` seconds, doubling
+    on each further failure up to ``max_backoff``.  If every host is backing
+    off, they are all tried anyway rather than failing outright.
+
+    :param hosts: A list of host names.
+    :param client_factory: A callable taking a host and returning a CQL client
+        for it.
+    :param size: The number of clients for each host.
+    :param max_outstanding: The number of queries each client may run at once.
+    :param clock: An IReactorTime provider.
+    """
+
+    def __init__(self, hosts, client_factory, size=1, max_outstanding=8,
+                 backoff=1, max_backoff=60, clock=reactor):
+        self._members = [_Member(host, client_factory(host))
+                         for host in hosts for _ in range(size)]
+        self._max_outstanding = max_outstanding
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._clock = clock
+
+        self._queue = deque()
+        self._failures = dict((host, 0) for host in hosts)
+        self._dead_until = dict((host, 0) for host in hosts)
+
+    @property
+    def in_flight(self):
+        """The number of queries being run."""
+        return sum(member.outstanding for member in self._members)
+
+    @property
+    def queued(self):
+        """The number of queries waiting for a free client."""
+        return len(self._queue)
+
+    def metrics(self):
+        """Get the pool's current in-flight and queued counts, by host."""
+        now = self._clock.seconds()
+        hosts = {}
+        for member in self._members:
+            host = hosts.setdefault(member.host, {
+                'in_flight': 0,
+                'dead': self._dead_until[member.host] > now})
+            host['in_flight'] += member.outstanding
+        return {'in_flight': self.in_flight,
+                'queued': self.queued,
+                'hosts': hosts}
+
+    def execute(self, query, params, consistency):
+        """
+        Execute a CQL query on the least busy client.
+
+        See :meth:`silverberg.client.CQLClient.execute`.
+        """
+        member = self._pick()
+        if member is None:
+            d = defer.Deferred()
+            self._queue.append((d, query, params, consistency))
+            return d
+        return self._execute(member, query, params, consistency)
+
+    def _pick(self):
+        now = self._clock.seconds()
+        live = [m for m in self._members if self._dead_until[m.host] <= now]
+        candidates = [m for m in (live or self._members)
+                      if m.outstanding < self._max_outstanding]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda m: m.outstanding)
+
+    def _execute(self, member, query, params, consistency):
+        member.outstanding += 1
+        d = defer.maybeDeferred(member.client.execute, query, params, consistency)
+
+        def finished(result):
+            member.outstanding -= 1
+            if isinstance(result, Failure) and result.check(*_CONNECTION_ERRORS):
+                self._mark_dead(member.host)
+            else:
+                self._failures[member.host] = 0
+            self._drain()
+            return result
+        return d.addBoth(finished)
+
+    def _mark_dead(self, host):
+        backoff = min(self._backoff * 2 ** self._failures[host], self._max_backoff)
+        self._failures[host] += 1
+        self._dead_until[host] = self._clock.seconds() + backoff
+
+    def _drain(self):
+        while self._queue:
+            member = self._pick()
+            if member is None:
+                return
+            d, query, params, consistency = self._queue.popleft()
+            self._execute(member, query, params, consistency).chainDeferred(d)
@@ -0,0 +1,132 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+A CQL client that prepares its queries.
+
+The functions in :mod:`bobby.cass` only ever run a fixed set of query strings,
+so rather than having Cassandra parse each one on every call, each query is
+prepared once per connection and afterwards executed by its prepared id.
+"""
+import re
+import struct
+
+from silverberg.cassandra import ttypes
+from silverberg.client import CQLClient
+from silverberg.marshal import unmarshallers
+from twisted.internet import defer
+
+
+_BIND_MARKER = re.compile(r':(\w+)')
+
+_LONG_TYPES = ('org.apache.cassandra.db.marshal.LongType',
+               'org.apache.cassandra.db.marshal.CounterColumnType')
+_INT_TYPE = 'org.apache.cassandra.db.marshal.Int32Type'
+_BOOLEAN_TYPE = 'org.apache.cassandra.db.marshal.BooleanType'
+
+
+def _serialize(value_type, value):
+    """Serialize a python value into the bytes Cassandra expects for a type."""
+    if value_type in _LONG_TYPES:
+        return struct.pack('>q', value)
+    if value_type == _INT_TYPE:
+        return struct.pack('>i', value)
+    if value_type == _BOOLEAN_TYPE:
+        return '\x01' if value else '\x00'
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _is_unprepared(failure):
+    """Whether a failure means the server has forgotten a prepared query."""
+    if not failure.check(ttypes.InvalidRequestException):
+        return False
+    why = failure.value.why or ''
+    return 'Prepared query with ID' in why and 'not found' in why
+
+
+class _Statement(object):
+    """A query prepared on one connection."""
+
+    def __init__(self, item_id, names, types):
+        self.item_id = item_id
+        self.names = names
+        self.types = types
+
+    def values(self, params):
+        """The serialized positional values for a dict of named params."""
+        return [_serialize(t, params[name]) for name, t in zip(self.names, self.types)]
+
+
+class PreparedCQLClient(CQLClient):
+    """
+    A :class:`silverberg.client.CQLClient` that executes prepared statements.
+
+    It has the same ``execute(query, params, consistency)`` interface, so it
+    can be used anywhere a CQLClient is.  Statements are cached per connection
+    and transparently prepared again if the connection is replaced or the
+    server reports that it no longer knows a statement.  Queries with null
+    parameters, which can't be bound, are executed unprepared.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PreparedCQLClient, self).__init__(*args, **kwargs)
+        self._statements = {}
+        self._statements_client = None
+
+    def _prepare(self, client, query):
+        """Get the statement for a query on a connection, preparing if needed."""
+        if client is not self._statements_client:
+            self._statements = {}
+            self._statements_client = client
+
+        if query in self._statements:
+            return defer.succeed(self._statements[query])
+
+        names = _BIND_MARKER.findall(query)
+        d = client.prepare_cql3_query(_BIND_MARKER.sub('?', query), ttypes.Compression.NONE)
+
+        def cache(result):
+            statement = _Statement(result.itemId, names, result.variable_types or [])
+            self._statements[query] = statement
+            return statement
+        return d.addCallback(cache)
+
+    def _execute_prepared(self, client, query, params, consistency):
+        d = self._prepare(client, query)
+
+        def execute(statement):
+            return client.execute_prepared_cql3_query(
+                statement.item_id, statement.values(params), consistency)
+        return d.addCallback(execute)
+
+    def _proc_results(self, result):
+        if result.type == ttypes.CqlResultType.ROWS:
+            return self._unmarshal_result(result.schema, result.rows, unmarshallers)
+        elif result.type == ttypes.CqlResultType.INT:
+            return result.num
+        else:
+            return None
+
+    def execute(self, query, params, consistency):
+        """
+        Execute a CQL query as a prepared statement.
+
+        See :meth:`silverberg.client.CQLClient.execute`.
+        """
+        if None in params.values():
+            return super(PreparedCQLClient, self).execute(query, params, consistency)
+
+        def _execute(client):
+            d = self._execute_prepared(client, query, params, consistency)
+
+            def reprepare(failure):
+                if not _is_unprepared(failure):
+                    return failure
+                self._statements.pop(query, None)
+                return self._execute_prepared(client, query, params, consistency)
+            return d.addErrback(reprepare)
+
+        d = self._connection()
+        d.addCallback(_execute)
+        d.addCallback(self._proc_results)
+        return d
@@ -0,0 +1,117 @@
+# Copyright 2013 Rackspace, Inc.
+"""
+Incremental tracking of policy quorum health.
+
+Rather than reading every serverpolicy for a policy on each alarm, the number
+of serverpolicies and the number of those in a critical state are kept in the
+``policyquorum`` counter table and cached in memory.  A full recount happens
+the first time a process loads a policy, since its stored counters may
+predate the serverpolicies (or the table) they should count; when the counts
+have drifted; and every few times the cached counts expire, to correct counts
+that a lost or repeated counter update has left wrong but plausible.
+"""
+from twisted.internet import defer, reactor
+
+from bobby import cass
+
+
+def _has_drifted((total, critical)):
+    """Whether the counts are impossible, and so need recounting."""
+    return total < 0 or critical < 0 or critical > total
+
+
+class QuorumTracker(object):
+    """In-memory per-policy quorum counts, written through to Cassandra.
+
+    :param db: A CQL client.
+    :param max_age: How long, in seconds, in-memory counts are trusted before
+        being read again from Cassandra (other nodes update them too).
+    :param recount_every: Recount rather than re-read the counts every this
+        many times they expire.
+    :param clock: An IReactorTime provider.
+    """
+
+    def __init__(self, db, max_age=60, recount_every=10, clock=reactor):
+        self._db = db
+        self._max_age = max_age
+        self._recount_every = recount_every
+        self._clock = clock
+        self._counts = {}
+        self._expiries = {}
+
+    def apply(self, policy_id, total_delta, critical_delta):
+        """Apply a delta, already written to Cassandra, to the in-memory counts."""
+        if policy_id not in self._counts:
+            return
+        (total, critical), loaded = self._counts[policy_id]
+        self._counts[policy_id] = (
+            (total + total_delta, critical + critical_delta), loaded)
+
+    def forget(self, policy_id):
+        """Drop the in-memory counts for a policy."""
+        self._counts.pop(policy_id, None)
+        self._expiries.pop(policy_id, None)
+
+    def get_counts(self, policy_id):
+        """
+        Get the quorum counts for a policy.
+
+        :return: A Deferred that fires with a tuple of (total, critical).
+        """
+        if policy_id not in self._counts:
+            return self.recount(policy_id)
+
+        counts, loaded = self._counts[policy_id]
+        if (self._clock.seconds() - loaded < self._max_age and
+                not _has_drifted(counts)):
+            return defer.succeed(counts)
+
+        self._expiries[policy_id] = self._expiries.get(policy_id, 0) + 1
+        if self._expiries[policy_id] % self._recount_every == 0:
+            return self.recount(policy_id)
+
+        d = cass.get_quorum_counts(self._db, policy_id)
+
+        def maybe_recount(counts):
+            if counts is None or _has_drifted(counts):
+                return self.recount(policy_id)
+            self._remember(policy_id, counts)
+            return counts
+        return d.addCallback(maybe_recount)
+
+    def recount(self, policy_id):
+        """
+        Count the policy's serverpolicies and correct the stored counters.
+
+        :return: A Deferred that fires with a tuple of (total, critical).
+        """
+        d = defer.gatherResults([
+            cass.count_policy_states(self._db, policy_id),
+            cass.get_quorum_counts(self._db, policy_id)])
+
+        def correct_counters((actual, stored)):
+            stored = stored or (0, 0)
+            d = defer.succeed(None)
+            if actual != stored:
+                d = cass.update_quorum_counts(
+                    self._db, policy_id,
+                    actual[0] - stored[0], actual[1] - stored[1])
+
+            def remember(_):
+                self._remember(policy_id, actual)
+                return actual
+            return d.addCallback(remember)
+        return d.addCallback(correct_counters)
+
+    def is_healthy(self, policy_id):
+        """
+        Check the health of a policy's quorum.
+
+        :return: A Deferred that fires with True if the quorum is healthy,
+            False if it is unhealthy.
+        """
+        d = self.get_counts(policy_id)
+        return d.addCallback(lambda (total, critical): cass.quorum_is_healthy(total, critical))
+
+    def _remember(self, policy_id, counts):
+        self._counts[policy_id] = (counts, self._clock.seconds())
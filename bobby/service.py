@@ -3,11 +3,26 @@ from twisted.internet import endpoints, reactor
 from twisted.python import usage
 from twisted.web import server
 
-from silverberg.client import CQLClient
-
+from bobby import ele, metrics
+from bobby.pool import CQLClientPool
+from bobby.prepared import PreparedCQLClient
 from bobby.views import Bobby
 
 
+class BobbyService(service.Service):
+    """
+    Stops a :class:`bobby.views.Bobby` with the application, so twistd waits
+    for its queued work before exiting.
+    """
+
+    def __init__(self, bobby):
+        self._bobby = bobby
+
+    def stopService(self):
+        service.Service.stopService(self)
+        return self._bobby.stop()
+
+
 class Options(usage.Options):
     """
     """
@@ -15,20 +30,51 @@ class Options(usage.Options):
         ["port", "p", 9876,
          "The bobby port for API connections."],
         ["cql-host", "h", "localhost",
-         "The CQL host for client communications."],
+         "The CQL hosts for client communications, separated by commas."],
         ["cql-port", "c", 9160,
-         "The CQL port for client communications."]]
+         "The CQL port for client communications."],
+        ["cql-pool-size", None, 2,
+         "The number of CQL connections to open to each host.", int],
+        ["alarm-window", None, 5,
+         "Seconds to coalesce changes to the same alarm for.", float],
+        ["execution-cooldown", None, 300,
+         "Seconds after executing a policy to ignore further executions.", float],
+        ["maas-pool-size", None, ele.MAX_PERSISTENT_PER_HOST,
+         "The number of persistent connections to keep open to MaaS.", int],
+        ["maas-idle-timeout", None, ele.IDLE_TIMEOUT,
+         "Seconds before closing an idle persistent connection to MaaS.", float],
+        ["maas-request-rate", None, ele.REQUESTS_PER_SECOND,
+         "The number of requests a second to send each MaaS tenant.", float],
+        ["maas-burst", None, ele.BURST,
+         "The number of requests that may be sent at once to an idle MaaS tenant.", int]]
+    optFlags = [
+        ["shared-cooldown", None,
+         "Record policy executions in Cassandra, so cooldowns apply across nodes."],
+        ["no-timing", None,
+         "Don't time Cassandra and MaaS calls for the /metrics endpoint."]]
 
 
 def makeService(options):
-    cql_client = CQLClient(
-        endpoints.clientFromString(
-            reactor,
-            "tcp:{0}:{1}".format(options["cql-host"], options["cql-port"])),
-        'bobby')
+    metrics.registry.enabled = not options["no-timing"]
+
+    def connect(host):
+        return PreparedCQLClient(
+            endpoints.clientFromString(
+                reactor,
+                "tcp:{0}:{1}".format(host, options["cql-port"])),
+            'bobby')
+    cql_client = CQLClientPool(
+        [host.strip() for host in options["cql-host"].split(',')],
+        connect,
+        size=options["cql-pool-size"])
     application = service.Application("Dammit, Bobby!")
     services = service.IServiceCollection(application)
-    bobby = Bobby(cql_client)
+    bobby = Bobby(cql_client, options["alarm-window"], options["execution-cooldown"],
+                  options["shared-cooldown"], maas_pool_size=options["maas-pool-size"],
+                  maas_idle_timeout=options["maas-idle-timeout"],
+                  maas_request_rate=options["maas-request-rate"],
+                  maas_burst=options["maas-burst"])
+    BobbyService(bobby).setServiceParent(application)
     bobbyServer = strports.service(
         'tcp:{0}'.format(options["port"]),
         server.Site(bobby.app.resource()))
@@ -0,0 +1,89 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.alarms."""
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from bobby import alarms
+
+
+class TestAlarmQueue(unittest.TestCase):
+    """Test bobby.alarms.AlarmQueue."""
+
+    def setUp(self):
+        """Create a queue whose processing waits to be fired."""
+        self.processing = []
+
+        def process(alarm_id, state):
+            d = defer.Deferred()
+            self.processing.append((alarm_id, state, d))
+            return d
+
+        self.clock = task.Clock()
+        self.queue = alarms.AlarmQueue(process, window=5, clock=self.clock)
+
+    def test_coalesces_within_window(self):
+        """Changes to an alarm within the window are processed once, with the latest state."""
+        self.queue.add('alOne', 'WARNING')
+        self.queue.add('alOne', 'CRITICAL')
+        self.queue.add('alTwo', 'OK')
+        self.clock.advance(4)
+        self.queue.add('alOne', 'OK')
+        self.assertEqual(self.processing, [])
+
+        self.clock.advance(1)
+        self.assertEqual(sorted((a, s) for a, s, _ in self.processing),
+                         [('alOne', 'OK'), ('alTwo', 'OK')])
+        self.assertEqual(self.queue.metrics()['coalesced'], 2)
+
+    def test_one_at_a_time(self):
+        """A change arriving while its alarm is processed waits for it to finish."""
+        self.queue.add('alOne', 'WARNING')
+        self.clock.advance(5)
+        self.queue.add('alOne', 'OK')
+        self.clock.advance(5)
+        self.assertEqual(len(self.processing), 1)
+
+        self.processing[0][2].callback(None)
+        self.clock.advance(5)
+        self.assertEqual([(a, s) for a, s, _ in self.processing],
+                         [('alOne', 'WARNING'), ('alOne', 'OK')])
+
+    def test_failures_logged(self):
+        """A failure to process a change is counted, and doesn't stop later ones."""
+        self.queue.add('alOne', 'WARNING')
+        self.clock.advance(5)
+        self.processing[0][2].errback(ValueError('boom'))
+
+        self.queue.add('alOne', 'OK')
+        self.clock.advance(5)
+        self.processing[1][2].callback(None)
+
+        metrics = self.queue.metrics()
+        self.assertEqual((metrics['failed'], metrics['processed']), (1, 1))
+        self.assertEqual([str(f.value) for f in self.flushLoggedErrors(ValueError)], ['boom'])
+
+    def test_flush(self):
+        """Flushing processes queued changes without waiting for the window."""
+        self.queue.add('alOne', 'WARNING')
+        d = self.queue.flush()
+
+        self.assertEqual(len(self.processing), 1)
+        self.assertNoResult(d)
+        self.processing[0][2].callback(None)
+        self.successResultOf(d)
+        self.assertEqual(self.queue.metrics()['pending'], 0)
+
+    def test_flush_while_processing(self):
+        """A change that arrives while its alarm is processing is flushed after it."""
+        self.queue.add('alOne', 'WARNING')
+        self.clock.advance(5)
+        self.queue.add('alOne', 'OK')
+        d = self.queue.flush()
+
+        self.processing[0][2].callback(None)
+        self.assertNoResult(d)
+        self.assertEqual(self.processing[1][:2], ('alOne', 'OK'))
+        self.processing[1][2].callback(None)
+        self.successResultOf(d)
+        self.assertEqual(self.queue.metrics()['pending'], 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
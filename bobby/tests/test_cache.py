@@ -0,0 +1,121 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.cache."""
+import mock
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from bobby import cache
+
+
+class TestTTLCache(unittest.TestCase):
+    """Test bobby.cache.TTLCache."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = cache.TTLCache(max_size=2, ttl=10, clock=self.clock)
+        self.fetch = mock.Mock(side_effect=lambda: defer.succeed('value'))
+
+    def test_read_through(self):
+        """A miss fetches the value, and later gets are served from the cache."""
+        self.assertEqual(self.successResultOf(self.cache.get('key', self.fetch)), 'value')
+        self.assertEqual(self.successResultOf(self.cache.get('key', self.fetch)), 'value')
+
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertEqual(self.cache.metrics(),
+                         {'size': 1, 'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_expiry(self):
+        """Entries are fetched again once their TTL has passed."""
+        self.cache.get('key', self.fetch)
+        self.clock.advance(10)
+        self.cache.get('key', self.fetch)
+
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_size_cap(self):
+        """The least recently used entry is dropped when the cache is full."""
+        self.cache.get('a', self.fetch)
+        self.cache.get('b', self.fetch)
+        self.cache.get('a', self.fetch)
+        self.cache.get('c', self.fetch)
+        self.assertEqual(self.fetch.call_count, 3)
+
+        self.cache.get('a', self.fetch)
+        self.assertEqual(self.fetch.call_count, 3)
+        self.cache.get('b', self.fetch)
+        self.assertEqual(self.fetch.call_count, 4)
+
+    def test_concurrent_misses_share_fetch(self):
+        """Gets made while a fetch is in progress wait for it."""
+        pending = defer.Deferred()
+        fetch = mock.Mock(return_value=pending)
+
+        d1 = self.cache.get('key', fetch)
+        d2 = self.cache.get('key', fetch)
+        self.assertNoResult(d2)
+
+        pending.callback('value')
+        self.assertEqual(self.successResultOf(d1), 'value')
+        self.assertEqual(self.successResultOf(d2), 'value')
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_failures_not_cached(self):
+        """A failed fetch is passed on to every waiter and isn't cached."""
+        pending = defer.Deferred()
+        d1 = self.cache.get('key', lambda: pending)
+        d2 = self.cache.get('key', self.fetch)
+
+        pending.errback(ValueError('boom'))
+        self.failureResultOf(d1, ValueError)
+        self.failureResultOf(d2, ValueError)
+
+        self.assertEqual(self.successResultOf(self.cache.get('key', self.fetch)), 'value')
+
+    def test_invalidate(self):
+        """An invalidated key is fetched again, even if it was mid-fetch."""
+        self.cache.get('key', self.fetch)
+        self.cache.invalidate('key')
+        self.cache.get('key', self.fetch)
+        self.assertEqual(self.fetch.call_count, 2)
+
+        pending = defer.Deferred()
+        self.cache.invalidate('key')
+        self.cache.get('key', lambda: pending)
+        self.cache.invalidate('key')
+        pending.callback('stale')
+
+        self.assertEqual(self.successResultOf(self.cache.get('key', self.fetch)), 'value')
+
+
+class TestReadCache(unittest.TestCase):
+    """Test bobby.cache.ReadCache."""
+
+    def setUp(self):
+        self.db = mock.Mock()
+        self.cache = cache.ReadCache(self.db, clock=task.Clock())
+
+    @mock.patch('bobby.cache.cass')
+    def test_group_and_policies(self, cass):
+        """Groups and policies are read from Cassandra once, until invalidated."""
+        cass.get_group_by_id.side_effect = lambda *args: defer.succeed({'groupId': 'group-abc'})
+        cass.get_policies_by_group_id.side_effect = lambda *args: defer.succeed([])
+
+        for _ in range(2):
+            self.cache.get_group_by_id('101010', 'group-abc')
+            self.cache.get_policies_by_group_id('group-abc')
+        cass.get_group_by_id.assert_called_once_with(self.db, '101010', 'group-abc')
+        cass.get_policies_by_group_id.assert_called_once_with(self.db, 'group-abc')
+
+        self.cache.invalidate_policies('group-abc')
+        self.cache.get_group_by_id('101010', 'group-abc')
+        self.cache.get_policies_by_group_id('group-abc')
+        self.assertEqual(cass.get_group_by_id.call_count, 1)
+        self.assertEqual(cass.get_policies_by_group_id.call_count, 2)
+
+        self.cache.invalidate_group('101010', 'group-abc')
+        self.cache.get_group_by_id('101010', 'group-abc')
+        self.cache.get_policies_by_group_id('group-abc')
+        self.assertEqual(cass.get_group_by_id.call_count, 2)
+        self.assertEqual(cass.get_policies_by_group_id.call_count, 3)
+
+        self.assertEqual(self.cache.metrics()['groups']['hits'], 2)
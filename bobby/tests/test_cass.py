@@ -79,7 +79,21 @@ class TestCreateGroup(_DBTestCase):
     """Test bobby.cass.create_group."""
 
     def test_create_group(self):
-        """Creates a group in Cassandra."""
+        """Creates a group in Cassandra, returning it without reading it back."""
+        self.client.execute.return_value = defer.succeed(None)
+
+        d = cass.create_group(self.client, '101010', 'group-abc',
+                              'notification-ghi', 'notificationPlan-jkl')
+
+        result = self.successResultOf(d)
+        self.assertEqual(result, {'groupId': 'group-abc',
+                                  'tenantId': '101010',
+                                  'notification': 'notification-ghi',
+                                  'notificationPlan': 'notificationPlan-jkl'})
+        self.assertEqual(len(self.client.execute.mock_calls), 1)
+
+    def test_create_group_verify(self):
+        """Creates a group in Cassandra, and reads it back."""
         expected = {'groupId': 'group-abc',
                     'tenantId': '101010',
                     'notification': 'notification-ghi',
@@ -93,7 +107,8 @@ class TestCreateGroup(_DBTestCase):
         self.client.execute.side_effect = execute
 
         d = cass.create_group(self.client, expected['tenantId'], expected['groupId'],
-                              expected['notification'], expected['notificationPlan'])
+                              expected['notification'], expected['notificationPlan'],
+                              verify=True)
 
         result = self.successResultOf(d)
         self.assertEqual(result, expected)
@@ -153,6 +168,81 @@ class TestGetServersByGroupId(_DBTestCase):
             1)
 
 
+class TestPages(_DBTestCase):
+    """Test bobby.cass.Pages."""
+
+    def setUp(self):
+        """Serve a partition of five servers."""
+        super(TestPages, self).setUp()
+        self.rows = [{'serverId': 'server-{0}'.format(i)} for i in range(5)]
+
+        def execute(query, data, consistency):
+            rows = [row for row in self.rows
+                    if row['serverId'] > data.get('after', '')]
+            return defer.succeed(rows[:2])
+        self.client.execute.side_effect = execute
+        self.pages = cass.page_servers_by_group_id(
+            self.client, '101010', 'group-def', page_size=2)
+
+    def test_next(self):
+        """Pages follow on from the last clustering key, and end with None."""
+        pages = [self.successResultOf(self.pages.next()) for _ in range(4)]
+
+        self.assertEqual(pages, [self.rows[0:2], self.rows[2:4], self.rows[4:], None])
+        self.assertEqual(self.client.execute.call_count, 3)
+        self.assertEqual(self.client.execute.mock_calls[:2], [
+            mock.call('SELECT * FROM servers WHERE "groupId"=:partition LIMIT 2;',
+                      {'partition': 'group-def'}, 1),
+            mock.call(('SELECT * FROM servers WHERE "groupId"=:partition '
+                       'AND "serverId">:after LIMIT 2;'),
+                      {'partition': 'group-def', 'after': 'server-1'}, 1)])
+
+    def test_full_last_page(self):
+        """A last page that is full is followed by an empty read."""
+        del self.rows[4]
+        pages = [self.successResultOf(self.pages.next()) for _ in range(3)]
+
+        self.assertEqual(pages, [self.rows[0:2], self.rows[2:4], None])
+        self.assertEqual(self.client.execute.call_count, 3)
+
+    def test_each(self):
+        """Each page is handled in turn, waiting for the one before."""
+        handling = []
+
+        def handle(page):
+            d = defer.Deferred()
+            handling.append((page, d))
+            return d
+
+        d = self.pages.each(handle)
+        self.assertEqual(len(handling), 1)
+        handling[0][1].callback(None)
+        handling[1][1].callback(None)
+        self.assertNoResult(d)
+        handling[2][1].callback(None)
+
+        self.assertIdentical(self.successResultOf(d), None)
+        self.assertEqual([page for page, _ in handling],
+                         [self.rows[0:2], self.rows[2:4], self.rows[4:]])
+
+    def test_each_many_synchronous_pages(self):
+        """Many pages that are read and handled synchronously don't exhaust the stack."""
+        self.rows = [{'serverId': 'server-{0:05d}'.format(i)} for i in range(5000)]
+        handled = []
+
+        d = self.pages.each(lambda page: handled.extend(page))
+
+        self.assertIdentical(self.successResultOf(d), None)
+        self.assertEqual(handled, self.rows)
+
+    def test_each_failure(self):
+        """A failure handling a page stops the paging with that failure."""
+        d = self.pages.each(lambda page: defer.fail(ValueError()))
+
+        self.failureResultOf(d, ValueError)
+        self.assertEqual(self.client.execute.call_count, 1)
+
+
 class TestGetServerByServerId(_DBTestCase):
     """Test bobby.cass.get_server_by_server_id."""
 
@@ -191,11 +281,47 @@ class TestGetServerByServerId(_DBTestCase):
         self.assertTrue(result.check(cass.ExcessiveResultsError))
 
 
+class TestGetServersByServerIds(_DBTestCase):
+    """Test bobby.cass.get_servers_by_server_ids."""
+
+    def test_get_servers_by_server_ids(self):
+        """Servers are read with IN queries of limited size."""
+        self.client.execute.side_effect = lambda query, data, consistency: defer.succeed(
+            [{'serverId': data[key]} for key in sorted(data) if key.startswith('serverId')])
+
+        d = cass.get_servers_by_server_ids(self.client, 'group-xyz',
+                                           ['server-a', 'server-b', 'server-c'], max_batch_size=2)
+
+        self.assertEqual([server['serverId'] for server in self.successResultOf(d)],
+                         ['server-a', 'server-b', 'server-c'])
+        self.assertEqual(self.client.execute.mock_calls[0], mock.call(
+            'SELECT * FROM servers WHERE "groupId"=:groupId AND "serverId" IN (:serverId0, :serverId1);',
+            {'groupId': 'group-xyz', 'serverId0': 'server-a', 'serverId1': 'server-b'}, 1))
+
+
 class TestCreateServer(_DBTestCase):
     """Test bobby.cass.create_server."""
 
     def test_create_server(self):
-        """Creates and returns a server dict."""
+        """Creates and returns a server dict, without reading it back."""
+        self.client.execute.return_value = defer.succeed(None)
+
+        d = cass.create_server(self.client, '101010', 'server-abc', 'entity-ghi', 'group-def')
+
+        result = self.successResultOf(d)
+        self.assertEqual(result, {'serverId': 'server-abc',
+                                  'groupId': 'group-def',
+                                  'entityId': 'entity-ghi'})
+        self.client.execute.assert_called_once_with(
+            'INSERT INTO servers ("serverId", "entityId", "groupId") '
+            'VALUES (:serverId, :entityId, :groupId);',
+            {'serverId': 'server-abc',
+             'entityId': 'entity-ghi',
+             'groupId': 'group-def'},
+            1)
+
+    def test_create_server_verify(self):
+        """Creates a server, and reads it back."""
         expected = {'serverId': 'server-abc',
                     'groupId': 'group-def',
                     'entityId': 'entity-ghi',
@@ -209,7 +335,7 @@ class TestCreateServer(_DBTestCase):
         self.client.execute.side_effect = execute
 
         d = cass.create_server(self.client, expected['tenantId'], expected['serverId'], expected['entityId'],
-                               expected['groupId'])
+                               expected['groupId'], verify=True)
 
         result = self.successResultOf(d)
         self.assertEqual(result, expected)
@@ -230,59 +356,183 @@ class TestCreateServer(_DBTestCase):
         self.assertEqual(self.client.execute.mock_calls, calls)
 
 
+class TestCreateServers(_DBTestCase):
+    """Test bobby.cass.create_servers."""
+
+    def test_create_servers(self):
+        """Servers are written in unlogged batches of limited size."""
+        self.client.execute.side_effect = lambda *args: defer.succeed(None)
+
+        d = cass.create_servers(
+            self.client, '101010', 'group-abc',
+            [('server-a', 'entity-a'), ('server-b', 'entity-b'), ('server-c', 'entity-c')],
+            max_batch_size=2)
+
+        self.assertEqual(self.successResultOf(d), [
+            {'serverId': 'server-a', 'entityId': 'entity-a', 'groupId': 'group-abc'},
+            {'serverId': 'server-b', 'entityId': 'entity-b', 'groupId': 'group-abc'},
+            {'serverId': 'server-c', 'entityId': 'entity-c', 'groupId': 'group-abc'}])
+        self.assertEqual(
+            self.client.execute.mock_calls,
+            [mock.call('BEGIN UNLOGGED BATCH '
+                       'INSERT INTO servers ("serverId", "entityId", "groupId") '
+                       'VALUES (:serverId0, :entityId0, :groupId) '
+                       'INSERT INTO servers ("serverId", "entityId", "groupId") '
+                       'VALUES (:serverId1, :entityId1, :groupId) '
+                       'APPLY BATCH;',
+                       {'groupId': 'group-abc',
+                        'serverId0': 'server-a', 'entityId0': 'entity-a',
+                        'serverId1': 'server-b', 'entityId1': 'entity-b'},
+                       1),
+             mock.call('BEGIN UNLOGGED BATCH '
+                       'INSERT INTO servers ("serverId", "entityId", "groupId") '
+                       'VALUES (:serverId0, :entityId0, :groupId) '
+                       'APPLY BATCH;',
+                       {'groupId': 'group-abc',
+                        'serverId0': 'server-c', 'entityId0': 'entity-c'},
+                       1)])
+
+
 class TestDeleteServer(_DBTestCase):
     """Test bobby.cass.delete_server."""
 
     def test_delete_server(self):
         """Delete and cascade to delete associated server policies."""
-        def execute(*args, **kwargs):
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([
+                    {'serverId': 'server-abc', 'policyId': 'policy-a',
+                     'alarmId': 'alarm-a', 'state': 'OK'},
+                    {'serverId': 'server-abc', 'policyId': 'policy-b',
+                     'alarmId': 'alarm-b', 'state': 'CRITICAL'}])
             return defer.succeed(None)
         self.client.execute.side_effect = execute
+        quorum = mock.Mock()
 
-        d = cass.delete_server(self.client, '101010', 'group-xyz', 'server-abc')
+        d = cass.delete_server(self.client, '101010', 'group-xyz', 'server-abc', quorum)
 
         self.successResultOf(d)
 
         calls = [
             mock.call(
-                'DELETE FROM servers WHERE "groupId"=:groupId AND "serverId"=:serverId;',
-                {'serverId': 'server-abc', 'groupId': 'group-xyz'}, 1)
+                'SELECT * FROM serverpolicies_by_server WHERE "serverId"=:serverId;',
+                {'serverId': 'server-abc'}, 1),
+            mock.call(
+                'BEGIN BATCH '
+                'DELETE FROM servers WHERE "groupId"=:groupId AND "serverId"=:serverId '
+                'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId '
+                'DELETE FROM serverpolicies WHERE "policyId"=:policyId0 AND "serverId"=:serverId '
+                'DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId0 '
+                'DELETE FROM serverpolicies WHERE "policyId"=:policyId1 AND "serverId"=:serverId '
+                'DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId1 '
+                'APPLY BATCH;',
+                {'serverId': 'server-abc', 'groupId': 'group-xyz',
+                 'policyId0': 'policy-a', 'alarmId0': 'alarm-a',
+                 'policyId1': 'policy-b', 'alarmId1': 'alarm-b'}, 1)
         ]
-        self.assertEqual(calls, self.client.execute.mock_calls)
+        self.assertEqual(calls, self.client.execute.mock_calls[:2])
+        self.assertEqual(quorum.apply.mock_calls,
+                         [mock.call('policy-a', -1, 0), mock.call('policy-b', -1, -1)])
+
+    def test_delete_server_padded(self):
+        """The serverpolicies with and without alarms are padded to power-of-two counts."""
+        serverpolicies = [
+            {'serverId': 'server-abc', 'policyId': 'policy-{0}'.format(i),
+             'alarmId': 'alarm-{0}'.format(i) if i < 3 else None, 'state': 'OK'}
+            for i in range(4)]
+
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed(serverpolicies)
+            return defer.succeed(None)
+        self.client.execute.side_effect = execute
+        quorum = mock.Mock()
+
+        d = cass.delete_server(self.client, '101010', 'group-xyz', 'server-abc', quorum)
+
+        self.successResultOf(d)
+        query, data, _ = self.client.execute.mock_calls[1][1]
+        self.assertEqual(query.count('DELETE FROM serverpolicies WHERE'), 5)
+        self.assertEqual(query.count('DELETE FROM alarms_by_id'), 4)
+        self.assertEqual([data['policyId{0}'.format(i)] for i in range(5)],
+                         ['policy-0', 'policy-1', 'policy-2', 'policy-2', 'policy-3'])
+        self.assertEqual(data['alarmId3'], 'alarm-2')
+        self.assertNotIn('alarmId4', data)
+        self.assertEqual(quorum.apply.call_count, 4)
+
+    def test_delete_server_already_deleted(self):
+        """Deleting a server that is already gone touches no quorum counters."""
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([])
+            return defer.succeed(None)
+        self.client.execute.side_effect = execute
+
+        d = cass.delete_server(self.client, '101010', 'group-xyz', 'server-abc')
+
+        self.successResultOf(d)
+        self.assertEqual(self.client.execute.call_count, 2)
+
+
+class TestDeleteServers(_DBTestCase):
+    """Test bobby.cass.delete_servers."""
+
+    def test_delete_servers(self):
+        """Servers are deleted in unlogged batches of limited size."""
+        self.client.execute.side_effect = lambda *args: defer.succeed(None)
+
+        d = cass.delete_servers(self.client, 'group-abc', ['server-a', 'server-b', 'server-c'],
+                                max_batch_size=2)
+
+        self.assertIdentical(self.successResultOf(d), None)
+        self.assertEqual(
+            self.client.execute.mock_calls[0],
+            mock.call('BEGIN UNLOGGED BATCH '
+                      'DELETE FROM servers WHERE "groupId"=:groupId AND "serverId"=:serverId0 '
+                      'DELETE FROM servers WHERE "groupId"=:groupId AND "serverId"=:serverId1 '
+                      'APPLY BATCH;',
+                      {'groupId': 'group-abc', 'serverId0': 'server-a', 'serverId1': 'server-b'},
+                      1))
+        self.assertEqual(self.client.execute.call_count, 2)
+
+    def test_delete_servers_batch_sizes(self):
+        """What is left after full batches is split into power-of-two batches."""
+        self.client.execute.side_effect = lambda *args: defer.succeed(None)
+
+        d = cass.delete_servers(self.client, 'group-abc',
+                                ['server-{0}'.format(i) for i in range(19)], max_batch_size=6)
+
+        self.successResultOf(d)
+        self.assertEqual([call[1][0].count('DELETE') for call in self.client.execute.mock_calls],
+                         [6, 6, 6, 1])
+
+        self.client.execute.reset_mock()
+        d = cass.delete_servers(self.client, 'group-abc',
+                                ['server-{0}'.format(i) for i in range(17)], max_batch_size=6)
+
+        self.successResultOf(d)
+        self.assertEqual([call[1][0].count('DELETE') for call in self.client.execute.mock_calls],
+                         [6, 6, 4, 1])
 
 
 class TestGetServerPoliciesByServerId(_DBTestCase):
     """Test bobby.cass.get_serverpolicies_by_server_id."""
 
     def test_get_serverpolicies_by_server_id(self):
-        policies = [{'policyId': 'policy-abc'},
-                    {'policyId': 'policy-xyz'}]
+        """A server's serverpolicies are read from its own partition."""
         expected = [{'policyId': 'policy-abc',
                      'serverId': 'server-abc'},
                     {'policyId': 'policy-xyz',
                      'serverId': 'server-abc'}]
-
-        def execute(query, args, consistency):
-            if 'FROM policies' in query:
-                return defer.succeed(policies)
-            else:
-                return defer.succeed(expected)
-        self.client.execute.side_effect = execute
+        self.client.execute.return_value = defer.succeed(expected)
 
         d = cass.get_serverpolicies_by_server_id(self.client, 'group-abc', 'server-abc')
 
         result = self.successResultOf(d)
         self.assertEqual(result, expected)
-
-        calls = [
-            mock.call('SELECT * FROM policies WHERE "groupId"=:groupId',
-                      {'groupId': 'group-abc'}, 1),
-            mock.call('SELECT * FROM serverpolicies WHERE "policyId" IN (:policies) AND "serverId"=:serverId',
-                      {'serverId': 'server-abc',
-                       'policies': 'policy-abc, policy-xyz'},
-                      1)
-        ]
-        self.assertEqual(self.client.execute.mock_calls, calls)
+        self.client.execute.assert_called_once_with(
+            'SELECT * FROM serverpolicies_by_server WHERE "serverId"=:serverId;',
+            {'serverId': 'server-abc'}, 1)
 
 
 class TestAddServerpolicy(_DBTestCase):
@@ -296,7 +546,11 @@ class TestAddServerpolicy(_DBTestCase):
 
         self.successResultOf(d)
         self.client.execute.assert_called_once_with(
-            'INSERT INTO serverpolicies ("serverId", "policyId") VALUES (:serverId, :policyId);',
+            ('BEGIN BATCH '
+             'INSERT INTO serverpolicies ("serverId", "policyId") VALUES (:serverId, :policyId) '
+             'INSERT INTO serverpolicies_by_server '
+             '("serverId", "policyId") VALUES (:serverId, :policyId) '
+             'APPLY BATCH;'),
             {'serverId': 'server-abc', 'policyId': 'policy-def'},
             1)
 
@@ -312,7 +566,10 @@ class TestDeleteServerpolicy(_DBTestCase):
 
         self.successResultOf(d)
         self.client.execute.assert_called_once_with(
-            'DELETE FROM serverpolicies WHERE "serverId"=:serverId AND "policyId"=:policyId;',
+            ('BEGIN BATCH '
+             'DELETE FROM serverpolicies WHERE "serverId"=:serverId AND "policyId"=:policyId '
+             'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId AND "policyId"=:policyId '
+             'APPLY BATCH;'),
             {'serverId': 'server-abc', 'policyId': 'policy-def'},
             1)
 
@@ -385,7 +642,21 @@ class TestCreatePolicy(_DBTestCase):
     """Test bobby.cass.create_policy."""
 
     def test_create_policy(self):
-        """Creates and returns a policy dict."""
+        """Creates and returns a policy dict, without reading it back."""
+        self.client.execute.return_value = defer.succeed(None)
+
+        d = cass.create_policy(self.client, 'policy-abc', 'group-def',
+                               'alarmTemplate-ghi', 'checkTemplate-jkl')
+
+        result = self.successResultOf(d)
+        self.assertEqual(result, {'policyId': 'policy-abc',
+                                  'groupId': 'group-def',
+                                  'alarmTemplate': 'alarmTemplate-ghi',
+                                  'checkTemplate': 'checkTemplate-jkl'})
+        self.assertEqual(len(self.client.execute.mock_calls), 1)
+
+    def test_create_policy_verify(self):
+        """Creates a policy, and reads it back."""
         expected = {'policyId': 'policy-abc',
                     'groupId': 'group-def',
                     'alarmTemplate': 'alarmTemplate-ghi',
@@ -400,7 +671,7 @@ class TestCreatePolicy(_DBTestCase):
 
         d = cass.create_policy(self.client, expected['policyId'],
                                expected['groupId'], expected['alarmTemplate'],
-                               expected['checkTemplate'])
+                               expected['checkTemplate'], verify=True)
 
         result = self.successResultOf(d)
         self.assertEqual(result, expected)
@@ -428,21 +699,87 @@ class TestDeletePolicy(_DBTestCase):
     """Test bobby.cass.delete_policy."""
 
     def test_delete_policy(self):
-        """Deletes a policy."""
-        def execute(*args, **kwargs):
+        """Deletes a policy, its serverpolicies partition and their other records."""
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([
+                    {'policyId': 'policy-abc', 'serverId': 'server-a', 'alarmId': 'alarm-a'},
+                    {'policyId': 'policy-abc', 'serverId': 'server-b', 'alarmId': None}])
             return defer.succeed(None)
         self.client.execute.side_effect = execute
+        quorum = mock.Mock()
 
-        d = cass.delete_policy(self.client, 'group-xyz', 'policy-abc')
+        d = cass.delete_policy(self.client, 'group-xyz', 'policy-abc', quorum=quorum)
 
         self.successResultOf(d)
 
         calls = [
             mock.call(
-                'DELETE FROM policies WHERE "groupId"=:groupId AND "policyId"=:policyId;',
+                'SELECT * FROM serverpolicies WHERE "policyId"=:partition LIMIT 1000;',
+                {'partition': 'policy-abc'}, 1),
+            mock.call(
+                'BEGIN UNLOGGED BATCH '
+                'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId0 '
+                'AND "policyId"=:policyId '
+                'DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId0 '
+                'APPLY BATCH;',
+                {'policyId': 'policy-abc', 'serverId0': 'server-a', 'alarmId0': 'alarm-a'}, 1),
+            mock.call(
+                'BEGIN UNLOGGED BATCH '
+                'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId0 '
+                'AND "policyId"=:policyId '
+                'APPLY BATCH;',
+                {'policyId': 'policy-abc', 'serverId0': 'server-b'}, 1),
+            mock.call(
+                'BEGIN BATCH '
+                'DELETE FROM policies WHERE "groupId"=:groupId AND "policyId"=:policyId '
+                'DELETE FROM serverpolicies WHERE "policyId"=:policyId '
+                'APPLY BATCH;',
                 {'policyId': 'policy-abc', 'groupId': 'group-xyz'}, 1),
+            mock.call(
+                'DELETE FROM policyquorum WHERE "policyId"=:policyId;',
+                {'policyId': 'policy-abc'}, 1),
         ]
         self.assertEqual(calls, self.client.execute.mock_calls)
+        quorum.forget.assert_called_once_with('policy-abc')
+
+    def test_delete_policy_in_batches(self):
+        """The serverpolicies' records are deleted a page and a batch at a time."""
+        serverpolicies = [{'policyId': 'policy-abc', 'serverId': 'server-{0}'.format(i),
+                           'alarmId': 'alarm-{0}'.format(i)} for i in range(5)]
+
+        def execute(query, data, consistency):
+            if 'SELECT' in query and 'after' in data:
+                return defer.succeed(serverpolicies[3:])
+            elif 'SELECT' in query:
+                return defer.succeed(serverpolicies[:3])
+            return defer.succeed(None)
+        self.client.execute.side_effect = execute
+
+        d = cass.delete_policy(self.client, 'group-xyz', 'policy-abc', page_size=3,
+                               max_batch_size=2)
+
+        self.successResultOf(d)
+        batches = [c[1][1] for c in self.client.execute.mock_calls if 'UNLOGGED' in c[1][0]]
+        self.assertEqual([sorted(data[key] for key in data if key.startswith('serverId'))
+                          for data in batches],
+                         [['server-0', 'server-1'], ['server-2'], ['server-3', 'server-4']])
+        self.assertIn('DELETE FROM serverpolicies WHERE "policyId"=:policyId',
+                      self.client.execute.mock_calls[-2][1][0])
+
+    def test_delete_policy_failure(self):
+        """If a serverpolicy's records can't be deleted, the policy is left for a retry."""
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([
+                    {'policyId': 'policy-abc', 'serverId': 'server-a', 'alarmId': 'alarm-a'}])
+            return defer.fail(ValueError())
+        self.client.execute.side_effect = execute
+
+        d = cass.delete_policy(self.client, 'group-xyz', 'policy-abc')
+
+        self.failureResultOf(d, ValueError)
+        self.assertEqual(self.client.execute.call_count, 2)
 
 
 class TestServerPoliciesCreateDestroy(_DBTestCase):
@@ -450,7 +787,9 @@ class TestServerPoliciesCreateDestroy(_DBTestCase):
 
     def test_register_policy_on_server(self):
         """Registers a policy on a server and creates a serverpolicy record."""
-        def execute(*args, **kwargs):
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([])
             return defer.succeed(None)
         self.client.execute.side_effect = execute
 
@@ -460,16 +799,63 @@ class TestServerPoliciesCreateDestroy(_DBTestCase):
 
         calls = [
             mock.call(
-                ('INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state)'
-                 ' VALUES (:serverId, :policyId, :alarmId, :checkId, false);'),
+                'SELECT * FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId;',
+                {'policyId': 'policy-abc', 'serverId': 'server-abc',
+                 'alarmId': 'alABCD', 'checkId': 'chABCD'}, 1),
+            mock.call(
+                ('BEGIN BATCH '
+                 'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state) '
+                 'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+                 'INSERT INTO alarms_by_id ("alarmId", "policyId", "serverId", state) '
+                 'VALUES (:alarmId, :policyId, :serverId, false) '
+                 'INSERT INTO serverpolicies_by_server '
+                 '("serverId", "policyId", "alarmId", "checkId", state) '
+                 'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+                 'APPLY BATCH;'),
                 {'policyId': 'policy-abc', 'serverId': 'server-abc',
                  'alarmId': 'alABCD', 'checkId': 'chABCD'}, 1),
+            mock.call(
+                ('UPDATE policyquorum SET total=total + :total, critical=critical + :critical '
+                 'WHERE "policyId"=:policyId;'),
+                {'total': 1, 'critical': 1, 'policyId': 'policy-abc'}, 1),
         ]
         self.assertEqual(calls, self.client.execute.mock_calls)
 
+    def test_register_policy_on_server_updates_quorum(self):
+        """The in-memory quorum tracker is told about the new serverpolicy."""
+        self.client.execute.side_effect = lambda query, *args: defer.succeed(
+            [] if 'SELECT' in query else None)
+        quorum = mock.Mock()
+
+        d = cass.register_policy_on_server(self.client, 'policy-abc', 'server-abc', 'alABCD', 'chABCD',
+                                           quorum)
+
+        self.successResultOf(d)
+        quorum.apply.assert_called_once_with('policy-abc', 1, 1)
+
+    def test_register_policy_on_server_again(self):
+        """Registering a server again does not count it twice."""
+        states = {'server-ok': 'OK', 'server-critical': 'CRITICAL'}
+        self.client.execute.side_effect = lambda query, data, consistency: defer.succeed(
+            [{'serverId': data['serverId'], 'state': states[data['serverId']]}]
+            if 'SELECT' in query else None)
+        quorum = mock.Mock()
+
+        for server_id in ('server-ok', 'server-critical'):
+            self.successResultOf(cass.register_policy_on_server(
+                self.client, 'policy-abc', server_id, 'alABCD', 'chABCD', quorum))
+
+        self.assertEqual(quorum.apply.mock_calls,
+                         [mock.call('policy-abc', 0, 1), mock.call('policy-abc', 0, 0)])
+
     def test_deregister_policy_on_server(self):
-        """Registers a policy on a server and creates a serverpolicy record."""
-        def execute(*args, **kwargs):
+        """Deletes a serverpolicy record and removes it from the quorum counts."""
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([{'policyId': 'policy-abc',
+                                       'serverId': 'server-abc',
+                                       'alarmId': 'alABCD',
+                                       'state': 'CRITICAL'}])
             return defer.succeed(None)
         self.client.execute.side_effect = execute
 
@@ -479,11 +865,184 @@ class TestServerPoliciesCreateDestroy(_DBTestCase):
 
         calls = [
             mock.call(
-                'DELETE FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId;',
+                'SELECT * FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId;',
                 {'policyId': 'policy-abc', 'serverId': 'server-abc'}, 1),
+            mock.call(
+                ('BEGIN BATCH '
+                 'DELETE FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId '
+                 'DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId '
+                 'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId '
+                 'AND "policyId"=:policyId '
+                 'APPLY BATCH;'),
+                {'policyId': 'policy-abc', 'serverId': 'server-abc', 'alarmId': 'alABCD'}, 1),
+            mock.call(
+                ('UPDATE policyquorum SET total=total + :total, critical=critical + :critical '
+                 'WHERE "policyId"=:policyId;'),
+                {'total': -1, 'critical': -1, 'policyId': 'policy-abc'}, 1),
         ]
         self.assertEqual(calls, self.client.execute.mock_calls)
 
+    def test_deregister_policy_on_server_not_found(self):
+        """Deleting a missing serverpolicy leaves the quorum counts alone."""
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([])
+            return defer.succeed(None)
+        self.client.execute.side_effect = execute
+
+        d = cass.deregister_policy_on_server(self.client, 'policy-abc', 'server-abc')
+
+        self.successResultOf(d)
+        self.assertEqual(len(self.client.execute.mock_calls), 2)
+
+
+class TestRegisterPolicyOnServers(_DBTestCase):
+    """Test bobby.cass.register_policy_on_servers."""
+
+    def test_register_policy_on_servers(self):
+        """Serverpolicies are written in unlogged batches of limited size, after their records."""
+        def execute(query, data, consistency):
+            if 'SELECT' in query and data['serverId0'] == 'server-a':
+                return defer.succeed([{'serverId': 'server-b', 'state': 'OK'}])
+            elif 'SELECT' in query:
+                return defer.succeed([])
+            return defer.succeed(None)
+        self.client.execute.side_effect = execute
+        quorum = mock.Mock()
+
+        d = cass.register_policy_on_servers(
+            self.client, 'policy-abc',
+            [('server-a', 'alarm-a', 'check-a'),
+             ('server-b', 'alarm-b', 'check-b'),
+             ('server-c', 'alarm-c', 'check-c')],
+            quorum, max_batch_size=2)
+
+        self.assertIdentical(self.successResultOf(d), None)
+
+        data = {'policyId': 'policy-abc',
+                'serverId0': 'server-a', 'alarmId0': 'alarm-a', 'checkId0': 'check-a',
+                'serverId1': 'server-b', 'alarmId1': 'alarm-b', 'checkId1': 'check-b'}
+        calls = self.client.execute.mock_calls
+        self.assertEqual(calls[:3], [
+            mock.call(
+                'SELECT * FROM serverpolicies WHERE "policyId"=:policyId '
+                'AND "serverId" IN (:serverId0, :serverId1);',
+                data, 1),
+            mock.call(
+                'BEGIN BATCH '
+                'INSERT INTO alarms_by_id ("alarmId", "policyId", "serverId", state) '
+                'VALUES (:alarmId0, :policyId, :serverId0, false) '
+                'INSERT INTO serverpolicies_by_server '
+                '("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId0, :policyId, :alarmId0, :checkId0, false) '
+                'INSERT INTO alarms_by_id ("alarmId", "policyId", "serverId", state) '
+                'VALUES (:alarmId1, :policyId, :serverId1, false) '
+                'INSERT INTO serverpolicies_by_server '
+                '("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId1, :policyId, :alarmId1, :checkId1, false) '
+                'APPLY BATCH;',
+                data, 1),
+            mock.call(
+                'BEGIN UNLOGGED BATCH '
+                'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId0, :policyId, :alarmId0, :checkId0, false) '
+                'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId1, :policyId, :alarmId1, :checkId1, false) '
+                'APPLY BATCH;',
+                data, 1)])
+        batches = [c for c in calls if 'BATCH' in c[1][0]]
+        self.assertEqual(len(batches), 4)
+        self.assertEqual(batches[3][1][1],
+                         {'policyId': 'policy-abc',
+                          'serverId0': 'server-c', 'alarmId0': 'alarm-c', 'checkId0': 'check-c'})
+        self.assertEqual(quorum.apply.mock_calls,
+                         [mock.call('policy-abc', 1, 2), mock.call('policy-abc', 1, 1)])
+
+    def test_register_policy_on_servers_failure(self):
+        """A failed batch fails the whole registration with its own error."""
+        self.client.execute.side_effect = lambda *args: defer.fail(ValueError())
+
+        d = cass.register_policy_on_servers(
+            self.client, 'policy-abc', [('server-a', 'alarm-a', 'check-a')])
+
+        self.failureResultOf(d, ValueError)
+
+    def test_serverpolicies_need_their_records(self):
+        """If the alarms_by_id records can't be written, no serverpolicies are."""
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([])
+            return defer.fail(ValueError())
+        self.client.execute.side_effect = execute
+
+        d = cass.register_policy_on_servers(
+            self.client, 'policy-abc', [('server-a', 'alarm-a', 'check-a')])
+
+        self.failureResultOf(d, ValueError)
+        self.assertEqual(self.client.execute.call_count, 2)
+        self.assertIn('alarms_by_id', self.client.execute.call_args[0][0])
+
+
+class TestDeregisterPolicyOnServers(_DBTestCase):
+    """Test bobby.cass.deregister_policy_on_servers."""
+
+    def test_deregister_policy_on_servers(self):
+        """Serverpolicies and their alarms are deleted in batches, and the quorum updated."""
+        self.client.execute.side_effect = lambda *args: defer.succeed(None)
+        quorum = mock.Mock()
+
+        d = cass.deregister_policy_on_servers(
+            self.client, 'policy-abc',
+            [{'serverId': 'server-a', 'alarmId': 'alarm-a', 'state': 'OK'},
+             {'serverId': 'server-b', 'alarmId': 'alarm-b', 'state': 'CRITICAL'}],
+            quorum)
+
+        self.assertIdentical(self.successResultOf(d), None)
+        self.assertEqual(
+            self.client.execute.mock_calls[0],
+            mock.call('BEGIN UNLOGGED BATCH '
+                      'DELETE FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId0 '
+                      'DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId0 '
+                      'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId0 '
+                      'AND "policyId"=:policyId '
+                      'DELETE FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId1 '
+                      'DELETE FROM alarms_by_id WHERE "alarmId"=:alarmId1 '
+                      'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId1 '
+                      'AND "policyId"=:policyId '
+                      'APPLY BATCH;',
+                      {'policyId': 'policy-abc',
+                       'serverId0': 'server-a', 'alarmId0': 'alarm-a',
+                       'serverId1': 'server-b', 'alarmId1': 'alarm-b'},
+                      1))
+        quorum.apply.assert_called_once_with('policy-abc', -2, -1)
+
+    def test_serverpolicies_without_alarms(self):
+        """Serverpolicies without an alarm are deleted without touching alarms_by_id."""
+        self.client.execute.side_effect = lambda *args: defer.succeed(None)
+        quorum = mock.Mock()
+
+        d = cass.deregister_policy_on_servers(
+            self.client, 'policy-abc',
+            [{'serverId': 'server-a', 'alarmId': None, 'state': None},
+             {'serverId': 'server-b', 'alarmId': 'alarm-b', 'state': 'OK'}],
+            quorum)
+
+        self.assertIdentical(self.successResultOf(d), None)
+        batches = [c for c in self.client.execute.mock_calls if 'BATCH' in c[1][0]]
+        self.assertEqual(
+            batches[1],
+            mock.call('BEGIN UNLOGGED BATCH '
+                      'DELETE FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId0 '
+                      'DELETE FROM serverpolicies_by_server WHERE "serverId"=:serverId0 '
+                      'AND "policyId"=:policyId '
+                      'APPLY BATCH;',
+                      {'policyId': 'policy-abc', 'serverId0': 'server-a'},
+                      1))
+        self.assertEqual(batches[0][1][1],
+                         {'policyId': 'policy-abc', 'serverId0': 'server-b', 'alarmId0': 'alarm-b'})
+        self.assertEqual(quorum.apply.mock_calls,
+                         [mock.call('policy-abc', -1, 0), mock.call('policy-abc', -1, -1)])
+
 
 class TestServerPolicies(_DBTestCase):
     """Test bobby.cass.register_policy_on_server and bobby.cass.deregister_policy_on_server."""
@@ -522,7 +1081,7 @@ class TestAlterAlarmState(_DBTestCase):
                     'state': True}
 
         def execute(query, data, consistency):
-            if 'UPDATE' in query:
+            if 'BATCH' in query:
                 return defer.succeed(None)
             elif 'SELECT' in query:
                 return defer.succeed([expected])
@@ -535,19 +1094,86 @@ class TestAlterAlarmState(_DBTestCase):
 
         calls = [
             mock.call(
-                'SELECT * FROM serverpolicies WHERE "alarmId"=:alarmId;',
+                'SELECT * FROM alarms_by_id WHERE "alarmId"=:alarmId;',
                 {'alarmId': 'alghi'},
                 1),
             mock.call(
-                ('UPDATE serverpolicies SET state=:state WHERE "policyId"=:policyId AND '
-                 '"serverId"=:serverId;'),
+                ('BEGIN BATCH '
+                 'UPDATE serverpolicies SET state=:state WHERE "policyId"=:policyId '
+                 'AND "serverId"=:serverId '
+                 'UPDATE alarms_by_id SET state=:state WHERE "alarmId"=:alarmId '
+                 'UPDATE serverpolicies_by_server SET state=:state WHERE "serverId"=:serverId '
+                 'AND "policyId"=:policyId '
+                 'APPLY BATCH;'),
                 {'state': False,
                  'policyId': 'policy-abc',
-                 'serverId': 'server-def'},
+                 'serverId': 'server-def',
+                 'alarmId': 'alghi'},
                 1)
         ]
         self.assertEqual(self.client.execute.mock_calls, calls)
 
+    def test_alter_alarm_state_updates_quorum(self):
+        """Moving into the OK state takes one off the critical count."""
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([{'policyId': 'policy-abc',
+                                       'serverId': 'server-def',
+                                       'alarmId': 'alghi',
+                                       'state': 'CRITICAL'}])
+            return defer.succeed(None)
+        self.client.execute.side_effect = execute
+        quorum = mock.Mock()
+
+        d = cass.alter_alarm_state(self.client, 'alghi', 'OK', quorum)
+        result = self.successResultOf(d)
+
+        self.assertEqual(result, ('policy-abc', 'server-def'))
+        self.assertEqual(
+            self.client.execute.mock_calls[-1],
+            mock.call(
+                ('UPDATE policyquorum SET total=total + :total, critical=critical + :critical '
+                 'WHERE "policyId"=:policyId;'),
+                {'total': 0, 'critical': -1, 'policyId': 'policy-abc'},
+                1))
+        quorum.apply.assert_called_once_with('policy-abc', 0, -1)
+
+
+class TestQuorumCounts(_DBTestCase):
+    """Test bobby.cass.get_quorum_counts and bobby.cass.update_quorum_counts."""
+
+    def test_get_quorum_counts(self):
+        """Returns a tuple of the total and critical counters."""
+        self.client.execute.return_value = defer.succeed([
+            {'policyId': 'policy-abc', 'total': 5, 'critical': 2}])
+
+        d = cass.get_quorum_counts(self.client, 'policy-abc')
+
+        self.assertEqual(self.successResultOf(d), (5, 2))
+        self.client.execute.assert_called_once_with(
+            'SELECT * FROM policyquorum WHERE "policyId"=:policyId;',
+            {'policyId': 'policy-abc'}, 1)
+
+    def test_get_quorum_counts_none_stored(self):
+        """Returns None when nothing has been counted for the policy."""
+        self.client.execute.return_value = defer.succeed([])
+
+        d = cass.get_quorum_counts(self.client, 'policy-abc')
+
+        self.assertIdentical(self.successResultOf(d), None)
+
+    def test_update_quorum_counts(self):
+        """Adds the deltas to the counters."""
+        self.client.execute.return_value = defer.succeed(None)
+
+        d = cass.update_quorum_counts(self.client, 'policy-abc', -1, 0)
+
+        self.successResultOf(d)
+        self.client.execute.assert_called_once_with(
+            ('UPDATE policyquorum SET total=total + :total, critical=critical + :critical '
+             'WHERE "policyId"=:policyId;'),
+            {'total': -1, 'critical': 0, 'policyId': 'policy-abc'}, 1)
+
 
 class TestCheckQuorumHealth(_DBTestCase):
     """Test bobby.cass.check_quorum_health."""
@@ -609,5 +1235,54 @@ class TestCheckQuorumHealth(_DBTestCase):
         self.assertTrue(result)
 
         self.client.execute.assert_called_once_with(
-            'SELECT * FROM serverpolicies WHERE "policyId"=:policyId;',
-            {'policyId': 'policy-uvwxyz'}, 1)
+            'SELECT * FROM serverpolicies WHERE "policyId"=:partition LIMIT 1000;',
+            {'partition': 'policy-uvwxyz'}, 1)
+
+    def test_counts_page_by_page(self):
+        """Counts are added up over every page of the partition."""
+        pages = [
+            [{'serverId': 'server-abc', 'state': 'CRITICAL'},
+             {'serverId': 'server-def', 'state': 'OK'}],
+            [{'serverId': 'server-ghi', 'state': 'CRITICAL'}]]
+        self.client.execute.side_effect = lambda *args: defer.succeed(pages.pop(0))
+
+        d = cass.count_policy_states(self.client, 'policy-uvwxyz', page_size=2)
+
+        self.assertEqual(self.successResultOf(d), (3, 2))
+        self.assertEqual(self.client.execute.call_count, 2)
+
+
+class TestPolicyExecutions(_DBTestCase):
+    """Test bobby.cass.get_policy_execution and bobby.cass.record_policy_execution."""
+
+    def test_get_policy_execution(self):
+        """Returns when the policy was last executed."""
+        self.client.execute.return_value = defer.succeed([
+            {'policyId': 'policy-abc', 'executedAt': 1000}])
+
+        d = cass.get_policy_execution(self.client, 'policy-abc')
+
+        self.assertEqual(self.successResultOf(d), 1000)
+        self.client.execute.assert_called_once_with(
+            'SELECT * FROM policyexecutions WHERE "policyId"=:policyId;',
+            {'policyId': 'policy-abc'}, 1)
+
+    def test_get_policy_execution_expired(self):
+        """Returns None when there is no unexpired execution."""
+        self.client.execute.return_value = defer.succeed([])
+
+        d = cass.get_policy_execution(self.client, 'policy-abc')
+
+        self.assertIdentical(self.successResultOf(d), None)
+
+    def test_record_policy_execution(self):
+        """Records the execution with a TTL of the cooldown."""
+        self.client.execute.return_value = defer.succeed(None)
+
+        d = cass.record_policy_execution(self.client, 'policy-abc', 1000.5, 300)
+
+        self.successResultOf(d)
+        self.client.execute.assert_called_once_with(
+            ('INSERT INTO policyexecutions ("policyId", "executedAt") '
+             'VALUES (:policyId, :executedAt) USING TTL 300;'),
+            {'policyId': 'policy-abc', 'executedAt': 1000}, 1)
@@ -0,0 +1,56 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.concurrency."""
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from bobby import concurrency
+
+
+class TestTenantLimiter(unittest.TestCase):
+    """Test bobby.concurrency.TenantLimiter."""
+
+    def setUp(self):
+        """Create a limiter allowing two operations at once."""
+        self.limiter = concurrency.TenantLimiter(limit=2)
+        self.pending = []
+
+    def operation(self, value):
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d.addCallback(lambda _: value)
+
+    def test_limit(self):
+        """Operations beyond the limit wait for a running one to finish."""
+        results = [self.limiter.run('101010', self.operation, i) for i in range(3)]
+
+        self.assertEqual(len(self.pending), 2)
+        self.assertEqual(self.limiter.queue_depth('101010'), 1)
+        self.assertEqual(self.limiter.metrics(), {'101010': {'running': 2, 'queued': 1}})
+
+        self.pending[0].callback(None)
+        self.assertEqual(self.successResultOf(results[0]), 0)
+        self.assertEqual(len(self.pending), 3)
+        self.assertEqual(self.limiter.queue_depth('101010'), 0)
+
+    def test_tenants_limited_separately(self):
+        """One tenant's operations don't hold up another's."""
+        for i in range(2):
+            self.limiter.run('101010', self.operation, i)
+        self.limiter.run('202020', self.operation, 2)
+
+        self.assertEqual(len(self.pending), 3)
+
+    def test_idle_tenants_forgotten(self):
+        """A tenant with nothing running or waiting is forgotten."""
+        d = self.limiter.run('101010', self.operation, 0)
+        self.pending[0].callback(None)
+
+        self.successResultOf(d)
+        self.assertEqual(self.limiter.metrics(), {})
+
+    def test_failures(self):
+        """Failures are passed on and free up the slot."""
+        d = self.limiter.run('101010', lambda: defer.fail(ValueError()))
+
+        self.failureResultOf(d, ValueError)
+        self.assertEqual(self.limiter.metrics(), {})
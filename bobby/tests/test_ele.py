@@ -2,7 +2,8 @@
 import json
 
 import mock
-from twisted.internet import defer
+from otter.util.http import APIError
+from twisted.internet import defer, task
 from twisted.trial import unittest
 
 from bobby import ele
@@ -26,6 +27,7 @@ class TestMaasClient(unittest.TestCase):
                 u'tenantId': u'675646'}],
              u'name': u'cloudMonitoring',
              u'type': u'rax:monitor'}]
+        self.patch(ele, '_schedulers', {})
         self.client = ele.MaasClient(service_catalog, 'auth-abc')
 
     def test_init(self):
@@ -44,7 +46,7 @@ class TestMaasClient(unittest.TestCase):
 
     @mock.patch('bobby.ele.treq')
     def test_create_entity(self, treq):
-        def post(url, headers, data):
+        def post(url, headers, data, pool=None):
             response = mock.Mock()
             response.code = 201
             response.headers.getRawHeaders.return_value = ['entity-abc']
@@ -70,6 +72,7 @@ class TestMaasClient(unittest.TestCase):
         self.assertEqual('entity-abc', result)
         treq.post.assert_called_once_with(
             'https://monitoring.api.rackspacecloud.com/v1.0/101010/entities',
+            pool=self.client._pool,
             headers={'content-type': ['application/json'],
                      'accept': ['application/json'],
                      'x-auth-token': ['auth-abc']},
@@ -81,7 +84,7 @@ class TestMaasClient(unittest.TestCase):
 
     @mock.patch('bobby.ele.treq')
     def test_delete_entity(self, treq):
-        def delete(url, headers):
+        def delete(url, headers, pool=None):
             response = mock.Mock()
             response.code = 204
             return defer.succeed(response)
@@ -92,15 +95,26 @@ class TestMaasClient(unittest.TestCase):
 
         treq.delete.assert_called_once_with(
             'https://monitoring.api.rackspacecloud.com/v1.0/101010/entities/entity-abc',
+            pool=self.client._pool,
             headers={'content-type': ['application/json'],
                      'accept': ['application/json'],
                      'x-auth-token': ['auth-abc']}
         )
 
+    @mock.patch('bobby.ele.treq')
+    def test_delete_entity_already_deleted(self, treq):
+        """Deleting an entity that is already gone succeeds."""
+        response = mock.Mock()
+        response.code = 404
+        treq.delete.return_value = defer.succeed(response)
+
+        d = self.client.delete_entity('entity-abc')
+        self.successResultOf(d)
+
     @mock.patch('bobby.ele.treq')
     def test_add_notification_and_plan(self, treq):
         """A notification and notification are created."""
-        def post(url, headers, data):
+        def post(url, headers, data, pool=None):
             if 'notifications' in url:
                 response = mock.Mock()
                 response.code = 201
@@ -123,6 +137,7 @@ class TestMaasClient(unittest.TestCase):
         calls = [
             mock.call(
                 'https://monitoring.api.rackspacecloud.com/v1.0/101010/notifications',
+                pool=self.client._pool,
                 headers={'content-type': ['application/json'],
                          'accept': ['application/json'],
                          'x-auth-token': ['auth-abc']},
@@ -130,6 +145,7 @@ class TestMaasClient(unittest.TestCase):
                      '"Auto Scale Webhook Notification"}'),
             mock.call(
                 'https://monitoring.api.rackspacecloud.com/v1.0/101010/notification_plans',
+                pool=self.client._pool,
                 headers={'content-type': ['application/json'],
                          'accept': ['application/json'],
                          'x-auth-token': ['auth-abc']},
@@ -142,7 +158,7 @@ class TestMaasClient(unittest.TestCase):
 
     @mock.patch('bobby.ele.treq')
     def test_remove_notification_and_plan(self, treq):
-        def delete(url, headers):
+        def delete(url, headers, pool=None):
             response = mock.Mock()
             response.code = 204
             return defer.succeed(response)
@@ -156,12 +172,14 @@ class TestMaasClient(unittest.TestCase):
             mock.call(
                 'https://monitoring.api.rackspacecloud.com/v1.0/101010/'
                 'notification_plans/notificationPlan-xyz',
+                pool=self.client._pool,
                 headers={'content-type': ['application/json'],
                          'accept': ['application/json'],
                          'x-auth-token': ['auth-abc']}),
             mock.call(
                 'https://monitoring.api.rackspacecloud.com/v1.0/101010/'
                 'notifications/notification-abc',
+                pool=self.client._pool,
                 headers={'content-type': ['application/json'],
                          'accept': ['application/json'],
                          'x-auth-token': ['auth-abc']})
@@ -170,14 +188,14 @@ class TestMaasClient(unittest.TestCase):
 
     @mock.patch('bobby.ele.treq')
     def test_add_check(self, treq):
-        def post(url, headers, data=None):
+        def post(url, headers, data=None, pool=None):
             response = mock.Mock()
             response.code = 201
-            response.headers.getRawHeaders.return_value = ['http://example.com']
+            response.headers.getRawHeaders.return_value = ['check-xyz']
             return defer.succeed(response)
         treq.post.side_effect = post
 
-        def get(url, headers):
+        def get(url, headers, pool=None):
             response = mock.Mock()
             response.code = 200
             return defer.succeed(response)
@@ -198,12 +216,13 @@ class TestMaasClient(unittest.TestCase):
             'target_alias': 'default'
         })
 
-        d = self.client.add_check('policy-abc', 'entity-def', check_template)
+        d = self.client.add_check('policy-abc', 'entity-def', check_template, fetch=True)
         self.successResultOf(d)
 
         treq.post.assert_called_once_with(
             'https://monitoring.api.rackspacecloud.com/v1.0/101010'
             '/entities/entity-def/checks',
+            pool=self.client._pool,
             headers={'content-type': ['application/json'],
                      'accept': ['application/json'],
                      'x-auth-token': ['auth-abc']},
@@ -211,16 +230,33 @@ class TestMaasClient(unittest.TestCase):
                  '"label": "Monitoring check", '
                  '"details": {"url": "http://www.example.com/", "method": "GET"}, '
                  '"timeout": 30, "monitoring_zones_poll": ["mzA"], '
-                 '"type": "remote.http"}')
+                 '"type": "remote.http", "metadata": {"bobby_policy_id": "policy-abc"}}')
         treq.get.assert_called_once_with(
-            'http://example.com',
+            'https://monitoring.api.rackspacecloud.com/v1.0/101010'
+            '/entities/entity-def/checks/check-xyz',
+            pool=self.client._pool,
             headers={'content-type': ['application/json'],
                      'accept': ['application/json'],
                      'x-auth-token': ['auth-abc']})
 
+    @mock.patch('bobby.ele.treq')
+    def test_add_check_without_fetch(self, treq):
+        """By default the check is built locally, without a GET."""
+        response = mock.Mock(code=201)
+        response.headers.getRawHeaders.side_effect = {'x-object-id': ['check-xyz']}.get
+        treq.post.return_value = defer.succeed(response)
+
+        d = self.client.add_check('policy-abc', 'entity-def',
+                                  json.dumps({'type': 'remote.http', 'period': 100}))
+
+        self.assertEqual(self.successResultOf(d),
+                         {'id': 'check-xyz', 'type': 'remote.http', 'period': 100,
+                          'metadata': {'bobby_policy_id': 'policy-abc'}})
+        self.assertFalse(treq.get.called)
+
     @mock.patch('bobby.ele.treq')
     def test_remove_check(self, treq):
-        def delete(url, headers):
+        def delete(url, headers, pool=None):
             response = mock.Mock()
             response.code = 204
             return defer.succeed(response)
@@ -232,6 +268,7 @@ class TestMaasClient(unittest.TestCase):
         treq.delete.assert_called_once_with(
             'https://monitoring.api.rackspacecloud.com/v1.0/101010'
             '/entities/entity-abc/checks/check-xyz',
+            pool=self.client._pool,
             headers={'content-type': ['application/json'],
                      'accept': ['application/json'],
                      'x-auth-token': ['auth-abc']})
@@ -241,7 +278,7 @@ class TestMaasClient(unittest.TestCase):
         def post(*args, **kwargs):
             response = mock.Mock()
             response.code = 201
-            response.headers.getRawHeaders.return_value = ['http://example.com']
+            response.headers.getRawHeaders.return_value = ['alarm-xyz']
             return defer.succeed(response)
         treq.post.side_effect = post
 
@@ -255,25 +292,47 @@ class TestMaasClient(unittest.TestCase):
             'return new AlarmStatus(CRITICAL);'
 
         d = self.client.add_alarm('policy-abc', 'entity-def', 'plan-ghi',
-                                  'check-jkl', alarm_template)
+                                  'check-jkl', alarm_template, fetch=True)
         self.successResultOf(d)
 
         treq.post.assert_called_once_with(
             'https://monitoring.api.rackspacecloud.com/v1.0/101010/'
             'entities/entity-def/alarms',
+            pool=self.client._pool,
             headers={'content-type': ['application/json'],
                      'accept': ['application/json'],
                      'x-auth-token': ['auth-abc']},
-            data='"if (metric[\\"duration\\"] >= 2) {return new AlarmStatus(OK); }return new AlarmStatus(CRITICAL);"')
+            data='{"check_id": "check-jkl", "notification_plan_id": "plan-ghi", '
+                 '"metadata": {"bobby_policy_id": "policy-abc"}, '
+                 '"criteria": "if (metric[\\"duration\\"] >= 2) {return new AlarmStatus(OK); }'
+                 'return new AlarmStatus(CRITICAL);"}')
         treq.get.assert_called_once_with(
-            'http://example.com',
+            'https://monitoring.api.rackspacecloud.com/v1.0/101010'
+            '/entities/entity-def/alarms/alarm-xyz',
+            pool=self.client._pool,
             headers={'content-type': ['application/json'],
                      'accept': ['application/json'],
                      'x-auth-token': ['auth-abc']})
 
+    @mock.patch('bobby.ele.treq')
+    def test_add_alarm_without_fetch(self, treq):
+        """By default the alarm is built locally, without a GET."""
+        response = mock.Mock(code=201)
+        response.headers.getRawHeaders.side_effect = {'x-object-id': ['alarm-xyz']}.get
+        treq.post.return_value = defer.succeed(response)
+
+        d = self.client.add_alarm('policy-abc', 'entity-def', 'plan-ghi',
+                                  'check-jkl', 'return new AlarmStatus(OK);')
+
+        self.assertEqual(self.successResultOf(d),
+                         {'id': 'alarm-xyz', 'criteria': 'return new AlarmStatus(OK);',
+                          'check_id': 'check-jkl', 'notification_plan_id': 'plan-ghi',
+                          'metadata': {'bobby_policy_id': 'policy-abc'}})
+        self.assertFalse(treq.get.called)
+
     @mock.patch('bobby.ele.treq')
     def test_remove_alarm(self, treq):
-        def delete(url, headers):
+        def delete(url, headers, pool=None):
             response = mock.Mock()
             response.code = 204
             return defer.succeed(response)
@@ -285,6 +344,237 @@ class TestMaasClient(unittest.TestCase):
         treq.delete.assert_called_once_with(
             'https://monitoring.api.rackspacecloud.com/v1.0/101010'
             '/entities/entity-abc/alarms/alarm-xyz',
+            pool=self.client._pool,
             headers={'content-type': ['application/json'],
                      'accept': ['application/json'],
                      'x-auth-token': ['auth-abc']})
+
+
+class TestConnectionPools(unittest.TestCase):
+    """Test the persistent connection pools shared by MaasClients."""
+
+    def setUp(self):
+        """Start with no pools."""
+        patcher = mock.patch.dict(ele._connection_pools, clear=True)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_shared_per_endpoint(self):
+        """Clients for the same endpoint share a pool, other endpoints don't."""
+        catalog = [{'name': 'cloudMonitoring',
+                    'endpoints': [{'publicURL': 'https://monitoring/v1.0/101010'}]}]
+        other_catalog = [{'name': 'cloudMonitoring',
+                          'endpoints': [{'publicURL': 'https://monitoring/v1.0/202020'}]}]
+
+        client = ele.MaasClient(catalog, 'auth-abc')
+
+        self.assertIdentical(client._pool, ele.MaasClient(catalog, 'auth-def')._pool)
+        self.assertNotIdentical(client._pool, ele.MaasClient(other_catalog, 'auth-abc')._pool)
+        self.assertTrue(client._pool.persistent)
+        self.assertEqual(client._pool.maxPersistentPerHost, ele.MAX_PERSISTENT_PER_HOST)
+
+    def test_pool_settings(self):
+        """The size and idle timeout of a new pool can be set."""
+        pool = ele.get_connection_pool('https://monitoring', max_per_host=3, idle_timeout=5)
+
+        self.assertEqual(pool.maxPersistentPerHost, 3)
+        self.assertEqual(pool.cachedConnectionTimeout, 5)
+
+    def test_client_pool_settings(self):
+        """A client makes its endpoint's pool with the settings it is given."""
+        catalog = [{'name': 'cloudMonitoring',
+                    'endpoints': [{'publicURL': 'https://monitoring/v1.0/101010'}]}]
+
+        client = ele.MaasClient(catalog, 'auth-abc', max_per_host=3, idle_timeout=5)
+
+        self.assertEqual(client._pool.maxPersistentPerHost, 3)
+        self.assertEqual(client._pool.cachedConnectionTimeout, 5)
+
+    def test_hits_and_misses(self):
+        """Reusing a cached connection is a hit, opening a new one is a miss."""
+        pool = ele.get_connection_pool('https://monitoring')
+        key = ('https', 'monitoring', 443)
+
+        endpoint = mock.Mock()
+        endpoint.connect.return_value = defer.Deferred()
+        pool.getConnection(key, endpoint)
+
+        connection = mock.Mock(state='QUIESCENT')
+        pool._connections[key] = [connection]
+        pool._timeouts[connection] = mock.Mock()
+        self.successResultOf(pool.getConnection(key, endpoint))
+
+        self.assertEqual(ele.connection_pool_stats(),
+                         {'https://monitoring': {'hits': 1, 'misses': 1}})
+
+
+class TestRequestScheduler(unittest.TestCase):
+    """Test bobby.ele.RequestScheduler."""
+
+    def setUp(self):
+        """Create a scheduler allowing two requests a second, in bursts of two."""
+        self.clock = task.Clock()
+        self.scheduler = ele.RequestScheduler(rate=2, burst=2, max_retries=1, clock=self.clock)
+        self.sent = []
+
+    def send(self, name, code=201, header=None):
+        """A request that records it was sent, and gets a response with ``code``.
+
+        Every header of the response has the values ``header``.
+        """
+        response = mock.Mock(code=code)
+        response.headers.getRawHeaders.return_value = header
+        self.sent.append(name)
+        return defer.succeed(response)
+
+    def test_token_bucket(self):
+        """Requests beyond the burst wait for the bucket to refill."""
+        ds = [self.scheduler.request(ele.PRIORITY_NORMAL, self.send, i) for i in range(4)]
+
+        self.assertEqual(self.sent, [0, 1])
+        self.assertEqual(self.scheduler.queued(), {ele.PRIORITY_NORMAL: 2})
+        self.clock.advance(0.5)
+        self.assertEqual(self.sent, [0, 1, 2])
+        self.clock.advance(0.5)
+        self.assertEqual(self.sent, [0, 1, 2, 3])
+        self.assertEqual([self.successResultOf(d).code for d in ds], [201] * 4)
+
+    def test_priorities(self):
+        """Queued requests are sent highest priority first, and in order within a priority."""
+        for i in range(2):
+            self.scheduler.request(ele.PRIORITY_NORMAL, self.send, 'first-{0}'.format(i))
+        self.scheduler.request(ele.PRIORITY_BULK, self.send, 'bulk')
+        self.scheduler.request(ele.PRIORITY_NORMAL, self.send, 'normal')
+        self.scheduler.request(ele.PRIORITY_HIGH, self.send, 'delete')
+
+        self.clock.pump([0.5] * 3)
+        self.assertEqual(self.sent, ['first-0', 'first-1', 'delete', 'normal', 'bulk'])
+
+    def test_retry_after(self):
+        """A 429 pauses the scheduler for the Retry-After, and then the request is sent again."""
+        responses = [self.send('throttled', 429, ['3']), self.send('created')]
+        d = self.scheduler.request(ele.PRIORITY_NORMAL, responses.pop, 0)
+        self.scheduler.request(ele.PRIORITY_NORMAL, self.send, 'waiting')
+        responses.reverse()
+
+        self.assertNoResult(d)
+        self.clock.advance(2.9)
+        self.assertNoResult(d)
+        self.clock.advance(0.1)
+        self.assertEqual(self.successResultOf(d).code, 201)
+        self.assertEqual((self.scheduler.sent, self.scheduler.throttled), (3, 1))
+
+    def test_retries_limited(self):
+        """After ``max_retries`` 429s, the response is passed on."""
+        d = self.scheduler.request(ele.PRIORITY_NORMAL, self.send, 'throttled', 429, None)
+
+        self.clock.advance(1)
+        self.assertEqual(self.successResultOf(d).code, 429)
+        self.assertEqual(self.sent, ['throttled'] * 2)
+
+    def test_errors(self):
+        """Errors making a request are passed on."""
+        d = self.scheduler.request(ele.PRIORITY_NORMAL, lambda: defer.fail(ValueError()))
+        self.failureResultOf(d, ValueError)
+
+    @mock.patch('bobby.ele.treq')
+    def test_client_priorities(self, treq):
+        """MaasClients send deletes at a high priority, and the rest at their own."""
+        self.patch(ele, '_schedulers', {'https://monitoring': self.scheduler})
+        catalog = [{'name': 'cloudMonitoring', 'endpoints': [{'publicURL': 'https://monitoring'}]}]
+        client = ele.MaasClient(catalog, 'auth-abc', ele.PRIORITY_BULK)
+        treq.post.side_effect = lambda url, **kwargs: self.send('post', 201, ['check-xyz'])
+        treq.delete.side_effect = lambda url, **kwargs: self.send('delete', 204)
+
+        for i in range(3):
+            client.add_check('policy-abc', 'entity-abc', '{}')
+        client.remove_check('entity-abc', 'check-abc')
+
+        self.clock.advance(0.5)
+        self.assertEqual(self.sent, ['post', 'post', 'delete'])
+        self.assertEqual(ele.scheduler_stats(),
+                         {'https://monitoring': {'sent': 3, 'throttled': 0, 'queued': 1}})
+
+    def test_client_scheduler_settings(self):
+        """A client makes its endpoint's scheduler with its settings and clock."""
+        self.patch(ele, '_schedulers', {})
+        catalog = [{'name': 'cloudMonitoring', 'endpoints': [{'publicURL': 'https://monitoring'}]}]
+        client = ele.MaasClient(catalog, 'auth-abc', clock=self.clock, request_rate=2, burst=1)
+        treq = mock.Mock()
+        treq.get.side_effect = lambda url, **kwargs: self.send('get', 200)
+
+        for _ in range(3):
+            client._scheduler.request(ele.PRIORITY_NORMAL, treq.get, 'https://monitoring')
+
+        self.assertEqual(self.sent, ['get'])
+        self.clock.advance(0.5)
+        self.assertEqual(self.sent, ['get', 'get'])
+
+
+class TestRetries(unittest.TestCase):
+    """Test MaasClient's retries of creates."""
+
+    def setUp(self):
+        """Create a client with its own scheduler, retry counts and clock."""
+        self.clock = task.Clock()
+        self.patch(ele, '_schedulers', {
+            'https://monitoring': ele.RequestScheduler(clock=self.clock)})
+        self.patch(ele, '_retries', {})
+        catalog = [{'name': 'cloudMonitoring', 'endpoints': [{'publicURL': 'https://monitoring'}]}]
+        self.client = ele.MaasClient(catalog, 'auth-abc', clock=self.clock)
+
+    def respond(self, code, object_id=None):
+        response = mock.Mock(code=code)
+        response.headers.getRawHeaders.return_value = [object_id]
+        return defer.succeed(response)
+
+    @mock.patch('bobby.ele.treq')
+    def test_found_after_lost_response(self, treq):
+        """A create that failed but went through is found, on any page, and not repeated."""
+        treq.post.return_value = self.respond(503)
+        pages = {
+            'https://monitoring/entities/entity-abc/checks': {
+                'values': [{'id': 'check-abc', 'metadata': {'bobby_policy_id': 'policy-def'}}],
+                'metadata': {'next_href': 'https://monitoring/next'}},
+            'https://monitoring/next': {
+                'values': [{'id': 'check-xyz', 'metadata': {'bobby_policy_id': 'policy-abc'}}],
+                'metadata': {'next_href': None}}}
+        treq.get.side_effect = lambda url, **kwargs: self.respond(200, url)
+        treq.json_content.side_effect = lambda response: pages[response.headers.getRawHeaders()[0]]
+
+        d = self.client.add_check('policy-abc', 'entity-abc', '{"type": "agent.cpu"}')
+        self.clock.advance(ele.BACKOFF)
+
+        self.assertEqual(self.successResultOf(d)['id'], 'check-xyz')
+        self.assertEqual(treq.post.call_count, 1)
+        self.assertEqual(ele.retry_stats(),
+                         {'add_check': {'retried': 1, 'found': 1, 'exhausted': 0}})
+
+    @mock.patch('bobby.ele.treq')
+    def test_backoff(self, treq):
+        """Each retry waits up to twice as long as the last."""
+        self.patch(ele.random, 'uniform', lambda low, high: high)
+        responses = [self.respond(500), self.respond(500), self.respond(201, 'entity-abc')]
+        treq.post.side_effect = lambda url, **kwargs: responses.pop(0)
+        treq.get.side_effect = lambda url, **kwargs: self.respond(200)
+        treq.json_content.return_value = {'values': []}
+
+        d = self.client.create_entity(
+            {'label': 'server', 'agent_id': None, 'ip_addresses': {}, 'metadata': None})
+        self.clock.advance(ele.BACKOFF)
+        self.assertEqual(treq.post.call_count, 2)
+        self.clock.advance(ele.BACKOFF * 2 - 0.1)
+        self.assertNoResult(d)
+        self.clock.advance(0.1)
+
+        self.assertEqual(self.successResultOf(d), 'entity-abc')
+
+    @mock.patch('bobby.ele.treq')
+    def test_client_errors_not_retried(self, treq):
+        """Failures that aren't transient are passed on at once."""
+        treq.post.return_value = self.respond(400)
+
+        d = self.client.add_alarm('policy-abc', 'entity-abc', 'plan-abc', 'check-abc', 'criteria')
+
+        self.assertEqual(self.failureResultOf(d, APIError).value.code, 400)
+        self.assertEqual(ele.retry_stats(), {})
@@ -0,0 +1,83 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.execution."""
+import mock
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from bobby import execution
+
+
+class TestExecutionTracker(unittest.TestCase):
+    """Test bobby.execution.ExecutionTracker."""
+
+    def setUp(self):
+        """Create a tracker whose executions wait to be fired."""
+        self.executions = []
+
+        def execute(policy_id):
+            d = defer.Deferred()
+            self.executions.append((policy_id, d))
+            return d
+        self.execute = execute
+
+        self.clock = task.Clock()
+        self.tracker = execution.ExecutionTracker(cooldown=300, clock=self.clock)
+
+    def test_concurrent_executions_collapse(self):
+        """Executions requested while one is running share its result."""
+        d1 = self.tracker.run('policy-abc', self.execute)
+        d2 = self.tracker.run('policy-abc', self.execute)
+
+        self.assertEqual(len(self.executions), 1)
+        self.executions[0][1].callback('executed')
+        self.assertEqual(self.successResultOf(d1), 'executed')
+        self.assertEqual(self.successResultOf(d2), 'executed')
+        self.assertEqual(self.tracker.metrics(),
+                         {'executed': 1, 'suppressed': 1, 'in_flight': 0})
+
+    def test_cooldown(self):
+        """Executions within the cooldown are suppressed."""
+        self.tracker.run('policy-abc', self.execute)
+        self.executions[0][1].callback('executed')
+
+        self.clock.advance(299)
+        d = self.tracker.run('policy-abc', self.execute)
+        self.assertIdentical(self.successResultOf(d), None)
+        self.tracker.run('policy-def', self.execute)
+        self.assertEqual(len(self.executions), 2)
+
+        self.clock.advance(1)
+        self.tracker.run('policy-abc', self.execute)
+        self.assertEqual(len(self.executions), 3)
+
+    def test_failure_no_cooldown(self):
+        """A failed execution fails every waiter, and doesn't start a cooldown."""
+        d1 = self.tracker.run('policy-abc', self.execute)
+        d2 = self.tracker.run('policy-abc', self.execute)
+        self.executions[0][1].errback(ValueError('boom'))
+
+        self.failureResultOf(d1, ValueError)
+        self.failureResultOf(d2, ValueError)
+
+        self.tracker.run('policy-abc', self.execute)
+        self.assertEqual(len(self.executions), 2)
+
+    @mock.patch('bobby.execution.cass')
+    def test_shared_cooldown(self, cass):
+        """With a database, executions recorded by other nodes are honoured."""
+        db = mock.Mock()
+        tracker = execution.ExecutionTracker(db, cooldown=300, clock=self.clock)
+        self.clock.advance(1000)
+
+        cass.get_policy_execution.return_value = defer.succeed(900)
+        d = tracker.run('policy-abc', self.execute)
+        self.assertIdentical(self.successResultOf(d), None)
+        self.assertEqual(self.executions, [])
+
+        cass.get_policy_execution.return_value = defer.succeed(None)
+        cass.record_policy_execution.return_value = defer.succeed(None)
+        d = tracker.run('policy-def', self.execute)
+        self.executions[0][1].callback('executed')
+
+        self.assertEqual(self.successResultOf(d), 'executed')
+        cass.record_policy_execution.assert_called_once_with(db, 'policy-def', 1000, 300)
@@ -0,0 +1,137 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.fake_cql, driven through bobby.cass."""
+from silverberg.cassandra.ttypes import InvalidRequestException
+from twisted.internet import task
+from twisted.trial import unittest
+
+from bobby import cass, fake_cql, quorum
+
+
+class TestFakeCQLClient(unittest.TestCase):
+    """Test bobby.fake_cql.FakeCQLClient."""
+
+    def setUp(self):
+        """Create a client for bobby's schema, with a secondary index for testing."""
+        tables = fake_cql.parse_schema(open(fake_cql.SCHEMA_PATH).read())
+        tables['serverpolicies'].indexes.add('alarmId')
+        self.clock = task.Clock()
+        self.db = fake_cql.FakeCQLClient(tables, clock=self.clock)
+
+    def test_parse_schema(self):
+        """Tables are read with their partition and clustering keys."""
+        table = fake_cql.FakeCQLClient.from_schema()._tables['serverpolicies']
+        self.assertEqual((table.partition_key, table.clustering_keys),
+                         ('policyId', ['serverId']))
+        self.assertEqual(table.columns['state'], 'ascii')
+
+    def test_insert_and_select(self):
+        """Rows are upserted by primary key, and read back with every column."""
+        cass.create_group(self.db, '101010', 'group-abc', 'nt-abc', 'np-abc')
+        cass.create_group(self.db, '101010', 'group-abc', 'nt-def', 'np-def')
+
+        group = self.successResultOf(cass.get_group_by_id(self.db, '101010', 'group-abc'))
+        self.assertEqual(group, {'tenantId': '101010', 'groupId': 'group-abc',
+                                 'notification': 'nt-def', 'notificationPlan': 'np-def'})
+        self.failureResultOf(cass.get_group_by_id(self.db, '101010', 'group-def'),
+                             cass.ResultNotFoundError)
+
+    def test_pages_and_partition_delete(self):
+        """Partitions are read in clustering order, and can be dropped whole."""
+        servers = [('server-{0}'.format(i), 'entity-{0}'.format(i)) for i in (3, 1, 4, 0, 2)]
+        self.successResultOf(cass.create_servers(self.db, '101010', 'group-abc', servers))
+        cass.create_server(self.db, '101010', 'server-9', 'entity-9', 'group-def')
+
+        pages = []
+        d = cass.page_servers_by_group_id(self.db, '101010', 'group-abc', page_size=2).each(
+            lambda page: pages.append([server['serverId'] for server in page]))
+        self.successResultOf(d)
+        self.assertEqual(pages, [['server-0', 'server-1'], ['server-2', 'server-3'],
+                                 ['server-4']])
+
+        self.db.execute('DELETE FROM servers WHERE "groupId"=:groupId;',
+                        {'groupId': 'group-abc'}, 1)
+        self.assertEqual([row['serverId'] for row in self.db.rows('servers')], ['server-9'])
+
+    def test_alarm_state_and_counters(self):
+        """Alarm changes update every copy of a serverpolicy, and the quorum counters."""
+        cass.register_policy_on_servers(
+            self.db, 'policy-abc', [('server-abc', 'alarm-abc', 'check-abc'),
+                                    ('server-def', 'alarm-def', 'check-def')])
+        d = cass.alter_alarm_state(self.db, 'alarm-abc', 'OK')
+
+        self.assertEqual(self.successResultOf(d), ('policy-abc', 'server-abc'))
+        self.assertEqual(self.successResultOf(cass.count_policy_states(self.db, 'policy-abc')),
+                         (2, 1))
+        self.assertEqual(self.successResultOf(cass.get_quorum_counts(self.db, 'policy-abc')),
+                         (2, 1))
+
+        serverpolicies = self.successResultOf(
+            cass.get_serverpolicies_by_server_id(self.db, 'group-abc', 'server-abc'))
+        self.assertEqual([sp['state'] for sp in serverpolicies], ['OK'])
+
+        cass.register_policy_on_servers(
+            self.db, 'policy-abc', [('server-abc', 'alarm-abc', 'check-abc'),
+                                    ('server-ghi', 'alarm-ghi', 'check-ghi')])
+        cass.register_policy_on_server(self.db, 'policy-abc', 'server-ghi', 'alarm-ghi', 'check-ghi')
+        self.assertEqual(self.successResultOf(cass.count_policy_states(self.db, 'policy-abc')),
+                         (3, 3))
+        self.assertEqual(self.successResultOf(cass.get_quorum_counts(self.db, 'policy-abc')),
+                         (3, 3))
+
+    def test_counters_predating_serverpolicies(self):
+        """A tracker recounts counters that don't count serverpolicies written before them."""
+        for i in range(10):
+            self.db.execute(
+                'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId, :policyId, :alarmId, :checkId, :state);',
+                {'serverId': 'server-{0}'.format(i), 'policyId': 'policy-abc',
+                 'alarmId': 'alarm-{0}'.format(i), 'checkId': 'check-{0}'.format(i),
+                 'state': 'OK'}, 1)
+        tracker = quorum.QuorumTracker(self.db, clock=self.clock)
+        cass.register_policy_on_server(self.db, 'policy-abc', 'server-new', 'alarm-new',
+                                       'check-new', tracker)
+        self.assertEqual(self.successResultOf(cass.get_quorum_counts(self.db, 'policy-abc')),
+                         (1, 1))
+
+        self.assertEqual(self.successResultOf(tracker.get_counts('policy-abc')), (11, 1))
+        self.assertTrue(self.successResultOf(tracker.is_healthy('policy-abc')))
+        self.assertEqual(self.successResultOf(cass.get_quorum_counts(self.db, 'policy-abc')),
+                         (11, 1))
+
+    def test_in_and_index(self):
+        """IN restricts to several keys, and indexed columns can be queried alone."""
+        cass.register_policy_on_servers(
+            self.db, 'policy-abc', [('server-abc', 'alarm-abc', 'check-abc'),
+                                    ('server-def', 'alarm-def', 'check-def')])
+
+        d = self.db.execute(
+            'SELECT * FROM serverpolicies WHERE "policyId"=:policyId '
+            'AND "serverId" IN (:one, :two);',
+            {'policyId': 'policy-abc', 'one': 'server-def', 'two': 'server-xyz'}, 1)
+        self.assertEqual([row['serverId'] for row in self.successResultOf(d)], ['server-def'])
+
+        d = self.db.execute('SELECT * FROM serverpolicies WHERE "alarmId"=:alarmId;',
+                            {'alarmId': 'alarm-abc'}, 1)
+        self.assertEqual([row['serverId'] for row in self.successResultOf(d)], ['server-abc'])
+
+        cass.deregister_policy_on_server(self.db, 'policy-abc', 'server-abc')
+        self.assertEqual(self.successResultOf(d.addCallback(lambda _: self.db.execute(
+            'SELECT * FROM serverpolicies WHERE "alarmId"=:alarmId;',
+            {'alarmId': 'alarm-abc'}, 1))), [])
+
+    def test_unrestricted_query_refused(self):
+        """A query that would scan the table is refused, as Cassandra would."""
+        d = self.db.execute('SELECT * FROM servers WHERE "entityId"=:entityId;',
+                            {'entityId': 'entity-abc'}, 1)
+        self.failureResultOf(d, InvalidRequestException)
+
+    def test_ttl(self):
+        """Rows written with a TTL are gone once it passes."""
+        cass.record_policy_execution(self.db, 'policy-abc', 1000, 300)
+        self.clock.advance(299)
+        self.assertEqual(
+            self.successResultOf(cass.get_policy_execution(self.db, 'policy-abc')), 1000)
+
+        self.clock.advance(1)
+        self.assertIdentical(
+            self.successResultOf(cass.get_policy_execution(self.db, 'policy-abc')), None)
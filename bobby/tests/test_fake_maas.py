@@ -0,0 +1,132 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.fake_maas, driven through bobby.ele.MaasClient."""
+import json
+
+from otter.util.http import APIError
+from treq.testing import StubTreq
+from twisted.internet import task
+from twisted.trial import unittest
+
+from bobby import ele, fake_maas
+
+
+URL = 'http://maas.example.com'
+SERVER = {'label': 'server-abc', 'agent_id': 'agent-abc', 'ip_addresses': {}, 'metadata': {}}
+
+
+class TestFakeMaaS(unittest.TestCase):
+    """Test bobby.fake_maas.FakeMaaS."""
+
+    def make_client(self, **kwargs):
+        """Serve a FakeMaaS through a stub treq, and make a MaasClient for it."""
+        self.clock = task.Clock()
+        self.maas = fake_maas.FakeMaaS(clock=self.clock, **kwargs)
+        self.treq = StubTreq(self.maas.app.resource())
+        self.patch(ele, 'treq', self.treq)
+        self.patch(ele, '_schedulers', {URL: ele.RequestScheduler(clock=self.clock)})
+        self.patch(ele, '_retries', {})
+        return ele.MaasClient(fake_maas.FakeMaaS.service_catalog(URL), 'token',
+                              clock=self.clock)
+
+    def test_objects(self):
+        """Checks and alarms are created on entities, read back and deleted."""
+        client = self.make_client()
+        entity_id = self.successResultOf(client.create_entity(SERVER))
+        check = self.successResultOf(
+            client.add_check('policy-abc', entity_id, json.dumps({'type': 'agent.cpu'}),
+                             fetch=True))
+        alarm = self.successResultOf(
+            client.add_alarm('policy-abc', entity_id, 'np-abc', check['id'], 'criteria'))
+
+        self.assertEqual((check['type'], check['entity_id']), ('agent.cpu', entity_id))
+        self.assertEqual(self.maas.objects['alarms'][alarm['id']]['criteria'], 'criteria')
+
+        self.successResultOf(client.remove_alarm(entity_id, alarm['id']))
+        self.successResultOf(client.remove_alarm(entity_id, alarm['id']))
+        self.assertEqual(self.maas.objects['alarms'], {})
+        self.assertEqual(self.maas.metrics()['requests']['delete_alarm'], 2)
+
+    def test_notifications(self):
+        """Notifications and plans are created and deleted in pairs."""
+        client = self.make_client()
+        notification_id, plan_id = self.successResultOf(client.add_notification_and_plan())
+        self.assertEqual(self.maas.objects['notification_plans'][plan_id]['critical_state'],
+                         [notification_id])
+
+        self.successResultOf(client.remove_notification_and_plan(plan_id, notification_id))
+        self.assertEqual(self.maas.objects['notifications'], {})
+
+    def test_latency(self):
+        """Responses are delayed by the latency of their endpoint."""
+        client = self.make_client(latency={'create_entity': 2, 'default': 1})
+        d = client.create_entity(SERVER)
+        self.treq.flush()
+        self.clock.advance(1)
+        self.assertNoResult(d)
+
+        self.clock.advance(1)
+        self.treq.flush()
+        self.successResultOf(d)
+
+    def test_rate_limit(self):
+        """Requests over the limit get a 429 with a Retry-After, until the period ends."""
+        self.make_client(rate_limit=1, rate_period=10)
+        self.clock.advance(4)
+        url = URL + '/entities/en-abc/checks/ch-abc'
+        self.assertEqual(self.successResultOf(self.treq.delete(url)).code, 404)
+
+        response = self.successResultOf(self.treq.delete(url))
+        self.assertEqual(response.code, 429)
+        self.assertEqual(response.headers.getRawHeaders('retry-after'), ['6'])
+
+        self.clock.advance(6)
+        self.assertEqual(self.successResultOf(self.treq.delete(url)).code, 404)
+        self.assertEqual(self.maas.metrics()['throttled'], {'delete_check': 1})
+
+    def test_client_waits_out_rate_limit(self):
+        """A MaasClient waits as long as the 429 says, and then succeeds."""
+        client = self.make_client(rate_limit=1, rate_period=10)
+        self.successResultOf(client.create_entity(SERVER))
+
+        d = client.create_entity(SERVER)
+        self.assertNoResult(d)
+        self.clock.advance(10)
+        self.successResultOf(d)
+        self.assertEqual(len(self.maas.objects['entities']), 2)
+
+    def test_errors(self):
+        """Injected errors fail requests without changing anything."""
+        client = self.make_client(error_rate={'create_check': 1}, error_code=400)
+        entity_id = self.successResultOf(client.create_entity(SERVER))
+
+        failure = self.failureResultOf(client.add_check('policy-abc', entity_id, '{}'), APIError)
+        self.assertEqual(failure.value.code, 400)
+        self.assertEqual(self.maas.objects['checks'], {})
+        self.assertEqual(self.maas.metrics()['errors'], {'create_check': 1})
+
+    def test_client_retries(self):
+        """A MaasClient retries creates that fail with a 5xx, after backing off."""
+        client = self.make_client(error_rate={'create_check': 1}, error_code=503)
+        entity_id = self.successResultOf(client.create_entity(SERVER))
+
+        d = client.add_check('policy-abc', entity_id, '{}')
+        self.assertNoResult(d)
+        self.maas._error_rate = 0
+        self.clock.advance(ele.BACKOFF)
+
+        check = self.successResultOf(d)
+        self.assertEqual(self.maas.objects['checks'].keys(), [check['id']])
+        self.assertEqual(self.maas.metrics()['requests']['list_checks'], 1)
+        self.assertEqual(ele.retry_stats(),
+                         {'add_check': {'retried': 1, 'found': 0, 'exhausted': 0}})
+
+    def test_client_gives_up(self):
+        """A MaasClient gives up after MAX_RETRIES retries."""
+        client = self.make_client(error_rate={'create_entity': 1})
+
+        d = client.create_entity(SERVER)
+        self.clock.pump([ele.MAX_BACKOFF] * ele.MAX_RETRIES)
+
+        self.assertEqual(self.failureResultOf(d, APIError).value.code, 500)
+        self.assertEqual(self.maas.metrics()['errors'], {'create_entity': ele.MAX_RETRIES + 1})
+        self.assertEqual(ele.retry_stats()['create_entity']['exhausted'], 1)
@@ -0,0 +1,54 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.jobs."""
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from bobby import jobs
+
+
+class TestJobRunner(unittest.TestCase):
+    """Test bobby.jobs.JobRunner."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.runner = jobs.JobRunner(limit=1, retention=60, clock=self.clock)
+
+    def test_job_status(self):
+        """A job's status follows it from pending to succeeded."""
+        first = defer.Deferred()
+        second = defer.Deferred()
+        job1 = self.runner.submit('101010', lambda: first)
+        job2 = self.runner.submit('101010', lambda: second)
+
+        self.assertEqual((job1.status, job2.status), ('running', 'pending'))
+
+        first.callback({'groupId': 'group-abc'})
+        self.assertEqual((job1.status, job2.status), ('succeeded', 'running'))
+        self.assertEqual(job1.result, {'groupId': 'group-abc'})
+
+        second.errback(ValueError('boom'))
+        self.assertEqual((job2.status, job2.error), ('failed', 'boom'))
+        self.assertEqual(self.runner.metrics(),
+                         {'pending': 0, 'running': 0, 'succeeded': 1, 'failed': 1})
+        self.assertEqual([str(f.value) for f in self.flushLoggedErrors(ValueError)], ['boom'])
+
+    def test_get(self):
+        """Jobs are only found for their own tenant, until their retention passes."""
+        job = self.runner.submit('101010', lambda: defer.succeed(None))
+
+        self.assertIdentical(self.runner.get('101010', job.id), job)
+        self.assertIdentical(self.runner.get('202020', job.id), None)
+
+        self.clock.advance(60)
+        self.assertIdentical(self.runner.get('101010', job.id), None)
+
+    def test_progress(self):
+        """A created job can be handed to its work to report progress."""
+        job = self.runner.create('101010')
+        self.assertEqual(job.status, 'pending')
+
+        self.runner.run(job, lambda report: report(3, 4) or defer.succeed(None),
+                        job.report_progress)
+
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.progress, {'done': 3, 'total': 4})
@@ -0,0 +1,88 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.metrics."""
+import mock
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from bobby import metrics
+
+
+class APIError(Exception):
+    """An error with an HTTP status code, like otter's."""
+
+    def __init__(self, code):
+        super(APIError, self).__init__(code)
+        self.code = code
+
+
+class TestMetrics(unittest.TestCase):
+    """Test bobby.metrics.Metrics."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.metrics = metrics.Metrics(buckets=(0.1, 1), clock=self.clock)
+
+    def test_time_deferred(self):
+        """A call is timed until its Deferred fires, and bucketed by duration."""
+        pending = defer.Deferred()
+        d = self.metrics.time('cass', 'get_group', lambda: pending)
+        self.clock.advance(0.5)
+        pending.callback('group')
+
+        self.assertEqual(self.successResultOf(d), 'group')
+        histogram = self.metrics.histograms()[('cass', 'get_group', 'success')]
+        self.assertEqual((histogram.counts, histogram.sum, histogram.count), ([0, 1], 0.5, 1))
+
+    def test_time_failures(self):
+        """Failures are recorded by status code, or else by error type."""
+        d = self.metrics.time('maas', 'add_check', lambda: defer.fail(APIError(429)))
+        self.failureResultOf(d, APIError)
+        self.assertRaises(ValueError, self.metrics.time, 'maas', 'add_check',
+                          mock.Mock(side_effect=ValueError))
+
+        self.assertEqual(sorted(self.metrics.histograms()),
+                         [('maas', 'add_check', '429'), ('maas', 'add_check', 'ValueError')])
+
+    def test_disabled(self):
+        """When disabled, calls aren't timed."""
+        self.metrics.enabled = False
+        f = mock.Mock(return_value=defer.succeed(None))
+
+        self.metrics.time('cass', 'get_group', f, 'a', b='c')
+
+        f.assert_called_once_with('a', b='c')
+        self.assertEqual(self.metrics.histograms(), {})
+
+    def test_render(self):
+        """Histograms and other metrics are rendered in the Prometheus text format."""
+        self.metrics.observe('cass', 'get_group', 'success', 0.05)
+        self.metrics.observe('cass', 'get_group', 'success', 2)
+
+        text = self.metrics.render([
+            ('bobby_jobs', 'gauge', 'Background jobs.', [({'status': 'run"ning'}, 3)])])
+
+        self.assertEqual(text.splitlines(), [
+            '# HELP bobby_cass_operation_seconds Time taken by cass operations.',
+            '# TYPE bobby_cass_operation_seconds histogram',
+            'bobby_cass_operation_seconds_bucket'
+            '{le="0.1",operation="get_group",outcome="success"} 1.0',
+            'bobby_cass_operation_seconds_bucket'
+            '{le="1.0",operation="get_group",outcome="success"} 1.0',
+            'bobby_cass_operation_seconds_bucket'
+            '{le="+Inf",operation="get_group",outcome="success"} 2.0',
+            'bobby_cass_operation_seconds_sum{operation="get_group",outcome="success"} 2.05',
+            'bobby_cass_operation_seconds_count{operation="get_group",outcome="success"} 2.0',
+            '# HELP bobby_jobs Background jobs.',
+            '# TYPE bobby_jobs gauge',
+            'bobby_jobs{status="run\\"ning"} 3.0'])
+
+    def test_timed(self):
+        """Decorated functions are timed in the registry, named after the function."""
+        self.patch(metrics, 'registry', self.metrics)
+
+        @metrics.timed('cass')
+        def get_group(group_id):
+            return defer.succeed(group_id)
+
+        self.assertEqual(self.successResultOf(get_group('group-abc')), 'group-abc')
+        self.assertEqual(self.metrics.histograms().keys(), [('cass', 'get_group', 'success')])
@@ -0,0 +1,79 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.pool."""
+import mock
+from twisted.internet import defer, error, task
+from twisted.trial import unittest
+
+from bobby import pool
+
+
+class TestCQLClientPool(unittest.TestCase):
+    """Test bobby.pool.CQLClientPool."""
+
+    def setUp(self):
+        """Create a pool of mock clients whose queries wait to be fired."""
+        self.clients = {}
+        self.pending = []
+
+        def client_factory(host):
+            client = mock.Mock()
+
+            def execute(query, params, consistency):
+                d = defer.Deferred()
+                self.pending.append((host, d))
+                return d
+            client.execute.side_effect = execute
+            self.clients.setdefault(host, []).append(client)
+            return client
+
+        self.clock = task.Clock()
+        self.pool = pool.CQLClientPool(['host-a', 'host-b'], client_factory,
+                                       size=1, max_outstanding=1, clock=self.clock)
+
+    def test_least_outstanding(self):
+        """Queries go to the clients with the fewest outstanding queries."""
+        self.pool.execute('SELECT', {}, 1)
+        self.pool.execute('SELECT', {}, 1)
+
+        self.assertEqual(sorted(host for host, _ in self.pending), ['host-a', 'host-b'])
+        self.assertEqual(self.pool.in_flight, 2)
+
+    def test_queued_when_busy(self):
+        """Queries wait for a client to be free, and then run."""
+        self.pool.execute('SELECT', {}, 1)
+        self.pool.execute('SELECT', {}, 1)
+        d = self.pool.execute('SELECT', {}, 1)
+
+        self.assertNoResult(d)
+        self.assertEqual(self.pool.queued, 1)
+
+        self.pending[0][1].callback(None)
+        self.assertEqual(self.pool.queued, 0)
+        self.assertEqual(len(self.pending), 3)
+
+        self.pending[2][1].callback(['row'])
+        self.assertEqual(self.successResultOf(d), ['row'])
+
+    def test_dead_host_backoff(self):
+        """A host whose connection fails is avoided until its backoff passes."""
+        d = self.pool.execute('SELECT', {}, 1)
+        host, pending = self.pending.pop()
+        pending.errback(error.ConnectionRefusedError())
+        self.failureResultOf(d, error.ConnectionRefusedError)
+
+        other = 'host-b' if host == 'host-a' else 'host-a'
+        self.pool.execute('SELECT', {}, 1)
+        self.assertEqual(self.pending.pop()[0], other)
+        self.assertTrue(self.pool.metrics()['hosts'][host]['dead'])
+
+        self.clock.advance(1)
+        self.assertFalse(self.pool.metrics()['hosts'][host]['dead'])
+
+    def test_query_errors_do_not_kill_host(self):
+        """Errors from the query itself don't mark the host as dead."""
+        d = self.pool.execute('SELECT', {}, 1)
+        host, pending = self.pending.pop()
+        pending.errback(ValueError('bad query'))
+        self.failureResultOf(d, ValueError)
+
+        self.assertFalse(self.pool.metrics()['hosts'][host]['dead'])
@@ -0,0 +1,86 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.prepared."""
+import mock
+from silverberg.cassandra import ttypes
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from bobby import prepared
+
+
+QUERY = 'UPDATE policyquorum SET total=total + :total WHERE "policyId"=:policyId;'
+
+
+class TestPreparedCQLClient(unittest.TestCase):
+    """Test bobby.prepared.PreparedCQLClient."""
+
+    def setUp(self):
+        """Replace the thrift connection with a mock."""
+        self.thrift = mock.Mock()
+        self.thrift.prepare_cql3_query.side_effect = lambda *args: defer.succeed(
+            ttypes.CqlPreparedResult(
+                itemId=12, count=2,
+                variable_types=['org.apache.cassandra.db.marshal.CounterColumnType',
+                                'org.apache.cassandra.db.marshal.AsciiType']))
+        self.thrift.execute_prepared_cql3_query.side_effect = lambda *args: defer.succeed(
+            ttypes.CqlResult(type=ttypes.CqlResultType.VOID))
+        self.thrift.execute_cql3_query.side_effect = lambda *args: defer.succeed(
+            ttypes.CqlResult(type=ttypes.CqlResultType.VOID))
+
+        self.client = prepared.PreparedCQLClient(mock.Mock(), 'bobby')
+        self.client._connection = lambda: defer.succeed(self.thrift)
+
+    def test_execute_prepares_once(self):
+        """A query is prepared once, then executed by id each time."""
+        for _ in range(2):
+            d = self.client.execute(QUERY, {'policyId': u'policy-abc', 'total': -1}, 1)
+            self.assertIdentical(self.successResultOf(d), None)
+
+        self.thrift.prepare_cql3_query.assert_called_once_with(
+            'UPDATE policyquorum SET total=total + ? WHERE "policyId"=?;',
+            ttypes.Compression.NONE)
+        self.assertEqual(
+            self.thrift.execute_prepared_cql3_query.mock_calls,
+            [mock.call(12, ['\xff' * 8, 'policy-abc'], 1)] * 2)
+
+    def test_new_connection_prepares_again(self):
+        """Statements are only cached for the connection they were prepared on."""
+        self.successResultOf(self.client.execute(QUERY, {'policyId': 'p', 'total': 1}, 1))
+
+        new_thrift = mock.Mock(wraps=self.thrift)
+        self.client._connection = lambda: defer.succeed(new_thrift)
+        self.successResultOf(self.client.execute(QUERY, {'policyId': 'p', 'total': 1}, 1))
+
+        self.assertEqual(self.thrift.prepare_cql3_query.call_count, 2)
+
+    def test_reprepares_unknown_statement(self):
+        """An unprepared error causes the query to be prepared and run again."""
+        results = [
+            defer.fail(ttypes.InvalidRequestException(
+                why='Prepared query with ID 12 not found (either the query was not prepared '
+                    'on this host (maybe the host has been restarted?) ...)')),
+            defer.succeed(ttypes.CqlResult(type=ttypes.CqlResultType.INT, num=3))]
+        self.thrift.execute_prepared_cql3_query.side_effect = lambda *args: results.pop(0)
+
+        d = self.client.execute(QUERY, {'policyId': 'p', 'total': 1}, 1)
+
+        self.assertEqual(self.successResultOf(d), 3)
+        self.assertEqual(self.thrift.prepare_cql3_query.call_count, 2)
+
+    def test_other_errors_propagate(self):
+        """Errors other than an unprepared statement are not retried."""
+        self.thrift.execute_prepared_cql3_query.side_effect = lambda *args: defer.fail(
+            ttypes.InvalidRequestException(why='unconfigured columnfamily policyquorum'))
+
+        d = self.client.execute(QUERY, {'policyId': 'p', 'total': 1}, 1)
+
+        self.failureResultOf(d, ttypes.InvalidRequestException)
+        self.thrift.prepare_cql3_query.assert_called_once_with(mock.ANY, mock.ANY)
+
+    def test_null_params_not_prepared(self):
+        """Queries with null parameters are executed without preparing."""
+        d = self.client.execute(QUERY, {'policyId': None, 'total': 1}, 1)
+
+        self.successResultOf(d)
+        self.assertFalse(self.thrift.prepare_cql3_query.called)
+        self.assertTrue(self.thrift.execute_cql3_query.called)
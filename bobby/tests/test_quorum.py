@@ -0,0 +1,104 @@
+# Copyright 2013 Rackspace, Inc.
+"""Tests for bobby.quorum."""
+import mock
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from bobby import quorum
+
+
+class TestQuorumTracker(unittest.TestCase):
+    """Test bobby.quorum.QuorumTracker."""
+
+    def setUp(self):
+        """Patch out bobby.quorum.cass."""
+        patcher = mock.patch('bobby.quorum.cass')
+        self.addCleanup(patcher.stop)
+        self.cass = patcher.start()
+        self.cass.quorum_is_healthy.side_effect = lambda total, critical: critical < total / 2.0
+        self.cass.update_quorum_counts.return_value = defer.succeed(None)
+
+        self.db = mock.Mock()
+        self.clock = task.Clock()
+        self.tracker = quorum.QuorumTracker(self.db, max_age=30, clock=self.clock)
+
+    def _counts(self, stored, actual):
+        """Make Cassandra hold these stored counters and serverpolicy counts."""
+        self.cass.get_quorum_counts.side_effect = lambda *args: defer.succeed(stored)
+        self.cass.count_policy_states.side_effect = lambda *args: defer.succeed(actual)
+
+    def test_first_load_recounts(self):
+        """Stored counts of unknown origin are recounted when a policy is first loaded."""
+        self._counts((1, 1), (11, 1))
+
+        self.assertEqual(self.successResultOf(self.tracker.get_counts('policy-abc')), (11, 1))
+        self.assertEqual(self.successResultOf(self.tracker.get_counts('policy-abc')), (11, 1))
+
+        self.cass.count_policy_states.assert_called_once_with(self.db, 'policy-abc')
+        self.cass.update_quorum_counts.assert_called_once_with(self.db, 'policy-abc', 10, 0)
+        self.assertTrue(self.successResultOf(self.tracker.is_healthy('policy-abc')))
+
+    def test_cold_start_recounts(self):
+        """With nothing stored, the serverpolicies are counted and stored."""
+        self._counts(None, (5, 3))
+
+        d = self.tracker.get_counts('policy-abc')
+
+        self.assertEqual(self.successResultOf(d), (5, 3))
+        self.cass.update_quorum_counts.assert_called_once_with(self.db, 'policy-abc', 5, 3)
+
+    def test_drift_recounts(self):
+        """Impossible stored counts are corrected by a recount."""
+        self._counts((4, 1), (4, 1))
+        self.successResultOf(self.tracker.get_counts('policy-abc'))
+
+        self.clock.advance(31)
+        self._counts((2, 3), (4, 1))
+
+        self.assertEqual(self.successResultOf(self.tracker.get_counts('policy-abc')), (4, 1))
+        self.cass.update_quorum_counts.assert_called_once_with(self.db, 'policy-abc', 2, -2)
+
+    def test_apply(self):
+        """Deltas are applied to counts held in memory."""
+        self._counts((4, 1), (4, 1))
+        self.successResultOf(self.tracker.get_counts('policy-abc'))
+
+        self.tracker.apply('policy-abc', 0, 2)
+
+        self.assertFalse(self.successResultOf(self.tracker.is_healthy('policy-abc')))
+        self.cass.count_policy_states.assert_called_once_with(self.db, 'policy-abc')
+        self.cass.get_quorum_counts.assert_called_once_with(self.db, 'policy-abc')
+
+    def test_expired_counts_reread(self):
+        """In-memory counts older than max_age are read again, without a recount."""
+        self._counts((4, 1), (4, 1))
+        self.successResultOf(self.tracker.get_counts('policy-abc'))
+
+        self.clock.advance(31)
+        self._counts((4, 3), (4, 1))
+
+        self.assertEqual(self.successResultOf(self.tracker.get_counts('policy-abc')), (4, 3))
+        self.assertEqual(self.cass.count_policy_states.call_count, 1)
+
+    def test_periodic_recount(self):
+        """Every few expiries, plausible but wrong counts are corrected by a recount."""
+        self.tracker = quorum.QuorumTracker(self.db, max_age=30, recount_every=3,
+                                            clock=self.clock)
+        self._counts((4, 2), (4, 2))
+        self.successResultOf(self.tracker.get_counts('policy-abc'))
+        self._counts((6, 2), (4, 2))
+
+        for _ in range(2):
+            self.clock.advance(31)
+            self.assertEqual(self.successResultOf(self.tracker.get_counts('policy-abc')), (6, 2))
+        self.assertEqual(self.cass.count_policy_states.call_count, 1)
+
+        self.clock.advance(31)
+        self.assertEqual(self.successResultOf(self.tracker.get_counts('policy-abc')), (4, 2))
+        self.cass.update_quorum_counts.assert_called_once_with(self.db, 'policy-abc', -2, 0)
+
+    def test_is_healthy(self):
+        """The quorum is healthy while fewer than half the servers are critical."""
+        self._counts((5, 2), (5, 2))
+
+        self.assertTrue(self.successResultOf(self.tracker.is_healthy('policy-abc')))
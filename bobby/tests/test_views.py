@@ -4,11 +4,16 @@ import json
 import StringIO
 
 import mock
-from twisted.internet import defer
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
 from twisted.trial import unittest
 from twisted.web.test.requesthelper import DummyRequest
 
-from bobby import views
+from bobby import ele, metrics, views
+from bobby.alarms import AlarmQueue
+from bobby.cache import ReadCache
+from bobby.jobs import JobRunner
+from bobby.quorum import QuorumTracker
 from bobby.worker import BobbyWorker
 
 
@@ -39,6 +44,15 @@ class ViewTest(unittest.TestCase):
         self.worker = mock.create_autospec(BobbyWorker)
         self.bobby._worker = self.worker
 
+        self.quorum = mock.create_autospec(QuorumTracker)
+        self.bobby._quorum = self.quorum
+        self.cache = mock.create_autospec(ReadCache)
+        self.bobby._cache = self.cache
+
+        self.clock = task.Clock()
+        self.bobby._alarms = AlarmQueue(self.bobby._process_alarm, 5, self.clock)
+        self.bobby._jobs = JobRunner(clock=self.clock)
+
     def test_create_server(self):
         """POSTing application/json creates a server."""
         expected = {
@@ -74,6 +88,113 @@ class ViewTest(unittest.TestCase):
         self.worker.create_server.assert_called_once_with(
             '101010', 'group-uvw', request_json['server'])
 
+    def test_create_server_async(self):
+        """With Prefer: respond-async, the server is created in a job."""
+        server = {'entityId': 'entity-xyz', 'groupId': 'group-uvw', 'serverId': 'server-rst'}
+        self.worker.create_server.return_value = defer.succeed(server)
+
+        request = BobbyDummyRequest('/101010/groups/group-uvw/servers/',
+                                    content=json.dumps({'server': {'id': 'server-rst'}}))
+        request.method = 'POST'
+        request.requestHeaders.setRawHeaders('prefer', ['respond-async'])
+
+        d = self.bobby.create_server(request, '101010', 'group-uvw')
+
+        self.successResultOf(d)
+        self.assertEqual(request.responseCode, 202)
+        job = json.loads(request.written[0])
+        self.assertEqual(request.responseHeaders.getRawHeaders('location'),
+                         ['/101010/jobs/{0}'.format(job['jobId'])])
+
+        request = BobbyDummyRequest('/101010/jobs/{0}'.format(job['jobId']))
+        d = self.bobby.get_job(request, '101010', job['jobId'])
+
+        self.successResultOf(d)
+        self.assertEqual(request.responseCode, 200)
+        result = json.loads(request.written[0])
+        self.assertEqual(result['status'], 'succeeded')
+        self.assertEqual(result['result']['serverId'], 'server-rst')
+
+    def test_create_servers(self):
+        """POSTing a list of servers creates them, and reports each one's result."""
+        created = {'server-a': {'entityId': 'entity-a', 'groupId': 'group-uvw', 'serverId': 'server-a'}}
+        failures = {'server-b': Failure(ValueError('no entity'))}
+        self.worker.create_servers.return_value = defer.succeed((created, failures))
+
+        servers = [{'id': 'server-a'}, {'id': 'server-b'}]
+        request = BobbyDummyRequest('/101010/groups/group-uvw/servers/bulk',
+                                    content=json.dumps({'servers': servers}))
+        request.method = 'POST'
+
+        d = self.bobby.create_servers(request, '101010', 'group-uvw')
+
+        self.successResultOf(d)
+        self.assertEqual(request.responseCode, 200)
+        self.assertEqual(json.loads(request.written[0]), {
+            'servers': [{
+                'entityId': 'entity-a',
+                'groupId': 'group-uvw',
+                'links': [{'href': '/101010/groups/group-uvw/servers/server-a', 'rel': 'self'}],
+                'serverId': 'server-a'}],
+            'errors': [{'message': 'no entity', 'serverId': 'server-b'}]})
+        self.worker.create_servers.assert_called_once_with('101010', 'group-uvw', servers)
+
+    def test_delete_servers(self):
+        """DELETEing a list of servers deletes them, and reports each one's result."""
+        self.worker.delete_servers.return_value = defer.succeed((
+            {'server-a': {'serverId': 'server-a'}},
+            {'server-b': Failure(ValueError('no entity'))}))
+
+        request = BobbyDummyRequest('/101010/groups/group-uvw/servers/bulk',
+                                    content=json.dumps({'servers': ['server-a', 'server-b']}))
+        request.method = 'DELETE'
+
+        d = self.bobby.delete_servers(request, '101010', 'group-uvw')
+
+        self.successResultOf(d)
+        self.assertEqual(request.responseCode, 200)
+        self.assertEqual(json.loads(request.written[0]), {
+            'deleted': ['server-a'],
+            'errors': [{'message': 'no entity', 'serverId': 'server-b'}]})
+        self.worker.delete_servers.assert_called_once_with(
+            '101010', 'group-uvw', ['server-a', 'server-b'])
+
+    def test_get_job_not_found(self):
+        """A job that doesn't exist is a 404."""
+        request = BobbyDummyRequest('/101010/jobs/job-abc')
+        d = self.bobby.get_job(request, '101010', 'job-abc')
+
+        self.successResultOf(d)
+        self.assertEqual(request.responseCode, 404)
+
+    def test_get_metrics(self):
+        """GET /metrics renders operation timings and component state for Prometheus."""
+        registry = metrics.Metrics()
+        registry.observe('maas', 'add_check', '429', 0.2)
+        self.patch(metrics, 'registry', registry)
+        self.patch(ele, '_schedulers', {'https://monitoring': ele.RequestScheduler()})
+        self.patch(ele, '_retries', {'add_check': {'retried': 2, 'found': 1, 'exhausted': 0}})
+        self.cache.metrics.return_value = {
+            'groups': {'size': 2, 'hits': 5, 'misses': 2, 'hit_rate': 0.7}}
+
+        request = BobbyDummyRequest('/metrics')
+        d = self.bobby.get_metrics(request)
+
+        self.successResultOf(d)
+        self.assertEqual(request.responseCode, 200)
+        self.assertEqual(request.responseHeaders.getRawHeaders('content-type'),
+                         [metrics.CONTENT_TYPE])
+        lines = ''.join(request.written).splitlines()
+        self.assertIn(
+            'bobby_maas_operation_seconds_count{operation="add_check",outcome="429"} 1.0', lines)
+        self.assertIn('bobby_cache_hits_total{cache="groups"} 5.0', lines)
+        self.assertIn('bobby_alarm_queue_pending 0.0', lines)
+        self.assertIn(
+            'bobby_maas_requests_total{endpoint="https://monitoring",result="throttled"} 0.0',
+            lines)
+        self.assertIn(
+            'bobby_maas_create_retries_total{operation="add_check",result="found"} 1.0', lines)
+
     def test_delete_server(self):
         """Deletes a server and returns 402."""
         self.worker.delete_server.return_value = defer.succeed(None)
@@ -130,12 +251,11 @@ class ViewTest(unittest.TestCase):
         self.assertEqual(request.responseCode, 204)
         self.worker.delete_group.assert_called_once_with('101010', 'uvwxyz')
 
-    @mock.patch('bobby.cass.check_quorum_health')
     @mock.patch('bobby.cass.alter_alarm_state')
-    def test_alarm(self, alter_alarm_state, check_quorum_health):
+    def test_alarm(self, alter_alarm_state):
         """Updates the status of an alarm for a server."""
         alter_alarm_state.return_value = defer.succeed(('policy-abcdef', 'server-abc'))
-        check_quorum_health.return_value = defer.succeed(True)
+        self.quorum.is_healthy.return_value = defer.succeed(True)
 
         data = {
             "event_id": "acOne:enOne:alOne:chOne:1326910500000:WARNING",
@@ -240,20 +360,21 @@ class ViewTest(unittest.TestCase):
         d = self.bobby.alarm(request)
 
         self.successResultOf(d)
-        self.assertEqual(request.responseCode, 200)
+        self.assertEqual(request.responseCode, 202)
+        self.assertFalse(alter_alarm_state.called)
 
+        self.clock.advance(5)
         alter_alarm_state.assert_called_once_with(
-            self.db, data['alarm']['id'], data['details']['state'])
-        check_quorum_health.assert_called_once_with(self.db, 'policy-abcdef')
+            self.db, data['alarm']['id'], data['details']['state'], self.quorum)
+        self.quorum.is_healthy.assert_called_once_with('policy-abcdef')
 
         self.worker.execute_policy.assert_called_once_with('policy-abcdef')
 
-    @mock.patch('bobby.cass.check_quorum_health')
     @mock.patch('bobby.cass.alter_alarm_state')
-    def test_alarm_still_healthy(self, alter_alarm_state, check_quorum_health):
+    def test_alarm_still_healthy(self, alter_alarm_state):
         """Updates the status of an alarm for a server, but still sees the group as healthy."""
         alter_alarm_state.return_value = defer.succeed(('policy-abcdef', 'server-abc'))
-        check_quorum_health.return_value = defer.succeed(False)
+        self.quorum.is_healthy.return_value = defer.succeed(False)
 
         data = {
             "event_id": "acOne:enOne:alOne:chOne:1326910500000:WARNING",
@@ -358,14 +479,27 @@ class ViewTest(unittest.TestCase):
         d = self.bobby.alarm(request)
 
         self.successResultOf(d)
-        self.assertEqual(request.responseCode, 200)
+        self.assertEqual(request.responseCode, 202)
+        self.assertFalse(alter_alarm_state.called)
 
+        self.clock.advance(5)
         alter_alarm_state.assert_called_once_with(
-            self.db, data['alarm']['id'], data['details']['state'])
-        check_quorum_health.assert_called_once_with(self.db, 'policy-abcdef')
+            self.db, data['alarm']['id'], data['details']['state'], self.quorum)
+        self.quorum.is_healthy.assert_called_once_with('policy-abcdef')
 
         self.assertFalse(self.worker.execute_policy.called)
 
+    @mock.patch('bobby.cass.alter_alarm_state')
+    def test_stop(self, alter_alarm_state):
+        """Stopping processes queued alarm changes without waiting for their window."""
+        alter_alarm_state.return_value = defer.succeed(('policy-abcdef', 'server-abc'))
+        self.quorum.is_healthy.return_value = defer.succeed(True)
+        self.bobby._alarms.add('alOne', 'WARNING')
+
+        self.successResultOf(self.bobby.stop())
+
+        alter_alarm_state.assert_called_once_with(self.db, 'alOne', 'WARNING', self.quorum)
+
 
 class TestCreatePolicy(ViewTest):
     """Test POST /{tenantId}/groups/{groupId}/policies"""
@@ -404,19 +538,41 @@ class TestCreatePolicy(ViewTest):
         self.successResultOf(d)
         result = json.loads(request.written[0])
         self.assertEqual(result, expected)
+        self.cache.invalidate_policies.assert_called_once_with('group-def')
 
 
 class TestDeletePolicy(ViewTest):
     """Test DELETE /{tenantId}/groups/{groupId}/policiess/{policyId}"""
 
-    @mock.patch('bobby.cass.delete_policy')
-    def test_delete_policy(self, delete_policy):
+    def test_delete_policy(self):
         """Deletes a policy and returns 402."""
-        delete_policy.return_value = defer.succeed(None)
+        self.worker.delete_policy.return_value = defer.succeed(None)
 
         request = BobbyDummyRequest('/101010/groups/uvwxyz/policies/opqrst')
         d = self.bobby.delete_policy(request, '101010', 'uvwxyz', 'opqrst')
 
         self.successResultOf(d)
         self.assertEqual(request.responseCode, 204)
-        delete_policy.assert_called_once_with(self.db, 'uvwxyz', 'opqrst')
+        self.worker.delete_policy.assert_called_once_with('101010', 'uvwxyz', 'opqrst', None)
+        self.cache.invalidate_policies.assert_called_once_with('uvwxyz')
+
+    def test_delete_policy_async(self):
+        """An asynchronous delete reports its progress in its job."""
+        pending = defer.Deferred()
+
+        def delete_policy(tenant_id, group_id, policy_id, progress):
+            progress(1, 2)
+            return pending
+        self.worker.delete_policy.side_effect = delete_policy
+
+        request = BobbyDummyRequest('/101010/groups/uvwxyz/policies/opqrst')
+        request.requestHeaders.setRawHeaders('prefer', ['respond-async'])
+        d = self.bobby.delete_policy(request, '101010', 'uvwxyz', 'opqrst')
+
+        self.successResultOf(d)
+        self.assertEqual(request.responseCode, 202)
+        job = json.loads(request.written[0])
+        self.assertEqual((job['status'], job['progress']), ('running', {'done': 1, 'total': 2}))
+
+        pending.callback(None)
+        self.cache.invalidate_policies.assert_called_once_with('uvwxyz')
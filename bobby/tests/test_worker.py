@@ -6,8 +6,12 @@ from twisted.internet import defer
 from twisted.trial import unittest
 from silverberg.client import CQLClient
 
-from bobby import worker
-from bobby.ele import MaasClient
+from bobby import cass as cass_module, worker
+from bobby.cache import ReadCache
+from bobby.cass import ResultNotFoundError
+from bobby.concurrency import TenantLimiter
+from bobby.ele import MaasClient, PRIORITY_BULK
+from bobby.execution import ExecutionTracker
 
 
 class TestBobbyWorker(unittest.TestCase):
@@ -20,8 +24,10 @@ class TestBobbyWorker(unittest.TestCase):
         self.maas_client = mock.create_autospec(MaasClient)
         patcher = mock.patch('bobby.worker.MaasClient')
         self.addCleanup(patcher.stop)
-        _MaasClient = patcher.start()
-        _MaasClient.return_value = self.maas_client
+        self.MaasClient = patcher.start()
+        self.MaasClient.return_value = self.maas_client
+
+        self.cache = mock.create_autospec(ReadCache)
 
     @mock.patch('bobby.worker.cass')
     def test_create_group(self, cass):
@@ -35,7 +41,7 @@ class TestBobbyWorker(unittest.TestCase):
             (expected['notification'], expected['notificationPlan']))
         cass.create_group.return_value = defer.succeed(expected)
 
-        w = worker.BobbyWorker(self.client)
+        w = worker.BobbyWorker(self.client, cache=self.cache)
         d = w.create_group(expected['tenantId'], expected['groupId'])
 
         result = self.successResultOf(d)
@@ -44,6 +50,7 @@ class TestBobbyWorker(unittest.TestCase):
         self.maas_client.add_notification_and_plan.assert_called_once_with()
         cass.create_group.assert_called_once_with(
             self.client, '101010', 'group-abc', 'notification-def', 'notificationPlan-ghi')
+        self.cache.invalidate_group.assert_called_once_with('101010', 'group-abc')
 
     @mock.patch('bobby.worker.cass')
     def test_delete_group(self, cass):
@@ -54,7 +61,7 @@ class TestBobbyWorker(unittest.TestCase):
         self.maas_client.remove_notification_and_plan.return_value = defer.succeed(None)
         cass.delete_group.return_value = defer.succeed(None)
 
-        w = worker.BobbyWorker(self.client)
+        w = worker.BobbyWorker(self.client, cache=self.cache)
         d = w.delete_group('tenant-abc', 'group-def')
         self.successResultOf(d)
 
@@ -63,21 +70,24 @@ class TestBobbyWorker(unittest.TestCase):
             'notification-abc', 'notificationPlan-def')
         cass.delete_group.assert_called_once_with(
             self.client, 'tenant-abc', 'group-def')
+        self.cache.invalidate_group.assert_called_once_with('tenant-abc', 'group-def')
 
     @mock.patch('bobby.worker.cass')
     def test_create_server(self, cass):
-        cass.get_server_by_server_id.return_value = defer.succeed({
-            'serverId': 'server-abc', 'entityId': 'entity-abc'})
-        cass.get_group_by_id.return_value = defer.succeed({
+        """Test BobbyWorker.create_server."""
+        expected = {'serverId': 'server-abc',
+                    'entityId': 'entity-abc',
+                    'groupId': 'group-def'}
+        self.cache.get_group_by_id.return_value = defer.succeed({
             'notificationPlan': 'plan-xyz'})
-        cass.get_policies_by_group_id.return_value = defer.succeed([{
+        self.cache.get_policies_by_group_id.return_value = defer.succeed([{
             'policyId': 'policy-abc',
             'checkTemplate': 'check-abc',
             'alarmTemplate': 'alarm-def'}])
         self.maas_client.add_check.return_value = defer.succeed({'id': 'check-xyz'})
         self.maas_client.add_alarm.return_value = defer.succeed({'id': 'alarm-xyz'})
 
-        cass.create_server.return_value = defer.succeed(None)
+        cass.create_server.return_value = defer.succeed(expected)
         self.maas_client.create_entity.return_value = defer.succeed('entity-abc')
         server = {
             'OS-DCF:diskConfig': 'AUTO',
@@ -95,16 +105,19 @@ class TestBobbyWorker(unittest.TestCase):
             ]
         }
 
-        w = worker.BobbyWorker(self.client)
+        w = worker.BobbyWorker(self.client, cache=self.cache)
         d = w.create_server('tenant-abc', 'group-def', server)
-        self.successResultOf(d)
+        self.assertEqual(self.successResultOf(d), expected)
 
         self.maas_client.create_entity.assert_called_once_with(server)
         cass.create_server.assert_called_once_with(
             self.client, 'tenant-abc', server['id'], 'entity-abc', 'group-def')
 
-        cass.get_server_by_server_id.assert_called_once_with(server['id'])
-        cass.register_policy_on_server.assert_called_once_with(self.client, 'policy-abc', server['id'], 'alarm-xyz', 'check-xyz')
+        self.assertFalse(cass.get_server_by_server_id.called)
+        self.cache.get_group_by_id.assert_called_once_with('tenant-abc', 'group-def')
+        self.cache.get_policies_by_group_id.assert_called_once_with('group-def')
+        cass.register_policy_on_server.assert_called_once_with(self.client, 'policy-abc', server['id'], 'alarm-xyz', 'check-xyz',
+                                                               w._quorum)
 
     @mock.patch('bobby.worker.cass')
     def test_delete_server(self, cass):
@@ -121,7 +134,23 @@ class TestBobbyWorker(unittest.TestCase):
             self.client, 'tenant-abc', 'group-def', 'server-abc')
         self.maas_client.delete_entity.assert_called_once_with('entity-abc')
         cass.delete_server.assert_called_once_with(
-            self.client, 'tenant-abc', 'group-def', 'server-abc')
+            self.client, 'tenant-abc', 'group-def', 'server-abc', w._quorum)
+
+    @mock.patch('bobby.worker.cass')
+    def test_delete_server_already_gone(self, cass):
+        """Deleting a server whose record is gone still cleans up after it."""
+        cass.ResultNotFoundError = ResultNotFoundError
+        cass.delete_server.return_value = defer.succeed(None)
+        cass.get_server_by_server_id.return_value = defer.fail(
+            ResultNotFoundError('server', 'server-abc'))
+
+        w = worker.BobbyWorker(self.client)
+        d = w.delete_server('tenant-abc', 'group-def', 'server-abc')
+        self.successResultOf(d)
+
+        self.assertFalse(self.maas_client.delete_entity.called)
+        cass.delete_server.assert_called_once_with(
+            self.client, 'tenant-abc', 'group-def', 'server-abc', w._quorum)
 
     @mock.patch('bobby.worker.MaasClient')
     def test_apply_policies_to_server(self, FakeMaasClient):
@@ -156,7 +185,12 @@ class TestBobbyWorker(unittest.TestCase):
             'details': {'file': 'blah',
                         'args': 'blah'}
         })
-        self.client.execute.return_value = defer.succeed(None)
+
+        def execute(query, data, consistency):
+            if 'SELECT' in query:
+                return defer.succeed([])
+            return defer.succeed(None)
+        self.client.execute.side_effect = execute
 
         w = worker.BobbyWorker(self.client)
         d = w.add_policy_to_server('t1', 'p1', 's1', 'enOne',
@@ -169,13 +203,30 @@ class TestBobbyWorker(unittest.TestCase):
             'p1', 'enOne',
             '{"type": "agent.plugin", "details": {"args": "blah", "file": "blah"}}')
 
-        self.client.execute.assert_called_once_with(
-            'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", '
-            '"checkId", state) VALUES (:serverId, :policyId, :alarmId, '
-            ':checkId, false);',
-            {'checkId': u'check-abc', 'serverId': 's1', 'policyId': 'p1',
-             'alarmId': 'alAAAA'},
-            1)
+        self.assertEqual(self.client.execute.mock_calls, [
+            mock.call(
+                'SELECT * FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId;',
+                {'checkId': u'check-abc', 'serverId': 's1', 'policyId': 'p1',
+                 'alarmId': 'alAAAA'},
+                1),
+            mock.call(
+                'BEGIN BATCH '
+                'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+                'INSERT INTO alarms_by_id ("alarmId", "policyId", "serverId", state) '
+                'VALUES (:alarmId, :policyId, :serverId, false) '
+                'INSERT INTO serverpolicies_by_server '
+                '("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+                'APPLY BATCH;',
+                {'checkId': u'check-abc', 'serverId': 's1', 'policyId': 'p1',
+                 'alarmId': 'alAAAA'},
+                1),
+            mock.call(
+                'UPDATE policyquorum SET total=total + :total, critical=critical + :critical '
+                'WHERE "policyId"=:policyId;',
+                {'total': 1, 'critical': 1, 'policyId': 'p1'},
+                1)])
 
     @mock.patch('bobby.worker.MaasClient')
     def test_add_policy_to_server(self, FakeMaasClient):
@@ -215,13 +266,15 @@ class TestBobbyWorker(unittest.TestCase):
                      'checkTemplate': 'checkTemplate-rst'}]
 
         def execute(query, data, consistency):
-            if 'INSERT' in query:
+            if 'BATCH' in query or 'UPDATE' in query:
                 return defer.succeed(None)
             elif 'SELECT' in query:
                 if 'groups' in query:
                     return defer.succeed([{
                         'groupId': 'group-abc',
                         'notificationPlan': 'plan-abc'}])
+                elif 'serverpolicies' in query:
+                    return defer.succeed([])
                 elif 'policies' in query:
                     return defer.succeed(expected)
         self.client.execute.side_effect = execute
@@ -240,16 +293,264 @@ class TestBobbyWorker(unittest.TestCase):
                 'SELECT * FROM policies WHERE "groupId"=:groupId;',
                 {'groupId': 'group-abc'}, 1),
             mock.call(
-                'INSERT INTO serverpolicies ("serverId", "policyId", '
-                '"alarmId", "checkId", state) VALUES (:serverId, :policyId, '
-                ':alarmId, :checkId, false);',
+                'SELECT * FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId;',
+                {'checkId': u'check-abc', 'serverId': 'server1',
+                 'policyId': 'policy-abc', 'alarmId': 'alAAAA'},
+                1),
+            mock.call(
+                'BEGIN BATCH '
+                'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+                'INSERT INTO alarms_by_id ("alarmId", "policyId", "serverId", state) '
+                'VALUES (:alarmId, :policyId, :serverId, false) '
+                'INSERT INTO serverpolicies_by_server '
+                '("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+                'APPLY BATCH;',
                 {'checkId': u'check-abc', 'serverId': 'server1',
                  'policyId': 'policy-abc', 'alarmId': 'alAAAA'},
                 1),
             mock.call(
-                'INSERT INTO serverpolicies ("serverId", "policyId", '
-                '"alarmId", "checkId", state) VALUES (:serverId, :policyId, '
-                ':alarmId, :checkId, false);',
+                'UPDATE policyquorum SET total=total + :total, critical=critical + :critical '
+                'WHERE "policyId"=:policyId;',
+                {'total': 1, 'critical': 1, 'policyId': 'policy-abc'},
+                1),
+            mock.call(
+                'SELECT * FROM serverpolicies WHERE "policyId"=:policyId AND "serverId"=:serverId;',
                 {'checkId': u'check-abc', 'serverId': 'server1',
                  'policyId': 'policy-xyz', 'alarmId': 'alAAAA'},
+                1),
+            mock.call(
+                'BEGIN BATCH '
+                'INSERT INTO serverpolicies ("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+                'INSERT INTO alarms_by_id ("alarmId", "policyId", "serverId", state) '
+                'VALUES (:alarmId, :policyId, :serverId, false) '
+                'INSERT INTO serverpolicies_by_server '
+                '("serverId", "policyId", "alarmId", "checkId", state) '
+                'VALUES (:serverId, :policyId, :alarmId, :checkId, false) '
+                'APPLY BATCH;',
+                {'checkId': u'check-abc', 'serverId': 'server1',
+                 'policyId': 'policy-xyz', 'alarmId': 'alAAAA'},
+                1),
+            mock.call(
+                'UPDATE policyquorum SET total=total + :total, critical=critical + :critical '
+                'WHERE "policyId"=:policyId;',
+                {'total': 1, 'critical': 1, 'policyId': 'policy-xyz'},
                 1)])
+
+    @mock.patch('bobby.worker.cass')
+    def test_apply_policy(self, cass):
+        """The policy is added to every server in the group, a few at a time."""
+        self.client.execute.return_value = defer.succeed([
+            {'serverId': 'server-{0}'.format(i), 'entityId': 'entity-{0}'.format(i)}
+            for i in range(3)])
+        cass.page_servers_by_group_id.return_value = cass_module.Pages(
+            self.client, 'servers', 'groupId', 'group-abc', 'serverId')
+        pending = []
+
+        def add_check(*args):
+            d = defer.Deferred()
+            pending.append(d)
+            return d
+        self.maas_client.add_check.side_effect = add_check
+        self.maas_client.add_alarm.side_effect = lambda *args: defer.succeed({'id': 'alarm-xyz'})
+        cass.register_policy_on_servers.return_value = defer.succeed(None)
+
+        w = worker.BobbyWorker(self.client, limiter=TenantLimiter(limit=2),
+                               maas_pool_size=4, maas_idle_timeout=30,
+                               maas_request_rate=20, maas_burst=5)
+        d = w.apply_policy('101010', 'group-abc', 'policy-def', 'check', 'alarm', 'plan-ghi')
+
+        self.assertEqual(len(pending), 2)
+        while pending:
+            pending.pop(0).callback({'id': 'check-xyz'})
+
+        self.assertIdentical(self.successResultOf(d), None)
+        self.MaasClient.assert_called_with({}, 'abc', PRIORITY_BULK, max_per_host=4, idle_timeout=30,
+                                           request_rate=20, burst=5)
+        cass.register_policy_on_servers.assert_called_once_with(
+            self.client, 'policy-def', mock.ANY, w._quorum)
+        self.assertEqual(
+            sorted(cass.register_policy_on_servers.call_args[0][2]),
+            [('server-{0}'.format(i), 'alarm-xyz', 'check-xyz') for i in range(3)])
+
+    @mock.patch('bobby.worker.cass')
+    def test_apply_policy_partial_failure(self, cass):
+        """Servers that fail are reported, after the rest have been done."""
+        pages = [[{'serverId': 'server-abc', 'entityId': 'entity-abc'}],
+                 [{'serverId': 'server-def', 'entityId': 'entity-def'}],
+                 []]
+        self.client.execute.side_effect = lambda *args: defer.succeed(pages.pop(0))
+        cass.page_servers_by_group_id.return_value = cass_module.Pages(
+            self.client, 'servers', 'groupId', 'group-abc', 'serverId', page_size=1)
+
+        def add_check(policy_id, entity_id, check_template):
+            if entity_id == 'entity-abc':
+                return defer.fail(ValueError('MaaS is down'))
+            return defer.succeed({'id': 'check-xyz'})
+        self.maas_client.add_check.side_effect = add_check
+        self.maas_client.add_alarm.return_value = defer.succeed({'id': 'alarm-xyz'})
+        cass.register_policy_on_servers.return_value = defer.succeed(None)
+
+        w = worker.BobbyWorker(self.client)
+        d = w.apply_policy('101010', 'group-abc', 'policy-def', 'check', 'alarm', 'plan-ghi')
+
+        failure = self.failureResultOf(d, worker.PartialFailureError)
+        self.assertEqual(failure.value.failures.keys(), ['server-abc'])
+        self.assertTrue(failure.value.failures['server-abc'].check(ValueError))
+        self.assertEqual(cass.register_policy_on_servers.mock_calls, [
+            mock.call(self.client, 'policy-def', [], w._quorum),
+            mock.call(self.client, 'policy-def', [('server-def', 'alarm-xyz', 'check-xyz')],
+                      w._quorum)])
+
+    @mock.patch('bobby.worker.treq')
+    def test_execute_policy(self, treq):
+        """Executions go through the tracker, which drops repeats."""
+        treq.post.return_value = defer.succeed('response')
+        treq.json_content.return_value = {'executed': True}
+
+        w = worker.BobbyWorker(self.client, executions=ExecutionTracker())
+        self.assertEqual(self.successResultOf(w.execute_policy('policy-abc')),
+                         {'executed': True})
+        self.assertIdentical(self.successResultOf(w.execute_policy('policy-abc')), None)
+
+        treq.post.assert_called_once_with('policy-abc/execute')
+
+    @mock.patch('bobby.worker.cass')
+    def test_create_servers(self, cass):
+        """Servers are created together, and each failure is reported against its server."""
+        self.cache.get_group_by_id.return_value = defer.succeed({'notificationPlan': 'plan-xyz'})
+        self.cache.get_policies_by_group_id.return_value = defer.succeed([{
+            'policyId': 'policy-abc',
+            'checkTemplate': 'check-abc',
+            'alarmTemplate': 'alarm-def'}])
+
+        def create_entity(server):
+            if server['id'] == 'server-c':
+                return defer.fail(ValueError('no entity'))
+            return defer.succeed('entity-' + server['id'][-1])
+        self.maas_client.create_entity.side_effect = create_entity
+
+        def add_check(policy_id, entity_id, check_template):
+            if entity_id == 'entity-b':
+                return defer.fail(ValueError('no check'))
+            return defer.succeed({'id': 'check-' + entity_id[-1]})
+        self.maas_client.add_check.side_effect = add_check
+        self.maas_client.add_alarm.side_effect = (
+            lambda policy_id, entity_id, *args: defer.succeed({'id': 'alarm-' + entity_id[-1]}))
+
+        cass.create_servers.side_effect = lambda db, tenant_id, group_id, servers: defer.succeed([
+            {'serverId': server_id, 'entityId': entity_id, 'groupId': group_id}
+            for server_id, entity_id in servers])
+        cass.register_policy_on_servers.return_value = defer.succeed(None)
+
+        w = worker.BobbyWorker(self.client, cache=self.cache)
+        d = w.create_servers('101010', 'group-def',
+                             [{'id': 'server-a'}, {'id': 'server-b'}, {'id': 'server-c'}])
+
+        created, failures = self.successResultOf(d)
+        self.assertEqual(created, {'server-a': {'serverId': 'server-a',
+                                                'entityId': 'entity-a',
+                                                'groupId': 'group-def'}})
+        self.assertEqual(sorted(failures), ['server-b', 'server-c'])
+
+        self.assertEqual(self.cache.get_group_by_id.call_count, 1)
+        self.assertEqual(sorted(cass.create_servers.call_args[0][3]),
+                         [('server-a', 'entity-a'), ('server-b', 'entity-b')])
+        cass.register_policy_on_servers.assert_called_once_with(
+            self.client, 'policy-abc', [('server-a', 'alarm-a', 'check-a')], w._quorum)
+
+    @mock.patch('bobby.worker.cass')
+    def test_delete_servers(self, cass):
+        """Servers are deleted together, and each failure is reported against its server."""
+        cass.get_servers_by_server_ids.return_value = defer.succeed([
+            {'serverId': 'server-a', 'entityId': 'entity-a'},
+            {'serverId': 'server-b', 'entityId': 'entity-b'},
+            {'serverId': 'server-c', 'entityId': 'entity-c'}])
+        self.maas_client.delete_entity.side_effect = lambda entity_id: (
+            defer.fail(ValueError('no')) if entity_id in ('entity-b', 'entity-c')
+            else defer.succeed(None))
+        serverpolicies = {
+            'server-a': [
+                {'serverId': 'server-a', 'policyId': 'policy-abc', 'alarmId': 'alarm-a', 'state': 'OK'},
+                {'serverId': 'server-a', 'policyId': 'policy-def', 'alarmId': 'alarm-d', 'state': 'OK'}],
+            'server-c': [
+                {'serverId': 'server-c', 'policyId': 'policy-abc', 'alarmId': 'alarm-c', 'state': 'OK'}],
+            'server-x': []}
+        cass.get_serverpolicies_by_server_id.side_effect = lambda db, group_id, server_id: (
+            defer.succeed(serverpolicies[server_id]))
+        cass.deregister_policy_on_servers.return_value = defer.succeed(None)
+        cass.delete_servers.return_value = defer.succeed(None)
+
+        w = worker.BobbyWorker(self.client, cache=self.cache)
+        d = w.delete_servers('101010', 'group-def', ['server-a', 'server-b', 'server-x'])
+
+        deleted, failures = self.successResultOf(d)
+        self.assertEqual(deleted, {'server-a': {'serverId': 'server-a', 'entityId': 'entity-a'},
+                                   'server-x': None})
+        self.assertEqual(failures.keys(), ['server-b'])
+        self.assertTrue(failures['server-b'].check(ValueError))
+
+        cass.get_servers_by_server_ids.assert_called_once_with(
+            self.client, 'group-def', ['server-a', 'server-b', 'server-x'])
+        self.assertEqual(sorted(cass.get_serverpolicies_by_server_id.mock_calls), [
+            mock.call(self.client, 'group-def', 'server-a'),
+            mock.call(self.client, 'group-def', 'server-x')])
+        self.assertEqual(sorted(cass.deregister_policy_on_servers.mock_calls), [
+            mock.call(self.client, 'policy-abc', serverpolicies['server-a'][:1], w._quorum),
+            mock.call(self.client, 'policy-def', serverpolicies['server-a'][1:], w._quorum)])
+        self.assertFalse(self.cache.get_policies_by_group_id.called)
+        cass.delete_servers.assert_called_once_with(self.client, 'group-def', mock.ANY)
+        self.assertEqual(sorted(cass.delete_servers.call_args[0][2]), ['server-a', 'server-x'])
+
+    @mock.patch('bobby.worker.cass')
+    def test_delete_policy(self, cass):
+        """A policy's alarms and checks are removed from MaaS, a page at a time, before it is deleted."""
+        self.client.execute.return_value = defer.succeed([
+            {'serverId': 'server-a', 'alarmId': 'alarm-a', 'checkId': 'check-a'},
+            {'serverId': 'server-b', 'alarmId': 'alarm-b', 'checkId': 'check-b'}])
+        cass.page_policy_state.return_value = cass_module.Pages(
+            self.client, 'serverpolicies', 'policyId', 'policy-abc', 'serverId')
+        cass.get_servers_by_server_ids.return_value = defer.succeed([
+            {'serverId': 'server-a', 'entityId': 'entity-a'}])
+        cass.delete_policy.return_value = defer.succeed(None)
+        self.maas_client.remove_alarm.return_value = defer.succeed(None)
+        self.maas_client.remove_check.return_value = defer.succeed(None)
+        quorum = mock.Mock()
+        quorum.get_counts.return_value = defer.succeed((2, 1))
+        progress = []
+
+        w = worker.BobbyWorker(self.client, quorum)
+        d = w.delete_policy('101010', 'group-def', 'policy-abc',
+                            lambda done, total: progress.append((done, total)))
+        self.successResultOf(d)
+
+        cass.page_policy_state.assert_called_once_with(self.client, 'policy-abc')
+        cass.get_servers_by_server_ids.assert_called_once_with(
+            self.client, 'group-def', ['server-a', 'server-b'])
+        self.maas_client.remove_alarm.assert_called_once_with('entity-a', 'alarm-a')
+        self.maas_client.remove_check.assert_called_once_with('entity-a', 'check-a')
+        cass.delete_policy.assert_called_once_with(
+            self.client, 'group-def', 'policy-abc', quorum)
+        self.assertEqual(progress, [(0, 2), (1, 2), (2, 2)])
+
+    @mock.patch('bobby.worker.cass')
+    def test_delete_policy_partial_failure(self, cass):
+        """Nothing is deleted from Cassandra if any server couldn't be cleaned up."""
+        self.client.execute.return_value = defer.succeed([
+            {'serverId': 'server-a', 'alarmId': 'alarm-a', 'checkId': 'check-a'}])
+        cass.page_policy_state.return_value = cass_module.Pages(
+            self.client, 'serverpolicies', 'policyId', 'policy-abc', 'serverId')
+        cass.get_servers_by_server_ids.return_value = defer.succeed([
+            {'serverId': 'server-a', 'entityId': 'entity-a'}])
+        self.maas_client.remove_alarm.return_value = defer.fail(ValueError('no'))
+        quorum = mock.Mock()
+        quorum.get_counts.return_value = defer.succeed((1, 1))
+
+        w = worker.BobbyWorker(self.client, quorum)
+        d = w.delete_policy('101010', 'group-def', 'policy-abc')
+
+        failure = self.failureResultOf(d, worker.PartialFailureError)
+        self.assertEqual(failure.value.failures.keys(), ['server-a'])
+        self.assertFalse(cass.delete_policy.called)
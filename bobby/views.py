@@ -9,7 +9,14 @@ from otter.util.hashkey import generate_transaction_id
 from twisted.internet import defer
 from twisted.python import reflect
 
-from bobby import cass
+from bobby import cass, ele, metrics
+from bobby.alarms import AlarmQueue
+from bobby.cache import ReadCache
+from bobby.concurrency import TenantLimiter
+from bobby.execution import ExecutionTracker
+from bobby.jobs import JobRunner
+from bobby.pool import CQLClientPool
+from bobby.quorum import QuorumTracker
 from bobby.worker import BobbyWorker
 
 
@@ -34,14 +41,71 @@ def with_transaction_id():
     return decorator
 
 
+def wants_async(request):
+    """Whether a request asked to be answered before its work is done."""
+    return 'respond-async' in (request.getHeader('prefer') or '')
+
+
 class Bobby(object):
     """Bobby app views."""
 
     app = Klein()
 
-    def __init__(self, db):
+    def __init__(self, db, alarm_window=5, execution_cooldown=300, shared_cooldown=False,
+                 service_catalog=None, maas_pool_size=None, maas_idle_timeout=None,
+                 maas_request_rate=None, maas_burst=None):
         self._db = db
-        self._worker = BobbyWorker(self._db)
+        self._quorum = QuorumTracker(self._db)
+        self._cache = ReadCache(self._db)
+        self._executions = ExecutionTracker(self._db if shared_cooldown else None,
+                                            execution_cooldown)
+        self._limiter = TenantLimiter()
+        self._worker = BobbyWorker(self._db, self._quorum, limiter=self._limiter,
+                                   cache=self._cache, executions=self._executions,
+                                   service_catalog=service_catalog,
+                                   maas_pool_size=maas_pool_size,
+                                   maas_idle_timeout=maas_idle_timeout,
+                                   maas_request_rate=maas_request_rate,
+                                   maas_burst=maas_burst)
+        self._alarms = AlarmQueue(self._process_alarm, alarm_window)
+        self._jobs = JobRunner()
+
+    def stop(self):
+        """
+        Process every queued alarm change, rather than lose them on shutdown.
+
+        :return: A Deferred that fires once they have been processed.
+        """
+        return self._alarms.flush()
+
+    def _respond_async(self, request, tenant_id, f, *args):
+        """Run ``f(*args)`` as a job, and answer the request with a 202 pointing to it."""
+        return self._respond_with_job(request, self._jobs.submit(tenant_id, f, *args))
+
+    def _respond_with_job(self, request, job):
+        request.setHeader('Content-Type', 'application/json')
+        request.setHeader('Location', '/{0}/jobs/{1}'.format(job.tenant_id, job.id))
+        request.setResponseCode(202)
+        request.write(json.dumps(self._serialize_job(job)))
+        request.finish()
+        return defer.succeed(None)
+
+    def _serialize_job(self, job):
+        json_object = {
+            'jobId': job.id,
+            'links': [{
+                'href': '/{0}/jobs/{1}'.format(job.tenant_id, job.id),
+                'rel': 'self'
+            }],
+            'status': job.status
+        }
+        if job.progress is not None:
+            json_object['progress'] = job.progress
+        if job.status == 'succeeded':
+            json_object['result'] = job.result
+        elif job.status == 'failed':
+            json_object['error'] = job.error
+        return json_object
 
     @app.route('/<string:tenant_id>/groups', methods=['POST'])
     @with_transaction_id()
@@ -49,30 +113,39 @@ class Bobby(object):
         """Create a new group.
 
         Receive application/json content for new group creation.
+        With a ``Prefer: respond-async`` header it is created in a background job.
 
         :param str tenant_id: A tenant id
         """
         content = json.loads(request.content.read())
         group_id = content.get('groupId')
+        path = request.URLPath().path
 
-        d = self._worker.create_group(tenant_id, group_id)
+        def create_group():
+            d = self._worker.create_group(tenant_id, group_id)
+            return d.addCallback(_serialize_object)
 
         def _serialize_object(group):
-            json_object = {
+            return {
                 'groupId': group['groupId'],
                 'links': [{
-                    'href': '{0}{1}'.format(request.URLPath().path, group['groupId']),
+                    'href': '{0}{1}'.format(path, group['groupId']),
                     'rel': 'self'
                 }],
                 'notification': group['notification'],
                 'notificationPlan': group['notificationPlan'],
                 'tenantId': group['tenantId']
             }
+
+        if wants_async(request):
+            return self._respond_async(request, tenant_id, create_group)
+
+        def finish(json_object):
             request.setHeader('Content-Type', 'application/json')
             request.setResponseCode(201)
             request.write(json.dumps(json_object))
             request.finish()
-        return d.addCallback(_serialize_object)
+        return create_group().addCallback(finish)
 
     @app.route('/<string:tenant_id>/groups/<string:group_id>', methods=['DELETE'])
     @with_transaction_id()
@@ -96,6 +169,7 @@ class Bobby(object):
         """Create a new server.
 
         Receive application/json content for new server creation.
+        With a ``Prefer: respond-async`` header it is created in a background job.
 
         :param request: Twisted IRequest object.
         :param log: A log object.
@@ -105,28 +179,124 @@ class Bobby(object):
         # The server object is one provided via the nova API.
         content = json.loads(request.content.read())
         server = content.get('server')
+        path = request.URLPath().path
 
-        d = self._worker.create_server(tenant_id, group_id, server)
+        def create_server():
+            d = self._worker.create_server(tenant_id, group_id, server)
+            return d.addCallback(serialize)
 
         def serialize(server):
-            json_object = {
+            return {
                 'entityId': server['entityId'],
                 'groupId': server['groupId'],
                 'links': [
                     {
-                        'href': '{0}{1}'.format(request.URLPath().path, server['serverId']),
+                        'href': '{0}{1}'.format(path, server['serverId']),
                         'rel': 'self'
                     }
                 ],
                 'serverId': server['serverId']
             }
 
+        if wants_async(request):
+            return self._respond_async(request, tenant_id, create_server)
+
+        def finish(json_object):
             request.setHeader('Content-Type', 'application/json')
             request.setResponseCode(201)
             request.write(json.dumps(json_object))
             request.finish()
+        return create_server().addCallback(finish)
+
+    @app.route('/<string:tenant_id>/groups/<string:group_id>/servers/bulk', methods=['POST'])
+    @with_transaction_id()
+    def create_servers(self, request, log, tenant_id, group_id):
+        """Create many servers at once.
+
+        Receive application/json content with a list of ``servers``, and
+        respond with the servers that were created and the errors of those
+        that weren't.
+        With a ``Prefer: respond-async`` header they are created in a background job.
+
+        :param str tenant_id: A tenant id
+        :param str group_id: A group id
+        """
+        content = json.loads(request.content.read())
+        servers = content.get('servers')
+        path = request.URLPath().path.rsplit('bulk', 1)[0]
+
+        def create_servers():
+            d = self._worker.create_servers(tenant_id, group_id, servers)
+            return d.addCallback(serialize)
+
+        def serialize((created, failures)):
+            return {
+                'servers': [
+                    {
+                        'entityId': server['entityId'],
+                        'groupId': server['groupId'],
+                        'links': [
+                            {
+                                'href': '{0}{1}'.format(path, server['serverId']),
+                                'rel': 'self'
+                            }
+                        ],
+                        'serverId': server['serverId']
+                    }
+                    for _, server in sorted(created.items())
+                ],
+                'errors': [
+                    {
+                        'message': failure.getErrorMessage(),
+                        'serverId': server_id
+                    }
+                    for server_id, failure in sorted(failures.items())
+                ]
+            }
+
+        if wants_async(request):
+            return self._respond_async(request, tenant_id, create_servers)
+
+        def finish(json_object):
+            request.setHeader('Content-Type', 'application/json')
+            request.setResponseCode(200)
+            request.write(json.dumps(json_object))
+            request.finish()
+        return create_servers().addCallback(finish)
+
+    @app.route('/<string:tenant_id>/groups/<string:group_id>/servers/bulk', methods=['DELETE'])
+    @with_transaction_id()
+    def delete_servers(self, request, log, tenant_id, group_id):
+        """Delete many servers at once.
+
+        Receive application/json content with a list of ``servers`` ids, and
+        respond with the ids that were deleted and the errors of those that
+        weren't.
+
+        :param str tenant_id: A tenant id
+        :param str group_id: A group id
+        """
+        content = json.loads(request.content.read())
+        server_ids = content.get('servers')
 
-        return d.addCallback(serialize)
+        d = self._worker.delete_servers(tenant_id, group_id, server_ids)
+
+        def finish((deleted, failures)):
+            json_object = {
+                'deleted': sorted(deleted),
+                'errors': [
+                    {
+                        'message': failure.getErrorMessage(),
+                        'serverId': server_id
+                    }
+                    for server_id, failure in sorted(failures.items())
+                ]
+            }
+            request.setHeader('Content-Type', 'application/json')
+            request.setResponseCode(200)
+            request.write(json.dumps(json_object))
+            request.finish()
+        return d.addCallback(finish)
 
     @app.route('/<string:tenant_id>/groups/<string:group_id>/servers/<string:server_id>', methods=['DELETE'])
     @with_transaction_id()
@@ -151,6 +321,7 @@ class Bobby(object):
         """Create a new policy.
 
         Receive application/json content for new policy creation.
+        With a ``Prefer: respond-async`` header it is created in a background job.
 
         :param str tenant_id: A tenant id
         :param str group_id: A group id
@@ -159,41 +330,70 @@ class Bobby(object):
         alarm_template_id = content.get('alarmTemplate')
         check_template_id = content.get('checkTemplate')
         policy_id = content.get('policyId')
+        path = request.URLPath().path
+
+        def create_policy():
+            d = cass.create_policy(self._db, policy_id, group_id, alarm_template_id, check_template_id)
+            d.addCallback(invalidate)
+            return d.addCallback(serialize)
 
-        d = cass.create_policy(self._db, policy_id, group_id, alarm_template_id, check_template_id)
+        def invalidate(policy):
+            self._cache.invalidate_policies(group_id)
+            return policy
 
         # Trigger actions to create the alarm and checks on the MaaS side and set things up
 
         def serialize(policy):
-            json_object = {
+            return {
                 'alarmTemplate': policy['alarmTemplate'],
                 'checkTemplate': policy['checkTemplate'],
                 'groupId': policy['groupId'],
                 'links': [
                     {
-                        'href': '{0}{1}'.format(request.URLPath().path, policy['policyId']),
+                        'href': '{0}{1}'.format(path, policy['policyId']),
                         'rel': 'self'
                     }
                 ],
                 'policyId': policy['policyId']
             }
+
+        if wants_async(request):
+            return self._respond_async(request, tenant_id, create_policy)
+
+        def finish(json_object):
             request.setHeader('Content-Type', 'application/json')
             request.setResponseCode(201)
             request.write(json.dumps(json_object))
             request.finish()
-        return d.addCallback(serialize)
+        return create_policy().addCallback(finish)
 
     @app.route('/<string:tenant_id>/groups/<string:group_id>/policies/<string:policy_id>',
                methods=['DELETE'])
     @with_transaction_id()
     def delete_policy(self, request, log, tenant_id, group_id, policy_id):
-        """Delete a policy.
+        """Delete a policy, and its checks and alarms on every server.
+
+        With a ``Prefer: respond-async`` header it is deleted in a background
+        job, which reports how many servers it has done.
 
         :param str tenant_id: A tenant id
         :param str group_id: A groud id
         :param str policy_id: A policy id
         """
-        d = cass.delete_policy(self._db, group_id, policy_id)
+        def delete_policy(progress=None):
+            d = self._worker.delete_policy(tenant_id, group_id, policy_id, progress)
+            return d.addCallback(invalidate)
+
+        def invalidate(result):
+            self._cache.invalidate_policies(group_id)
+            return result
+
+        if wants_async(request):
+            job = self._jobs.create(tenant_id)
+            self._jobs.run(job, delete_policy, job.report_progress)
+            return self._respond_with_job(request, job)
+
+        d = delete_policy()
 
         def finish(_):
             request.setHeader('Content-Type', 'application/json')
@@ -201,31 +401,129 @@ class Bobby(object):
             request.finish()
         return d.addCallback(finish)
 
+    @app.route('/<string:tenant_id>/jobs/<string:job_id>', methods=['GET'])
+    @with_transaction_id()
+    def get_job(self, request, log, tenant_id, job_id):
+        """Get the status of a job started by an asynchronous request.
+
+        :param str tenant_id: A tenant id
+        :param str job_id: A job id
+        """
+        job = self._jobs.get(tenant_id, job_id)
+        request.setHeader('Content-Type', 'application/json')
+        if job is None:
+            request.setResponseCode(404)
+        else:
+            request.setResponseCode(200)
+            request.write(json.dumps(self._serialize_job(job)))
+        request.finish()
+        return defer.succeed(None)
+
     @app.route('/alarm', methods=['POST'])
     @with_transaction_id()
     def alarm(self, request, log):
-        """Change the state of an alarm."""
-        _policy_id = []
+        """Change the state of an alarm.
 
+        The change is queued and processed in the background, see
+        :class:`bobby.alarms.AlarmQueue`.
+        """
         content = json.loads(request.content.read())
         alarm_id = content.get('alarm').get('id')
         status = content.get('details').get('state')
 
-        d = cass.alter_alarm_state(self._db, alarm_id, status)
+        self._alarms.add(alarm_id, status)
+
+        request.setResponseCode(202)
+        request.finish()
+        return defer.succeed(None)
+
+    def _process_alarm(self, alarm_id, status):
+        """Record an alarm's new state, and execute its policy if need be."""
+        _policy_id = []
+
+        d = cass.alter_alarm_state(self._db, alarm_id, status, self._quorum)
 
         def check_quorum_health((policy_id, server_id)):
             _policy_id.append(policy_id)
-            return cass.check_quorum_health(self._db, policy_id)
+            return self._quorum.is_healthy(policy_id)
         d.addCallback(check_quorum_health)
 
         def maybe_execute_policy(health):
             if health:
                 return self._worker.execute_policy(_policy_id[0])
-            else:
-                defer.succeed(None)
-        d.addCallback(maybe_execute_policy)
+        return d.addCallback(maybe_execute_policy)
 
-        def finish(_):
-            request.setResponseCode(200)
-            request.finish()
-        return d.addCallback(finish)
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics(self, request):
+        """Get bobby's metrics, in the Prometheus text format.
+
+        These are the timings of Cassandra and MaaS calls (unless timing is
+        disabled), and the state of the caches, queues and pools.
+        """
+        request.setHeader('Content-Type', metrics.CONTENT_TYPE)
+        request.setResponseCode(200)
+        request.write(metrics.registry.render(self._metric_families()))
+        request.finish()
+        return defer.succeed(None)
+
+    def _metric_families(self):
+        """Collect the metrics of the app's components for :meth:`get_metrics`."""
+        cache = self._cache.metrics()
+        alarms = self._alarms.metrics()
+        executions = self._executions.metrics()
+        limiter = self._limiter.metrics()
+        schedulers = sorted(ele.scheduler_stats().items())
+        families = [
+            ('bobby_cache_entries', 'gauge', 'Entries in each read cache.',
+             [({'cache': name}, m['size']) for name, m in sorted(cache.items())]),
+            ('bobby_cache_hits_total', 'counter', 'Reads served from each read cache.',
+             [({'cache': name}, m['hits']) for name, m in sorted(cache.items())]),
+            ('bobby_cache_misses_total', 'counter', 'Reads each read cache had to fetch.',
+             [({'cache': name}, m['misses']) for name, m in sorted(cache.items())]),
+            ('bobby_alarm_queue_pending', 'gauge', 'Alarm changes waiting to be processed.',
+             [({}, alarms['pending'])]),
+            ('bobby_alarm_queue_processing', 'gauge', 'Alarm changes being processed.',
+             [({}, alarms['processing'])]),
+            ('bobby_alarm_changes_total', 'counter', 'Alarm changes, by what became of them.',
+             [({'event': event}, alarms[event])
+              for event in ('received', 'coalesced', 'processed', 'failed')]),
+            ('bobby_policy_executions_total', 'counter', 'Policy executions run and suppressed.',
+             [({'result': result}, executions[result]) for result in ('executed', 'suppressed')]),
+            ('bobby_policy_executions_in_flight', 'gauge', 'Policy executions running.',
+             [({}, executions['in_flight'])]),
+            ('bobby_jobs', 'gauge', 'Background jobs, by status.',
+             [({'status': status}, count) for status, count in sorted(self._jobs.metrics().items())]),
+            ('bobby_tenant_operations_running', 'gauge', 'MaaS operations running, by tenant.',
+             [({'tenant': tenant}, m['running']) for tenant, m in sorted(limiter.items())]),
+            ('bobby_tenant_operations_queued', 'gauge', 'MaaS operations waiting, by tenant.',
+             [({'tenant': tenant}, m['queued']) for tenant, m in sorted(limiter.items())]),
+            ('bobby_maas_connections_total', 'counter',
+             'MaaS connections reused (hit) and opened (miss), by endpoint.',
+             [({'endpoint': endpoint, 'result': result}, stats[key])
+              for endpoint, stats in sorted(ele.connection_pool_stats().items())
+              for result, key in (('hit', 'hits'), ('miss', 'misses'))]),
+            ('bobby_maas_requests_total', 'counter',
+             'MaaS requests sent, and those answered with a 429, by endpoint.',
+             [({'endpoint': endpoint, 'result': result}, stats[result])
+              for endpoint, stats in schedulers for result in ('sent', 'throttled')]),
+            ('bobby_maas_requests_queued', 'gauge',
+             'MaaS requests waiting for the rate limit, by endpoint.',
+             [({'endpoint': endpoint}, stats['queued']) for endpoint, stats in schedulers]),
+            ('bobby_maas_create_retries_total', 'counter',
+             'Retried MaaS creates, by whether the object was found already created, '
+             'and creates that ran out of retries.',
+             [({'operation': operation, 'result': result}, counts[result])
+              for operation, counts in sorted(ele.retry_stats().items())
+              for result in ('retried', 'found', 'exhausted')])]
+
+        if isinstance(self._db, CQLClientPool):
+            pool = self._db.metrics()
+            hosts = sorted(pool['hosts'].items())
+            families.extend([
+                ('bobby_cql_queued', 'gauge', 'CQL queries waiting for a free client.',
+                 [({}, pool['queued'])]),
+                ('bobby_cql_in_flight', 'gauge', 'CQL queries running, by host.',
+                 [({'host': host}, m['in_flight']) for host, m in hosts]),
+                ('bobby_cql_host_down', 'gauge', 'Whether each CQL host is being avoided.',
+                 [({'host': host}, int(m['dead'])) for host, m in hosts])])
+        return families
@@ -1,23 +1,109 @@
 """
 Functions for actually doing things
 """
+from functools import partial
 
 import treq
 from twisted.internet import defer
 
 from bobby import cass
-from bobby.ele import MaasClient
+from bobby.cache import ReadCache
+from bobby.concurrency import TenantLimiter
+from bobby.ele import MaasClient, PRIORITY_BULK, PRIORITY_NORMAL
+from bobby.execution import ExecutionTracker
+from bobby.quorum import QuorumTracker
+
+
+class PartialFailureError(Exception):
+    """Exception raised when an operation fails for only some of its items.
+
+    :ivar failures: A dict mapping the id of each item that failed to its
+        :class:`twisted.python.failure.Failure`.
+    """
+    def __init__(self, operation, failures):
+        super(PartialFailureError, self).__init__(
+            '{0} failed for: {1}'.format(operation, ', '.join(sorted(failures))))
+        self.failures = failures
+
+
+def _gather_all(deferreds):
+    """
+    Wait for every one of a dict of Deferreds, rather than stopping at the first failure.
+
+    :param deferreds: A dict mapping item ids to Deferreds.
+    :return: A Deferred that fires with a tuple of two dicts: the results of
+        the items that succeeded, and the failures of those that didn't.
+    """
+    ids = deferreds.keys()
+    d = defer.DeferredList([deferreds[item_id] for item_id in ids], consumeErrors=True)
+
+    def collect(results):
+        successes = {}
+        failures = {}
+        for item_id, (success, result) in zip(ids, results):
+            if success:
+                successes[item_id] = result
+            else:
+                failures[item_id] = result
+        return successes, failures
+    return d.addCallback(collect)
+
+
+def _gather(deferreds):
+    """Wait for a list of Deferreds, failing with the first one that fails."""
+    d = defer.gatherResults(deferreds, consumeErrors=True)
+    return d.addErrback(lambda f: f.trap(defer.FirstError) and f.value.subFailure)
+
+
+def _raise_failures(operation, (successes, failures)):
+    """Fail with a :class:`PartialFailureError` if anything failed."""
+    if failures:
+        return defer.fail(PartialFailureError(operation, failures))
+    return successes
 
 
 class BobbyWorker(object):
-    """Worker for doing tasks."""
+    """Worker for doing tasks.
 
-    def __init__(self, db):
+    MaaS work fanned out over many servers or policies goes through a
+    :class:`bobby.concurrency.TenantLimiter`, so a large group can't flood
+    MaaS with requests.
+
+    Groups and their policies are read through a :class:`bobby.cache.ReadCache`,
+    which is invalidated whenever a group is created or deleted here.
+
+    Policy executions go through a :class:`bobby.execution.ExecutionTracker`,
+    so a policy isn't executed again while it is cooling down.
+
+    MaaS clients are made for the monitoring endpoint in ``service_catalog``,
+    and share a pool of up to ``maas_pool_size`` persistent connections to it,
+    closed after ``maas_idle_timeout`` seconds idle.  Requests to it are sent
+    at up to ``maas_request_rate`` a second, in bursts of up to ``maas_burst``.
+    Applying a new policy across a group is bulk work, so its requests wait
+    behind everything else queued for MaaS.
+    """
+
+    def __init__(self, db, quorum=None, limiter=None, cache=None, executions=None,
+                 service_catalog=None, maas_pool_size=None, maas_idle_timeout=None,
+                 maas_request_rate=None, maas_burst=None):
         self._db = db
+        self._quorum = quorum or QuorumTracker(db)
+        self._limiter = limiter or TenantLimiter()
+        self._cache = cache or ReadCache(db)
+        self._executions = executions or ExecutionTracker()
+        self._service_catalog = service_catalog or {}
+        self._maas_pool_size = maas_pool_size
+        self._maas_idle_timeout = maas_idle_timeout
+        self._maas_request_rate = maas_request_rate
+        self._maas_burst = maas_burst
 
-    def _get_maas_client(self):
+    def _get_maas_client(self, priority=PRIORITY_NORMAL):
         # TODO: get the service catalog and auth token.
-        return MaasClient({}, 'abc')
+        return MaasClient(self._service_catalog, 'abc', priority,
+                          max_per_host=self._maas_pool_size,
+                          idle_timeout=self._maas_idle_timeout,
+                          request_rate=self._maas_request_rate,
+                          burst=self._maas_burst)
 
     def create_group(self, tenant_id, group_id):
         """Create a group, and register a notification and notification plan."""
@@ -29,6 +115,11 @@ class BobbyWorker(object):
                 self._db, tenant_id, group_id, notification, notification_plan)
         d.addCallback(create_group_in_db)
 
+        def invalidate(group):
+            self._cache.invalidate_group(tenant_id, group_id)
+            return group
+        d.addCallback(invalidate)
+
         return d
 
     def delete_group(self, tenant_id, group_id):
@@ -44,6 +135,11 @@ class BobbyWorker(object):
             return cass.delete_group(self._db, tenant_id, group_id)
         d.addCallback(delete_group_from_db)
 
+        def invalidate(result):
+            self._cache.invalidate_group(tenant_id, group_id)
+            return result
+        d.addCallback(invalidate)
+
         return d
 
     def create_server(self, tenant_id, group_id, server):
@@ -55,85 +151,323 @@ class BobbyWorker(object):
             return cass.create_server(self._db, tenant_id, server.get('id'), entity_id, group_id)
         d.addCallback(create_server_record)
 
-        def get_server(_):
-            return cass.get_server_by_server_id(server.get('id'))
-        d.addCallback(get_server)
-
         def apply_policies(server):
-            return self.apply_policies_to_server(
+            d = self.apply_policies_to_server(
                 tenant_id, group_id, server['serverId'], server['entityId'])
+            return d.addCallback(lambda _: server)
+        return d.addCallback(apply_policies)
+
+    def create_servers(self, tenant_id, group_id, servers):
+        """Create many servers in a group, registering them with MaaS.
+
+        The group and its policies are read once, the entities and every
+        policy's checks and alarms are created in MaaS through the limiter,
+        and the servers and serverpolicies are written in batches.
+
+        A server that one of the policies couldn't be applied to is still
+        recorded, but is reported as failed along with those whose entity
+        couldn't be created.
+
+        :param servers: A list of server dicts, as provided by nova.
+        :return: A Deferred that fires with a tuple of two dicts: the server
+            dicts of the servers that were created, and the failures of those
+            that weren't, both keyed by server id.
+        """
+        maas_client = self._get_maas_client()
+        group = []
+        d = self._cache.get_group_by_id(tenant_id, group_id)
+
+        def get_policies(_group):
+            group.append(_group)
+            return self._cache.get_policies_by_group_id(group_id)
+        d.addCallback(get_policies)
+
+        def create_entities(policies):
+            deferreds = dict(
+                (server['id'],
+                 self._limiter.run(tenant_id, maas_client.create_entity, server))
+                for server in servers
+            )
+            d = _gather_all(deferreds)
+            return d.addCallback(lambda results: (policies, results))
+        d.addCallback(create_entities)
+
+        def create_server_records((policies, (entities, failures))):
+            d = cass.create_servers(self._db, tenant_id, group_id, entities.items())
+            return d.addCallback(
+                lambda created: (policies, dict((s['serverId'], s) for s in created), failures))
+        d.addCallback(create_server_records)
+
+        def apply_policies((policies, created, failures)):
+            deferreds = [
+                self._apply_policy_to_servers(
+                    tenant_id, policy['policyId'], created.values(),
+                    policy['checkTemplate'], policy['alarmTemplate'],
+                    group[0]['notificationPlan'])
+                for policy in policies
+            ]
+            d = _gather(deferreds)
+
+            def collect(results):
+                for _, policy_failures in results:
+                    failures.update(policy_failures)
+                return (dict((server_id, server) for server_id, server in created.items()
+                             if server_id not in failures),
+                        failures)
+            return d.addCallback(collect)
         return d.addCallback(apply_policies)
 
     def delete_server(self, tenant_id, group_id, server_id):
-        """ Clean up a server's records """
+        """ Clean up a server's records
+
+        Deleting the server's entity in MaaS deletes its checks and alarms
+        too, and :func:`bobby.cass.delete_server` cascades to its
+        serverpolicies.  A server that is already gone is not an error, so a
+        delete that failed part way can be retried.
+        """
         d = cass.get_server_by_server_id(self._db, tenant_id, group_id, server_id)
 
         def delete_entity(result):
             maas_client = self._get_maas_client()
             d = maas_client.delete_entity(result['entityId'])
             return d
-        d.addCallback(delete_entity)
+        d.addCallbacks(delete_entity, lambda f: f.trap(cass.ResultNotFoundError) and None)
 
         def delete_server_from_db(_):
-            return cass.delete_server(self._db, tenant_id, group_id, server_id)
+            return cass.delete_server(self._db, tenant_id, group_id, server_id, self._quorum)
         d.addCallback(delete_server_from_db)
 
         return d
 
+    def delete_servers(self, tenant_id, group_id, server_ids):
+        """Delete many servers in a group, and their entities in MaaS.
+
+        The servers are read with IN queries, and their entities are deleted
+        through the limiter.  The serverpolicies of the deleted servers are
+        read from their serverpolicies_by_server partitions and grouped by
+        policy, and then they and the servers are deleted in batches.
+        Deleting an entity deletes its checks and alarms in MaaS too.
+
+        As with :meth:`delete_server`, a server that is already gone is not an
+        error, so a bulk delete that failed part way can be retried.
+
+        :param server_ids: A list of server ids.
+        :return: A Deferred that fires with a tuple of two dicts: the server
+            dicts of the servers that were deleted (None for those that were
+            already gone), and the failures of those that weren't, both keyed
+            by server id.
+        """
+        maas_client = self._get_maas_client()
+        d = cass.get_servers_by_server_ids(self._db, group_id, server_ids)
+
+        def delete_entities(servers):
+            servers = dict((server['serverId'], server) for server in servers)
+            deferreds = dict(
+                (server_id,
+                 self._limiter.run(tenant_id, maas_client.delete_entity, servers[server_id]['entityId'])
+                 if server_id in servers else
+                 defer.succeed(None))
+                for server_id in server_ids
+            )
+            d = _gather_all(deferreds)
+            return d.addCallback(
+                lambda (deleted, failures): (
+                    dict((server_id, servers.get(server_id)) for server_id in deleted), failures))
+        d.addCallback(delete_entities)
+
+        def deregister_policies((deleted, failures)):
+            d = _gather([cass.get_serverpolicies_by_server_id(self._db, group_id, server_id)
+                         for server_id in deleted])
+
+            def deregister_all(results):
+                by_policy = {}
+                for serverpolicies in results:
+                    for serverpolicy in serverpolicies:
+                        by_policy.setdefault(serverpolicy['policyId'], []).append(serverpolicy)
+                return _gather([
+                    cass.deregister_policy_on_servers(self._db, policy_id, serverpolicies, self._quorum)
+                    for policy_id, serverpolicies in by_policy.items()])
+
+            d.addCallback(deregister_all)
+            d.addCallback(lambda _: cass.delete_servers(self._db, group_id, deleted.keys()))
+            return d.addCallback(lambda _: (deleted, failures))
+        return d.addCallback(deregister_policies)
+
     def apply_policies_to_server(self, tenant_id, group_id, server_id, entity_id):
         """ Apply policies to a new server """
         group = []
-        d = cass.get_group_by_id(self._db, tenant_id, group_id)
+        d = self._cache.get_group_by_id(tenant_id, group_id)
 
         def get_policies(_group):
             group.append(_group)
-            return cass.get_policies_by_group_id(self._db, group_id)
+            return self._cache.get_policies_by_group_id(group_id)
         d.addCallback(get_policies)
 
         def proc_policies(policies):
-            deferreds = [
-                self.add_policy_to_server(
-                    tenant_id, policy['policyId'], server_id, entity_id,
-                    policy['checkTemplate'], policy['alarmTemplate'],
-                    group[0]['notificationPlan'])
+            deferreds = dict(
+                (policy['policyId'],
+                 self._limiter.run(
+                     tenant_id, self.add_policy_to_server,
+                     tenant_id, policy['policyId'], server_id, entity_id,
+                     policy['checkTemplate'], policy['alarmTemplate'],
+                     group[0]['notificationPlan']))
                 for policy in policies
-            ]
-            return defer.gatherResults(deferreds, consumeErrors=False)
+            )
+            d = _gather_all(deferreds)
+            return d.addCallback(
+                partial(_raise_failures, 'Applying policies to server {0}'.format(server_id)))
         d.addCallback(proc_policies)
         d.addCallback(lambda _: defer.succeed(None))
         return d
 
     def apply_policy(self, tenant_id, group_id, policy_id, check_template, alarm_template, nplan_id):
-        """Apply a new policy accross a group of servers"""
-        d = cass.get_servers_by_group_id(self._db, tenant_id, group_id)
+        """Apply a new policy accross a group of servers.
+
+        The group's servers are read a page at a time.  For each page, the
+        checks and alarms are created in MaaS first, and then every server
+        that succeeded is registered in one batched write.  If any servers
+        failed, the Deferred fails with a :class:`PartialFailureError` naming
+        them, once every page is done.
+        """
+        successes, failures = {}, {}
 
         def proc_servers(servers):
-            deferreds = [
-                self.add_policy_to_server(self._db, tenant_id, policy_id, server['serverId'], server['entityId'],
-                                          check_template, alarm_template, nplan_id)
-                for server in servers
-            ]
-            return defer.gatherResults(deferreds, consumeErrors=False)
-        d.addCallback(proc_servers)
+            d = self._apply_policy_to_servers(
+                tenant_id, policy_id, servers, check_template, alarm_template, nplan_id,
+                PRIORITY_BULK)
+
+            def collect((page_successes, page_failures)):
+                successes.update(page_successes)
+                failures.update(page_failures)
+            return d.addCallback(collect)
+
+        d = cass.page_servers_by_group_id(self._db, tenant_id, group_id).each(proc_servers)
+        d.addCallback(lambda _: _raise_failures(
+            'Applying policy {0}'.format(policy_id), (successes, failures)))
         d.addCallback(lambda _: None)
         return d
 
+    def _apply_policy_to_servers(self, tenant_id, policy_id, servers, check_template,
+                                 alarm_template, nplan_id, priority=PRIORITY_NORMAL):
+        """Create a policy's checks and alarms on many servers, and register them in one batch.
+
+        :param servers: A list of server dicts.
+        :param priority: The priority of the MaaS requests.
+        :return: A Deferred that fires with the results of :func:`_gather_all`.
+        """
+        deferreds = dict(
+            (server['serverId'],
+             self._limiter.run(
+                 tenant_id, self._add_check_and_alarm,
+                 policy_id, server['entityId'], check_template, alarm_template, nplan_id,
+                 priority))
+            for server in servers
+        )
+        d = _gather_all(deferreds)
+
+        def register_policies((successes, failures)):
+            registrations = [(server_id, alarm_id, check_id)
+                             for server_id, (check_id, alarm_id) in successes.items()]
+            d = cass.register_policy_on_servers(self._db, policy_id, registrations, self._quorum)
+            return d.addCallback(lambda _: (successes, failures))
+        return d.addCallback(register_policies)
+
+    def delete_policy(self, tenant_id, group_id, policy_id, progress=None):
+        """Delete a policy, and its checks and alarms on every server.
+
+        The policy's serverpolicies are read a page at a time.  For each page,
+        the servers' entities are read and their alarms and checks removed
+        from MaaS through the limiter.  Once every page is done, the policy and
+        all its serverpolicies are deleted.  If any server's alarm or check
+        couldn't be removed, nothing is deleted from Cassandra and the
+        Deferred fails with a :class:`PartialFailureError`; removals that
+        already happened are not errors, so the delete can be retried.
+
+        :param progress: A callable taking the number of servers done and the
+            total, called as each server is done.  The total is the policy's
+            quorum count.
+        """
+        maas_client = self._get_maas_client()
+        successes, failures = {}, {}
+        done = []
+
+        def remove(entities, serverpolicy):
+            entity_id = entities.get(serverpolicy['serverId'])
+            if entity_id is None:
+                # The entity went with the server, taking its checks and alarms.
+                return None
+            d = defer.succeed(None)
+            if serverpolicy.get('alarmId') is not None:
+                d.addCallback(lambda _: maas_client.remove_alarm(
+                    entity_id, serverpolicy['alarmId']))
+            if serverpolicy.get('checkId') is not None:
+                d.addCallback(lambda _: maas_client.remove_check(
+                    entity_id, serverpolicy['checkId']))
+            return d
+
+        def remove_page(total, serverpolicies):
+            def report(result):
+                done.append(None)
+                if progress is not None:
+                    progress(len(done), max(total, len(done)))
+                return result
+
+            def remove_all(servers):
+                entities = dict((server['serverId'], server['entityId']) for server in servers)
+                deferreds = dict(
+                    (serverpolicy['serverId'],
+                     self._limiter.run(tenant_id, remove, entities, serverpolicy).addBoth(report))
+                    for serverpolicy in serverpolicies
+                )
+                return _gather_all(deferreds)
+
+            def collect((page_successes, page_failures)):
+                successes.update(page_successes)
+                failures.update(page_failures)
+
+            d = cass.get_servers_by_server_ids(
+                self._db, group_id, [serverpolicy['serverId'] for serverpolicy in serverpolicies])
+            d.addCallback(remove_all)
+            return d.addCallback(collect)
+
+        def remove_from_maas((total, critical)):
+            if progress is not None:
+                progress(0, total)
+            return cass.page_policy_state(self._db, policy_id).each(partial(remove_page, total))
+
+        d = self._quorum.get_counts(policy_id)
+        d.addCallback(remove_from_maas)
+        d.addCallback(lambda _: _raise_failures(
+            'Deleting policy {0}'.format(policy_id), (successes, failures)))
+        return d.addCallback(lambda _: cass.delete_policy(
+            self._db, group_id, policy_id, self._quorum))
+
     def add_policy_to_server(self, tenant_id, policy_id, server_id, entity_id, check_template, alarm_template,
                              nplan_id):
         """Adds a single policy to a server"""
-        maas_client = self._get_maas_client()
+        d = self._add_check_and_alarm(policy_id, entity_id, check_template, alarm_template, nplan_id)
+
+        def register_policy((check_id, alarm_id)):
+            return cass.register_policy_on_server(self._db, policy_id, server_id, alarm_id, check_id,
+                                                  self._quorum)
+        d.addCallback(register_policy)
+        return d
+
+    def _add_check_and_alarm(self, policy_id, entity_id, check_template, alarm_template, nplan_id,
+                             priority=PRIORITY_NORMAL):
+        """Create a policy's check and alarm on an entity, returning their ids."""
+        maas_client = self._get_maas_client(priority)
         d = maas_client.add_check(policy_id, entity_id, check_template)
 
         def add_alarm(check):
             d = maas_client.add_alarm(policy_id, entity_id, nplan_id, check['id'], alarm_template)
             return d.addCallback(lambda alarm: (check['id'], alarm['id']))
-        d.addCallback(add_alarm)
-
-        def register_policy((check_id, alarm_id)):
-            return cass.register_policy_on_server(self._db, policy_id, server_id, alarm_id, check_id)
-        d.addCallback(register_policy)
-        return d
+        return d.addCallback(add_alarm)
 
     def execute_policy(self, policy_id):
+        """Execute a policy, unless it was executed recently."""
+        return self._executions.run(policy_id, self._execute_policy)
+
+    def _execute_policy(self, policy_id):
         d = treq.post('{0}/execute'.format(policy_id))
         return d.addCallback(treq.json_content)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""
+Populates the serverpolicies_by_server table from existing serverpolicies rows.
+
+This only needs to be run once against a keyspace created before
+serverpolicies_by_server existed.  It is safe to run more than once.
+"""
+
+import argparse
+import sys
+
+from cql.connection import connect
+
+
+the_parser = argparse.ArgumentParser(
+    description="Backfill serverpolicies_by_server from serverpolicies.")
+
+the_parser.add_argument(
+    '--keyspace', type=str, default='bobby',
+    help='The name of the keyspace.  Default: bobby')
+
+the_parser.add_argument(
+    '--dry-run', action='store_true',
+    help="If this option is passed, nothing actually gets written to cassandra.")
+
+the_parser.add_argument(
+    '--host', type=str, default='localhost',
+    help='The host of the cluster to connect to. Default: localhost')
+
+the_parser.add_argument(
+    '--port', type=int, default=9160,
+    help='The port of the cluster to connect to. Default: 9160')
+
+the_parser.add_argument(
+    '--verbose', '-v', action='count', default=0, help="How verbose to be")
+
+
+def run(args):
+    """
+    Copy every serverpolicy into serverpolicies_by_server.
+    """
+    if args.verbose > 0:
+        print "Attempting to connect to {0}:{1}".format(args.host, args.port)
+    try:
+        connection = connect(args.host, args.port, keyspace=args.keyspace,
+                             cql_version='3')
+    except Exception as e:
+        print "CONNECTION ERROR: {0}".format(e.message)
+        sys.exit(1)
+
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT "serverId", "policyId", "alarmId", "checkId", state FROM serverpolicies;', {})
+    rows = cursor.fetchall()
+
+    written = 0
+    for server_id, policy_id, alarm_id, check_id, state in rows:
+        if args.verbose > 1:
+            print "{0} -> {1}".format(server_id, policy_id)
+
+        if not args.dry_run:
+            cursor.execute(
+                ' '.join((
+                    'INSERT INTO serverpolicies_by_server',
+                    '("serverId", "policyId", "alarmId", "checkId", state)',
+                    'VALUES (:serverId, :policyId, :alarmId, :checkId, :state);')),
+                {'serverId': server_id,
+                 'policyId': policy_id,
+                 'alarmId': alarm_id,
+                 'checkId': check_id,
+                 'state': state})
+        written += 1
+
+    if args.verbose > 0:
+        print '\n----\n'
+        print "Done.  {0} of {1} serverpolicies backfilled.  Disconnecting.".format(
+            written, len(rows))
+
+    cursor.close()
+    connection.close()
+
+
+args = the_parser.parse_args()
+run(args)
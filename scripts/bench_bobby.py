@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+"""
+Load-tests the bobby API end to end.
+
+The Bobby app is served over HTTP on a local port, backed by an in-memory
+Cassandra (bobby.fake_cql) and a local fake MaaS (bobby.fake_maas), each
+with a configurable latency; MaaS can also be given a rate limit and an
+error rate, and bobby's own rate for MaaS requests can be set.  These
+workloads are then driven against it:
+
+* scale-up: a burst of servers created in a group that has policies, each
+  of which gets an entity, and a check and an alarm for every policy.
+* fan-out: a new policy applied across every server in the group.
+* alarm storm: a flood of alarm state changes, many to the same alarms.
+
+For each endpoint the p50 and p99 latency and requests per second are
+reported.  Policy executions aren't wired up to otter yet, so alarm changes
+that would execute a policy are counted as failed by the alarm queue.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+import treq
+from twisted.internet import defer, reactor
+from twisted.web.client import HTTPConnectionPool
+from twisted.web.server import Site
+
+from bobby import ele
+from bobby.fake_cql import FakeCQLClient
+from bobby.fake_maas import FakeMaaS
+from bobby.views import Bobby
+
+
+TENANT = '101010'
+GROUP = 'group-bench'
+
+the_parser = argparse.ArgumentParser(description="Load-test the bobby API.")
+
+the_parser.add_argument(
+    '--servers', type=int, default=200,
+    help='The number of servers to create in the scale-up burst.  Default: 200')
+
+the_parser.add_argument(
+    '--policies', type=int, default=2,
+    help='The number of policies the group has before the burst.  Default: 2')
+
+the_parser.add_argument(
+    '--alarms', type=int, default=2000,
+    help='The number of alarm state changes in the storm.  Default: 2000')
+
+the_parser.add_argument(
+    '--concurrency', type=int, default=20,
+    help='How many requests to have in flight at once.  Default: 20')
+
+the_parser.add_argument(
+    '--db-latency', type=float, default=1.0,
+    help='Milliseconds each Cassandra query takes.  Default: 1.0')
+
+the_parser.add_argument(
+    '--maas-latency', type=float, default=20.0,
+    help='Milliseconds each MaaS request takes.  Default: 20.0')
+
+the_parser.add_argument(
+    '--maas-rate-limit', type=int, default=None,
+    help='Requests per second MaaS allows before answering 429.  Default: no limit')
+
+the_parser.add_argument(
+    '--maas-error-rate', type=float, default=0,
+    help='The fraction of MaaS requests that fail with a 500.  Default: 0')
+
+the_parser.add_argument(
+    '--maas-request-rate', type=float, default=ele.REQUESTS_PER_SECOND,
+    help='Requests per second bobby sends MaaS.  Default: {0}'.format(ele.REQUESTS_PER_SECOND))
+
+the_parser.add_argument(
+    '--maas-burst', type=int, default=ele.BURST,
+    help='Requests bobby may send an idle MaaS at once.  Default: {0}'.format(ele.BURST))
+
+the_parser.add_argument(
+    '--alarm-window', type=float, default=0.5,
+    help='Seconds bobby coalesces changes to an alarm for.  Default: 0.5')
+
+
+def percentile(values, p):
+    """The p-th percentile of a list of values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+class Recorder(object):
+    """Times requests, by endpoint."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.elapsed = {}
+
+    def time(self, endpoint, f, *args, **kwargs):
+        """Call ``f``, recording how long its Deferred takes and whether it failed."""
+        start = time.time()
+        d = f(*args, **kwargs)
+
+        def done(result):
+            self.latencies.setdefault(endpoint, []).append(time.time() - start)
+            return result
+
+        def failed(failure):
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return d.addBoth(done).addErrback(failed)
+
+    @defer.inlineCallbacks
+    def run(self, endpoint, calls, concurrency):
+        """Time a list of ``(f, args)`` calls, ``concurrency`` at a time."""
+        semaphore = defer.DeferredSemaphore(concurrency)
+        start = time.time()
+        yield defer.gatherResults([semaphore.run(self.time, endpoint, f, *args)
+                                   for f, args in calls])
+        self.elapsed[endpoint] = self.elapsed.get(endpoint, 0) + time.time() - start
+
+    def report(self):
+        """Print the latencies and throughput of each endpoint."""
+        for endpoint in sorted(self.latencies):
+            latencies = self.latencies[endpoint]
+            print "{0}: {1} requests, {2} errors, {3:.1f} req/s".format(
+                endpoint, len(latencies), self.errors.get(endpoint, 0),
+                len(latencies) / self.elapsed[endpoint])
+            print "    p50 {0:.2f}ms  p99 {1:.2f}ms".format(
+                percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000)
+
+
+class Client(object):
+    """Makes requests to the bobby API."""
+
+    def __init__(self, url):
+        self._url = url
+        self._pool = HTTPConnectionPool(reactor, persistent=True)
+        self._pool.maxPersistentPerHost = 100
+
+    def request(self, method, path, body=None, codes=(200, 201, 202, 204)):
+        """Make a request, failing unless it gets one of ``codes``."""
+        d = treq.request(method, self._url + path, pool=self._pool,
+                         data=json.dumps(body) if body is not None else None)
+
+        def check(response):
+            d = treq.content(response)
+            if response.code not in codes:
+                return d.addCallback(lambda content: defer.fail(
+                    ValueError('{0} {1}: {2} {3}'.format(method, path, response.code, content))))
+            return d
+        return d.addCallback(check)
+
+    def close(self):
+        """Close the client's connections."""
+        return self._pool.closeCachedConnections()
+
+
+def policy_body(i):
+    """The body of a request to create a policy."""
+    return {'policyId': 'policy-{0}'.format(i),
+            'checkTemplate': json.dumps({'type': 'agent.cpu', 'label': 'cpu'}),
+            'alarmTemplate': 'if (metric["usage"] > 90) { return new AlarmStatus(CRITICAL); }'}
+
+
+def server_body(i):
+    """The body of a request to create a server."""
+    return {'server': {'id': 'server-{0}'.format(i),
+                       'label': 'server-{0}'.format(i),
+                       'agent_id': 'agent-{0}'.format(i),
+                       'ip_addresses': {'private0': '10.0.0.{0}'.format(i % 256)},
+                       'metadata': {}}}
+
+
+@defer.inlineCallbacks
+def run(args):
+    """
+    Serve bobby against the fakes, drive each workload and print the results.
+    """
+    db = FakeCQLClient.from_schema(latency=args.db_latency / 1000.0)
+    maas = FakeMaaS(latency=args.maas_latency / 1000.0, rate_limit=args.maas_rate_limit,
+                    error_rate=args.maas_error_rate)
+    maas_port = reactor.listenTCP(0, Site(maas.app.resource()), interface='127.0.0.1')
+    maas_url = 'http://127.0.0.1:{0}'.format(maas_port.getHost().port)
+
+    bobby = Bobby(db, alarm_window=args.alarm_window,
+                  service_catalog=FakeMaaS.service_catalog(maas_url),
+                  maas_request_rate=args.maas_request_rate, maas_burst=args.maas_burst)
+    bobby_port = reactor.listenTCP(0, Site(bobby.app.resource()), interface='127.0.0.1')
+    client = Client('http://127.0.0.1:{0}'.format(bobby_port.getHost().port))
+    recorder = Recorder()
+
+    yield recorder.run('POST /groups', [
+        (client.request, ('POST', '/{0}/groups'.format(TENANT), {'groupId': GROUP}))], 1)
+    yield recorder.run('POST /policies', [
+        (client.request, ('POST', '/{0}/groups/{1}/policies'.format(TENANT, GROUP),
+                          policy_body(i)))
+        for i in range(args.policies)], args.concurrency)
+
+    yield recorder.run('POST /servers (scale-up)', [
+        (client.request, ('POST', '/{0}/groups/{1}/servers'.format(TENANT, GROUP),
+                          server_body(i)))
+        for i in range(args.servers)], args.concurrency)
+
+    policy = policy_body(args.policies)
+    group = db.rows('groups')[0]
+    yield recorder.run('apply_policy (fan-out)', [
+        (bobby._worker.apply_policy,
+         (TENANT, GROUP, policy['policyId'], policy['checkTemplate'], policy['alarmTemplate'],
+          group['notificationPlan']))], 1)
+
+    alarm_ids = [row['alarmId'] for row in db.rows('alarms_by_id')]
+    start = time.time()
+    yield recorder.run('POST /alarm (storm)', [
+        (client.request, ('POST', '/alarm', {
+            'alarm': {'id': random.choice(alarm_ids)},
+            'details': {'state': random.choice(['OK', 'OK', 'OK', 'CRITICAL'])}}))
+        for _ in range(args.alarms)], args.concurrency)
+    yield bobby._alarms.flush()
+    storm = time.time() - start
+
+    recorder.report()
+    alarms = bobby._alarms.metrics()
+    print "alarm storm: {0} received, {1} coalesced, {2} processed, {3} failed in {4:.3f}s".format(
+        alarms['received'], alarms['coalesced'], alarms['processed'], alarms['failed'], storm)
+    maas_metrics = maas.metrics()
+    print "backends: {0} Cassandra queries, {1} MaaS requests ({2} throttled, {3} failed)".format(
+        db.queries, sum(maas_metrics['requests'].values()),
+        sum(maas_metrics['throttled'].values()), sum(maas_metrics['errors'].values()))
+    scheduler = ele.get_scheduler(maas_url)
+    print "scheduler: {0} sent, {1} answered with a 429".format(
+        scheduler.sent, scheduler.throttled)
+    for operation, counts in sorted(ele.retry_stats().items()):
+        print "{0}: {1} retried, {2} found already created, {3} out of retries".format(
+            operation, counts['retried'], counts['found'], counts['exhausted'])
+
+    yield client.close()
+    yield bobby_port.stopListening()
+    yield maas_port.stopListening()
+
+
+def main(args):
+    """Run the load test, recording any failure, and stop the reactor."""
+    d = run(args)
+
+    def failed(f):
+        f.printTraceback()
+        failures.append(f)
+    d.addErrback(failed)
+    d.addBoth(lambda _: reactor.stop())
+
+
+# Parse the arguments before the reactor runs, which would swallow argparse's SystemExit.
+failures = []
+reactor.callWhenRunning(main, the_parser.parse_args())
+reactor.run()
+sys.exit(1 if failures else 0)
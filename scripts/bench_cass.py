@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks bobby.cass against the in-memory Cassandra in bobby.fake_cql.
+
+One policy is registered on --servers servers, and then its quorum is
+counted a page at a time, alarm states are changed and servers' policies
+are looked up.  The time and rate of each step are reported, so the cass
+functions can be benchmarked at sizes no test cluster is kept at.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from twisted.internet import defer, reactor
+
+from bobby import cass
+from bobby.fake_cql import FakeCQLClient
+
+
+the_parser = argparse.ArgumentParser(description="Benchmark bobby.cass on an in-memory Cassandra.")
+
+the_parser.add_argument(
+    '--servers', type=int, default=100000,
+    help='The number of servers to register the policy on.  Default: 100000')
+
+the_parser.add_argument(
+    '--lookups', type=int, default=10000,
+    help='The number of alarm changes and server lookups.  Default: 10000')
+
+the_parser.add_argument(
+    '--page-size', type=int, default=cass.PAGE_SIZE,
+    help='Rows per page when counting the quorum.  Default: {0}'.format(cass.PAGE_SIZE))
+
+
+@defer.inlineCallbacks
+def timed(name, count, f, *args):
+    """Run ``f(*args)`` and print how long it took for ``count`` operations."""
+    start = time.time()
+    result = yield f(*args)
+    elapsed = time.time() - start
+    print "{0}: {1} in {2:.3f}s, {3:.0f}/s".format(name, count, elapsed, count / elapsed)
+    defer.returnValue(result)
+
+
+def each(f, items):
+    """Call ``f`` on each item in turn."""
+    return defer.gatherResults([f(item) for item in items])
+
+
+@defer.inlineCallbacks
+def run(args):
+    """
+    Run each step and print the results.
+    """
+    db = FakeCQLClient.from_schema()
+    registrations = [('server-{0:08d}'.format(i), 'alarm-{0:08d}'.format(i),
+                      'check-{0:08d}'.format(i)) for i in range(args.servers)]
+
+    yield timed('register_policy_on_servers', args.servers,
+                cass.register_policy_on_servers, db, 'policy-abc', registrations)
+
+    counts = yield timed('count_policy_states', args.servers,
+                         cass.count_policy_states, db, 'policy-abc', args.page_size)
+    print "    (total, critical) = {0}".format(counts)
+
+    sample = random.sample(registrations, min(args.lookups, args.servers))
+    yield timed('alter_alarm_state', len(sample), each,
+                lambda (server_id, alarm_id, check_id): cass.alter_alarm_state(
+                    db, alarm_id, 'OK'), sample)
+    yield timed('get_serverpolicies_by_server_id', len(sample), each,
+                lambda (server_id, alarm_id, check_id): cass.get_serverpolicies_by_server_id(
+                    db, 'group-abc', server_id), sample)
+    yield timed('get_quorum_counts', 1, cass.get_quorum_counts, db, 'policy-abc')
+    print "{0} queries".format(db.queries)
+
+
+def main(args):
+    """Run the benchmark, recording any failure, and stop the reactor."""
+    d = run(args)
+
+    def failed(f):
+        f.printTraceback()
+        failures.append(f)
+    d.addErrback(failed)
+    d.addBoth(lambda _: reactor.stop())
+
+
+# Parse the arguments before the reactor runs, which would swallow argparse's SystemExit.
+failures = []
+reactor.callWhenRunning(main, the_parser.parse_args())
+reactor.run()
+sys.exit(1 if failures else 0)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks bulk server creation through bobby.cass.create_server.
+
+Each query against the fake database takes --latency milliseconds, which
+stands in for a round trip to Cassandra.  Servers are created with and
+without reading the new row back, and the latency of each mode is reported.
+"""
+
+import argparse
+import sys
+import time
+
+from twisted.internet import defer, reactor, task
+
+from bobby import cass
+
+
+the_parser = argparse.ArgumentParser(description="Benchmark bulk server creation.")
+
+the_parser.add_argument(
+    '--servers', type=int, default=1000,
+    help='The number of servers to create.  Default: 1000')
+
+the_parser.add_argument(
+    '--concurrency', type=int, default=50,
+    help='How many servers to create at once.  Default: 50')
+
+the_parser.add_argument(
+    '--latency', type=float, default=2.0,
+    help='Milliseconds each query takes.  Default: 2.0')
+
+
+class LatentDB(object):
+    """A database whose queries all take a fixed time."""
+
+    def __init__(self, latency):
+        self._latency = latency
+        self.queries = 0
+
+    def execute(self, query, params, consistency):
+        """Answer a query after the latency has passed."""
+        self.queries += 1
+        if query.startswith('SELECT'):
+            result = [params]
+        else:
+            result = None
+        return task.deferLater(reactor, self._latency, lambda: result)
+
+
+@defer.inlineCallbacks
+def create_servers(db, count, concurrency, verify):
+    """Create ``count`` servers, returning the latency of each."""
+    latencies = []
+    semaphore = defer.DeferredSemaphore(concurrency)
+
+    def create(i):
+        start = time.time()
+        d = cass.create_server(db, '101010', 'server-{0}'.format(i),
+                               'entity-{0}'.format(i), 'group-abc', verify=verify)
+        return d.addCallback(lambda _: latencies.append(time.time() - start))
+
+    yield defer.gatherResults([semaphore.run(create, i) for i in range(count)])
+    defer.returnValue(latencies)
+
+
+def percentile(values, p):
+    """The p-th percentile of a list of values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+@defer.inlineCallbacks
+def run(args):
+    """
+    Create servers in each mode and print the results.
+    """
+    for verify in (True, False):
+        db = LatentDB(args.latency / 1000.0)
+        start = time.time()
+        latencies = yield create_servers(db, args.servers, args.concurrency, verify)
+        elapsed = time.time() - start
+
+        print "{0}: {1} servers, {2} queries, {3:.3f}s total, {4:.1f} servers/s".format(
+            'read-back' if verify else 'no read-back',
+            args.servers, db.queries, elapsed, args.servers / elapsed)
+        print "    p50 {0:.2f}ms  p99 {1:.2f}ms".format(
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000)
+
+
+def main(args):
+    """Run the benchmark, recording any failure, and stop the reactor."""
+    d = run(args)
+
+    def failed(f):
+        f.printTraceback()
+        failures.append(f)
+    d.addErrback(failed)
+    d.addBoth(lambda _: reactor.stop())
+
+
+# Parse the arguments before the reactor runs, which would swallow argparse's SystemExit.
+failures = []
+reactor.callWhenRunning(main, the_parser.parse_args())
+reactor.run()
+sys.exit(1 if failures else 0)